@@ -70,6 +70,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'testapp.middleware.ShadowGeometryMiddleware',
 ]
 
 ROOT_URLCONF = 'ca_project.urls'
@@ -103,6 +104,22 @@ REST_FRAMEWORK = {
 }
 
 
+# Caches
+# 'recommendations' is shared by all workers on the host so
+# `manage.py warm_county_recommendations` can pre-fill it.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "recommendations": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache" / "recommendations",
+        "TIMEOUT": 3600,
+    },
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -116,6 +133,11 @@ DATABASES = {
         "PASSWORD": os.getenv("DATABASE_PASSWORD"),
         "HOST": os.getenv("DATABASE_HOST", "localhost"),
         "PORT": os.getenv("DATABASE_PORT", "5432"),
+        "TEST": {
+            # The migrations expect the tables ogr2ogr imports; the test
+            # database is built from the models instead (see testapp/tests.py)
+            "MIGRATE": False,
+        },
     }
 }
 
@@ -209,3 +231,92 @@ area["name"="Ireland"]->.searchArea;
 );
 out center;
 """
+
+# In-memory spatial index settings (testapp/spatial_index.py)
+SPATIAL_INDEX_CELL_KM = 5
+# How often each worker re-reads dataset versions to detect new data
+DATASET_VERSION_CHECK_SECONDS = 5
+
+# Recommendation engine: 'index' (in-memory spatial index) or 'sql'
+# (one set-based PostGIS statement per request)
+RECOMMENDATION_ENGINE = os.getenv('RECOMMENDATION_ENGINE', 'index')
+
+# County recommendation cache (testapp/result_cache.py)
+RECOMMENDATION_CACHE_ALIAS = 'recommendations'
+RECOMMENDATION_CACHE_SIZE = 512
+RECOMMENDATION_CACHE_TTL = 3600
+# Distances are snapped to the sidebar input step before caching
+RECOMMENDATION_CACHE_QUANTUM_KM = 0.1
+
+# Background recommendation jobs (testapp/jobs.py), per worker process
+RECOMMENDATION_JOB_WORKERS = 2
+RECOMMENDATION_JOB_MAX_QUEUED = 20
+# Longest a GET may long-poll with ?wait= (it holds a request thread)
+RECOMMENDATION_JOB_MAX_WAIT_SECONDS = 10
+# Seconds between the owning worker's heartbeats on its queued/running jobs
+RECOMMENDATION_JOB_HEARTBEAT_SECONDS = 15
+# Jobs whose heartbeat is older than this are failed (their worker has died)
+RECOMMENDATION_JOB_STALE_SECONDS = 120
+# Finished jobs older than this are deleted
+RECOMMENDATION_JOB_RETENTION_SECONDS = 86400
+
+# Batch recommendations (testapp/batch.py); fewer than 2 threads
+# evaluates every area on the request's own thread
+RECOMMENDATION_BATCH_THREADS = 4
+RECOMMENDATION_BATCH_MAX_AREAS = 50
+
+# Largest hexagonal candidate grid (testapp/hex_grid.py) one request may build
+HEX_GRID_MAX_CELLS = 250000
+
+# Batch nearest-car-wash endpoint limits (/api/nearest_batch/)
+NEAREST_BATCH_MAX_POINTS = 50000
+NEAREST_BATCH_MAX_K = 10
+# Points read and answered at a time for NDJSON batches
+NEAREST_BATCH_CHUNK_SIZE = 1000
+
+# Route corridor search (testapp/route_corridor.py): the route is matched
+# in pieces of this length so each ST_DWithin gets a tight index box
+ROUTE_CORRIDOR_SEGMENT_KM = 5
+ROUTE_CORRIDOR_MAX_WIDTH_KM = 10
+ROUTE_CORRIDOR_MAX_POINTS = 20000
+
+# Geohash cell cache for nearest/nearby/competition (testapp/geo_cache.py).
+# Precision 6 cells are about 1.2km x 0.6km
+GEO_CACHE_PRECISION = 6
+GEO_CACHE_SIZE = 4096
+GEO_CACHE_TTL = 3600
+
+# Largest competitor-density heatmap (testapp/competition_grid.py), and
+# the largest radius in cells
+COMPETITION_GRID_MAX_CELLS = 100000
+COMPETITION_GRID_MAX_RADIUS_CELLS = 100
+
+# Rows per server-side cursor fetch when streaming GeoJSON (testapp/geojson_stream.py)
+GEOJSON_STREAM_CHUNK_SIZE = 2000
+
+# Vector tiles (testapp/vector_tiles.py). Tiles up to TILE_CACHE_MAX_ZOOM
+# are kept on disk; refresh_tiles pre-renders up to TILE_SEED_MAX_ZOOM
+TILE_CACHE_DIR = BASE_DIR / "cache" / "tiles"
+TILE_MAX_ZOOM = 18
+TILE_CACHE_MAX_ZOOM = 14
+TILE_SEED_MAX_ZOOM = 8
+
+# Precompressed carwashes.geojson / counties.geojson (testapp/geojson_snapshots.py)
+GEOJSON_SNAPSHOT_DIR = BASE_DIR / "cache" / "geojson"
+
+# Car wash map zooms answered with clusters rather than single car washes
+# (testapp/carwash_clusters.py)
+CARWASH_CLUSTER_MAX_ZOOM = 11
+
+# Binary point layers for the mobile app (testapp/point_layers.py); one
+# row group per grid cell of this size
+POINT_LAYER_DIR = BASE_DIR / "cache" / "points"
+POINT_LAYER_CELL_DEG = 0.25
+
+# County levels of detail (testapp/county_topology.py): simplification
+# tolerance per level in degrees, coarsest first, and the coordinate grid
+COUNTY_LOD_TOLERANCES = (0.02, 0.005, 0.001, 0.0002)
+COUNTY_TOPOLOGY_QUANTISATION = 100000
+
+# ST_Subdivide vertex limit for the county_pieces table
+COUNTY_PIECE_MAX_VERTICES = 256
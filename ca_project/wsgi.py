@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ca_project.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory spatial indexes once per worker so the first
+# recommendation request does not pay for loading them.
+from testapp.spatial_index import warm_indexes  # noqa: E402
+
+warm_indexes()
@@ -3,7 +3,7 @@ from django.contrib import admin
 from .models import Location, TestArea, IrishCounty
 from django.contrib.gis.admin import OSMGeoAdmin
 from .models import Location
-from .osm_import import replace_carwashes_from_overpass
+from .osm_import import carwashes_changed, replace_carwashes_from_overpass
 
 # Register your models here.
 admin.site.register(TestArea)
@@ -39,6 +39,19 @@ class LocationAdmin(admin.ModelAdmin):
     search_fields = ("name", "addr_city", "addr_postcode", "brand", "operator")
     actions = ["refresh_from_osm"]
 
+    # Manual edits invalidate the spatial indexes and derived tables too
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        carwashes_changed()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        carwashes_changed()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        carwashes_changed()
+
     def refresh_from_osm(self, request, queryset):
         """
         Admin action: fetch latest car washes from OSM Overpass
@@ -4,15 +4,25 @@ from . import api_views
 urlpatterns = [
     path('nearest/', api_views.nearest_carwash_api),
     path('nearby/', api_views.nearby_carwashes_api),
+    path('nearest_batch/', api_views.nearest_carwashes_batch_api),
+    path('route/', api_views.route_carwashes_api),
     path('carwashes/', api_views.carwash_geojson_api),
     path('counties/', api_views.counties_geojson_api),
+    path('settlements/', api_views.settlements_geojson_api),
+    path('points/<str:layer>.bin', api_views.point_layer_api),
     path('county_wash_counts/', api_views.county_wash_counts_api),
     path('recommend_county/', api_views.recommend_carwash_locations_county_api),
     path('recommend_circle/', api_views.recommend_carwash_locations_circle_api),
     path('recommend_polygon/', api_views.recommend_carwash_locations_polygon_api),
+    path('recommend_batch/', api_views.recommend_carwash_locations_batch_api),
+    path('recommend_coverage/', api_views.recommend_carwash_sites_coverage_api),
+    path('recommend_jobs/', api_views.create_recommendation_job_api),
+    path('recommend_jobs/<uuid:job_id>/', api_views.recommendation_job_api),
     path('recommendations/save/', api_views.save_recommendation_api),
     path('recommendations/', api_views.list_saved_recommendations_api),
     path("weather/", api_views.get_weather),
     path("competition/", api_views.competition_density, name="competition-density"),
+    path("competition_grid/", api_views.competition_grid_api, name="competition-grid"),
+    path("geo_cache_stats/", api_views.geo_cache_stats_api),
     path("mobile_login/", api_views.mobile_login, name="mobile-login"),
 ]
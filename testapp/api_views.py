@@ -1,17 +1,24 @@
 import json
+import itertools
 from ca_project import settings
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import GEOSGeometry
-from .models import IrishCounty, Location, PopulationPoint, SavedRecommendation
-from .serializers import CarwashRecommendationSerializer, CarwashSerializer, IrishCountyGeoSerializer, NearbyCarwashSerializer, CarwashGeoSerializer, SavedRecommendationSerializer
+from .models import IrishCounty, Location, PopulationPoint, RecommendationJob, SavedRecommendation
+from . import (
+    batch, carwash_clusters, competition_grid, county_rollup, county_topology, geo_cache,
+    geojson_snapshots, geojson_stream, hex_grid, jobs, nearest_service, point_layers,
+    recommendations, result_cache, route_corridor, site_optimiser,
+)
+from .spatial_index import carwash_index, settlement_index
+from .serializers import CarwashRecommendationSerializer, CoverageSiteSerializer, RecommendationJobSerializer, IrishCountyGeoSerializer, CarwashGeoSerializer, SavedRecommendationSerializer
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.exceptions import NotAuthenticated
 import requests
-from django.contrib.gis.measure import D
 from django.contrib.auth import authenticate, login
 
 @api_view(['GET'])
@@ -20,7 +27,8 @@ def nearest_carwash_api(request):
     Return the nearest car wash to a given user location.
 
     This endpoint is intended for regular users.
-    It performs a spatial nearest-neighbour query using PostGIS.
+    It is answered from the geohash cell cache (geo_cache.py) over the
+    in-memory car wash index (nearest_service.py).
 
     Query parameters:
     - lat: User latitude
@@ -36,18 +44,15 @@ def nearest_carwash_api(request):
     except (TypeError, ValueError):
         return Response({'error': 'Invalid coordinates'}, status=400)
 
-    user_point = Point(lng, lat, srid=4326)
-
-    nearest = Location.objects.annotate(
-        distance=Distance('point', user_point)
-    ).order_by('distance').first()
+    nearest = geo_cache.nearest_carwashes(lng, lat, k=1)
 
     if not nearest:
         return Response({'location': None})
 
+    distance_km, location = nearest[0]
     return Response({
-        'location': CarwashSerializer(nearest).data,
-        'distance': nearest.distance.km
+        'location': location,
+        'distance': distance_km
     })
 
 @api_view(['GET'])
@@ -56,7 +61,8 @@ def nearby_carwashes_api(request):
     Return a list of nearby car washes ordered by distance.
 
     This endpoint is intended for regular users.
-    It uses spatial distance annotations to return the closest results.
+    It is answered from the geohash cell cache (geo_cache.py) over the
+    in-memory car wash index (nearest_service.py).
 
     Query parameters:
     - lat: User latitude
@@ -72,33 +78,211 @@ def nearby_carwashes_api(request):
     except (TypeError, ValueError):
         return Response({'error': 'Invalid coordinates'}, status=400)
 
-    user_point = Point(lng, lat, srid=4326)
+    carwashes = [
+        dict(fields, distance_km=distance_km)
+        for distance_km, fields in geo_cache.nearest_carwashes(lng, lat, k=10)
+    ]
+    return Response({'carwashes': carwashes})
+
+@api_view(['POST'])
+def nearest_carwashes_batch_api(request):
+    """
+    Return the k nearest car washes for many points in one request.
+
+    Body, either:
+    - JSON: {"points": [[lat, lng], ...]} (or {"lat": .., "lng": ..} objects)
+    - NDJSON (Content-Type: application/x-ndjson): one point per line;
+      the response is then streamed back as NDJSON too, one line per point.
+      The body is read and answered NEAREST_BATCH_CHUNK_SIZE points at a
+      time, so memory stays bounded however many points are sent. A
+      malformed point after the first chunk cannot turn the response into
+      a 400 any more; it ends the stream with an {"error": ...} line.
+
+    Query parameters:
+    - k: car washes per point (default 1)
+
+    Returns:
+    - One {"lat", "lng", "carwashes": [... with distance_km]} per point,
+      in input order
+    """
+    ndjson = request.content_type.startswith('application/x-ndjson')
+
+    try:
+        k = int(request.GET.get('k', 1))
+        max_k = getattr(settings, 'NEAREST_BATCH_MAX_K', 10)
+        if not 1 <= k <= max_k:
+            raise ValueError(f'k must be between 1 and {max_k}')
+
+        if ndjson:
+            chunks = nearest_service.parse_point_chunks(
+                (json.loads(line) for line in request.stream if line.strip()),
+                getattr(settings, 'NEAREST_BATCH_CHUNK_SIZE', 1000),
+            )
+            # Parse the first chunk now, so an error there is still a 400
+            first = next(chunks, None)
+        else:
+            items = request.data.get('points') if isinstance(request.data, dict) else request.data
+            if not isinstance(items, list):
+                raise ValueError('points must be a list')
+            lngs, lats = nearest_service.parse_points(items)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    def point_results(lngs, lats):
+        results = nearest_service.nearest_carwashes_many(lngs, lats, k)
+        for lng, lat, nearest in zip(lngs, lats, results):
+            yield {
+                'lat': lat,
+                'lng': lng,
+                'carwashes': [dict(fields, distance_km=distance_km) for distance_km, fields in nearest],
+            }
+
+    if ndjson:
+        def lines():
+            if first is None:
+                return
+            try:
+                for lngs, lats in itertools.chain([first], chunks):
+                    for result in point_results(lngs, lats):
+                        yield json.dumps(result) + '\n'
+            except ValueError as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    return Response({'results': list(point_results(lngs, lats))})
+
+@api_view(['GET', 'POST'])
+def route_carwashes_api(request):
+    """
+    Return the car washes along a route, ordered by distance along it.
+
+    This endpoint is intended for regular users ("car washes on my way").
+    Parameters come from the query string (GET) or the JSON body (POST,
+    for routes too long for a URL):
+    - polyline: Encoded polyline of the route
+    - precision (optional): Polyline precision, 5 (default) or 6
+    - width_km (optional): Maximum distance from the route (default 1km)
+
+    Returns:
+    - NDJSON, streamed: one car wash per line with distance_km (from the
+      route) and along_km (from the start)
+    """
+    params = request.data if request.method == 'POST' else request.GET
+
+    try:
+        width_km = float(params.get('width_km', 1))
+        max_width_km = getattr(settings, 'ROUTE_CORRIDOR_MAX_WIDTH_KM', 10)
+        if not 0 < width_km <= max_width_km:
+            raise ValueError(f'width_km must be between 0 and {max_width_km}')
+        points = route_corridor.parse_route(
+            str(params.get('polyline') or ''), int(params.get('precision', 5))
+        )
+    except (TypeError, ValueError) as e:
+        return Response({'error': str(e)}, status=400)
+
+    return StreamingHttpResponse(
+        (json.dumps(carwash) + '\n' for carwash in route_corridor.carwashes_along(points, width_km)),
+        content_type='application/x-ndjson',
+    )
 
-    qs = (
-        Location.objects
-        .annotate(distance=Distance('point', user_point))
-        .order_by('distance')[:10]
+def _stream_geojson(request, model, geometry_field, fields):
+    # Same features as the GeoFeatureModelSerializer; id is the feature id
+    try:
+        precision = geojson_stream.parse_precision(request.GET.get('precision'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    properties = [field for field in fields if field != 'id']
+    return StreamingHttpResponse(
+        geojson_stream.feature_collection(model, geometry_field, properties, precision),
+        content_type='application/json',
     )
 
-    # Attach distance_km dynamically
-    for obj in qs:
-        obj.distance_km = obj.distance.km
+@api_view(['GET'])
+def point_layer_api(request, layer):
+    """
+    Return a point layer in the compact binary format (point_layers.py).
+
+    Intended for the mobile app: coordinates and attributes arrive as typed
+    arrays instead of GeoJSON. Supports single "Range: bytes=" requests, so
+    a client can read the header and then fetch only the row groups of the
+    grid cells it needs.
 
-    serializer = NearbyCarwashSerializer(qs, many=True)
-    return Response({'carwashes': serializer.data})
+    Layers:
+    - carwashes: public
+    - settlements: authenticated users only
+    """
+    if layer not in point_layers.LAYERS:
+        return Response({'error': 'Unknown layer'}, status=404)
+    if layer == 'settlements' and not request.user.is_authenticated:
+        raise NotAuthenticated()
+
+    path, etag = point_layers.current(layer)
+    size = path.stat().st_size
+    byte_range = point_layers.parse_range(request.headers.get('Range'), size)
+    if request.headers.get('If-Range', etag) != etag:
+        byte_range = None
+
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        response = HttpResponse(data, status=206, content_type=point_layers.CONTENT_TYPE)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=point_layers.CONTENT_TYPE)
+
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'public, no-cache'
+    return response
 
 @api_view(['GET'])
 def carwash_geojson_api(request):
     """
-    Return all car wash locations as GeoJSON.
+    Return car wash locations as GeoJSON.
 
     This endpoint is public and used to render
     car wash markers on the Leaflet map.
+    The collection is built by PostGIS and streamed (geojson_stream.py).
+
+    With bbox, only the car washes in the viewport are returned. With a
+    zoom up to CARWASH_CLUSTER_MAX_ZOOM, nearby car washes come back as
+    clusters from a per-worker grid hierarchy (carwash_clusters.py):
+    properties {cluster: true, point_count} at the centroid of the cluster.
+
+    Query parameters:
+    - precision (optional): Coordinate decimal places (default 9)
+    - bbox (optional): min_lng,min_lat,max_lng,max_lat
+    - zoom (optional): Map zoom level
     """
 
-    qs = Location.objects.all()
-    serializer = CarwashGeoSerializer(qs, many=True)
-    return Response(serializer.data)
+    try:
+        precision = geojson_stream.parse_precision(request.GET.get('precision'))
+        bbox = geojson_stream.parse_bbox(request.GET.get('bbox'))
+        zoom = request.GET.get('zoom')
+        zoom = int(zoom) if zoom not in (None, '') else None
+        if zoom is not None and zoom < 0:
+            raise ValueError('zoom must not be negative')
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    if zoom is not None and zoom <= carwash_clusters.max_zoom():
+        return HttpResponse(
+            carwash_clusters.feature_collection(zoom, bbox, precision),
+            content_type='application/json',
+        )
+
+    properties = [field for field in CarwashGeoSerializer.Meta.fields if field != 'id']
+    return StreamingHttpResponse(
+        geojson_stream.feature_collection(Location, 'point', properties, precision, bbox=bbox),
+        content_type='application/json',
+    )
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -108,11 +292,52 @@ def counties_geojson_api(request):
 
     Access is restricted to authenticated users (business mode).
     Used for county-based analysis and visualisation.
+
+    With zoom or tolerance, a precomputed level of detail is served
+    (county_topology.py): shared borders simplified once, coordinates
+    quantised, as TopoJSON by default. Without them the full-resolution
+    collection is built by PostGIS and streamed (geojson_stream.py).
+
+    Query parameters:
+    - zoom (optional): Web map zoom level to simplify for
+    - tolerance (optional): Largest simplification error, in degrees
+    - output (optional): topojson (default) or geojson, with zoom/tolerance
+    - precision (optional): Coordinate decimal places (default 9), full resolution only
+    """
+
+    zoom = request.GET.get('zoom')
+    tolerance = request.GET.get('tolerance')
+    if zoom is None and tolerance is None:
+        return _stream_geojson(request, IrishCounty, 'geom', IrishCountyGeoSerializer.Meta.fields)
+
+    output = request.GET.get('output', 'topojson')
+    try:
+        if output not in ('topojson', 'geojson'):
+            raise ValueError('output must be topojson or geojson')
+        if zoom is not None:
+            lod = county_topology.lod_for_zoom(int(zoom))
+        else:
+            lod = county_topology.lod_for_tolerance(float(tolerance))
+    except (ValueError, OverflowError) as e:
+        return Response({'error': str(e)}, status=400)
+
+    name = geojson_snapshots.lod_name(lod, topojson=output == 'topojson')
+    return geojson_snapshots.snapshot_response(request, name)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def settlements_geojson_api(request):
+    """
+    Return all settlements (population points) as GeoJSON.
+
+    Access is restricted to authenticated users (business mode).
+    The collection is built by PostGIS and streamed (geojson_stream.py).
+
+    Query parameters:
+    - precision (optional): Coordinate decimal places (default 9)
     """
 
-    qs = IrishCounty.objects.all()
-    serializer = IrishCountyGeoSerializer(qs, many=True)
-    return Response(serializer.data)
+    return _stream_geojson(request, PopulationPoint, 'point', ('name', 'population', 'place'))
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -123,21 +348,32 @@ def county_wash_counts_api(request):
     This endpoint supports business analytics visualisations
     such as heatmaps or choropleth maps.
 
+    Optional ?by=brand,operator,self_service breaks the counts down by
+    those tags (one entry per county and combination).
+
+    Counts are read from the precomputed county_wash_rollup table.
+
     Access limited to authenticated users.
     """
 
-    results = []
+    dimensions = [d for d in request.GET.get('by', '').split(',') if d]
 
-    for county in IrishCounty.objects.all():
-        count = Location.objects.filter(
-            point__within=county.geom
-        ).count()
+    try:
+        rows = county_rollup.county_counts(*dimensions)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
 
-        results.append({
-            'id': county.id,
-            'name': county.name_en,
-            'wash_count': count
-        })
+    results = []
+
+    for row in rows:
+        result = {
+            'id': row['county_id'],
+            'name': row['county_name'],
+            'wash_count': row['wash_count']
+        }
+        for dimension in dimensions:
+            result[dimension] = row[dimension]
+        results.append(result)
 
     return Response({'counts': results})
 
@@ -154,6 +390,9 @@ def recommend_carwash_locations_county_api(request):
     - Penalise isolated settlements using nearby settlement counts
     - Rank by distance from car washes, then by population
 
+    With candidates=hex the county is tiled with a hexagonal grid of
+    cell_km cells (default 1) instead, ranked by nearby population.
+
     Access:
     - Restricted to authenticated (business) users
     """
@@ -169,58 +408,21 @@ def recommend_carwash_locations_county_api(request):
 
         if not county_id:
             return Response({'error': 'county_id is required'}, status=400)
-        county = IrishCounty.objects.get(id=county_id)
-
-        # Get all car washes inside the county
-        carwashes = Location.objects.filter(point__within=county.geom)
-        # Get all settlements inside the county
-        settlements = PopulationPoint.objects.filter(point__within=county.geom)
-
-        candidates = []
-
-        # Use settlements as candidate points
-        for settlement in settlements:
-            # Calculate distance to nearest car wash
-            if carwashes.exists():
-                distances = [
-                    settlement.point.distance(cw.point) * 111
-                    for cw in carwashes
-                ]
-                min_dist_km = min(distances)
-            else:
-                min_dist_km = None
-            # Skip if too close to an existing car wash
-            if min_dist_km is not None and min_dist_km < min_distance_km:
-                continue
-            # Count how many other settlements are nearby
-            nearby_settlements = PopulationPoint.objects.filter(
-                point__distance_lte=(
-                    settlement.point,
-                    max_settlement_distance_km / 111
-                )
-            ).count()
-
-            candidates.append({
-                'lat': settlement.point.y,
-                'lng': settlement.point.x,
-                'name': settlement.name,
-                'population': settlement.population,
-                'min_distance_to_carwash_km': min_dist_km,
-                'nearby_settlements': nearby_settlements,
-                'reason': f'Recommended location in {county.name_en}'
-            })
-
-        # Rank by distance first, then population
-        candidates = sorted(
-            candidates,
-            key=lambda x: (
-                x['min_distance_to_carwash_km'] or 0,
-                x['population'] or 0
-            ),
-            reverse=True
-        )
 
-        serializer = CarwashRecommendationSerializer(candidates[:10], many=True)
+        if request.GET.get('candidates') == 'hex':
+            candidates = hex_grid.recommend_county(
+                IrishCounty.objects.get(id=county_id),
+                min_distance_km,
+                max_settlement_distance_km,
+                cell_km=float(request.GET.get('cell_km', hex_grid.DEFAULT_CELL_KM)),
+            )
+        else:
+            # Memoised per (county, quantised distances, dataset version)
+            candidates = result_cache.recommend_county(
+                county_id, min_distance_km, max_settlement_distance_km
+            )
+
+        serializer = CarwashRecommendationSerializer(candidates, many=True)
         return Response({'recommendations': serializer.data})
 
     except IrishCounty.DoesNotExist:
@@ -239,6 +441,9 @@ def recommend_carwash_locations_circle_api(request):
     The circle is defined using latitude, longitude, and radius.
     This endpoint supports flexible business location planning.
 
+    With candidates=hex the circle is tiled with a hexagonal grid of
+    cell_km cells (default 1) instead of using settlements.
+
     Access:
     - Authenticated users only
     """
@@ -253,63 +458,18 @@ def recommend_carwash_locations_circle_api(request):
             request.GET.get('max_settlement_distance_km', 10)
         )
 
-        # Create circular geometry (km → degrees, approx)
-        buffer_deg = radius_km / 111.0
-        center = Point(lng, lat, srid=4326)
-        circle = center.buffer(buffer_deg)
-
-        # Get car washes and settlements inside the circle
-        carwashes = Location.objects.filter(point__within=circle)
-        settlements = PopulationPoint.objects.filter(point__within=circle)
-
-        candidates = []
-
-        for settlement in settlements:
-            # Distance to nearest car wash
-            if carwashes.exists():
-                distances = [
-                    settlement.point.distance(cw.point) * 111
-                    for cw in carwashes
-                ]
-                min_dist_km = min(distances)
-            else:
-                min_dist_km = None
-
-            # Skip candidates too close to existing car washes
-            if min_dist_km is not None and min_dist_km < min_distance_km:
-                continue
-
-            # Count nearby settlements
-            nearby_settlements = PopulationPoint.objects.filter(
-                point__distance_lte=(
-                    settlement.point,
-                    max_settlement_distance_km / 111
-                )
-            ).count()
-
-            candidates.append({
-                'lat': settlement.point.y,
-                'lng': settlement.point.x,
-                'name': settlement.name,
-                'population': settlement.population,
-                'min_distance_to_carwash_km': min_dist_km,
-                'nearby_settlements': nearby_settlements,
-                'reason': 'Recommended location inside selected circle'
-            })
-
-        # Rank candidates
-        candidates = sorted(
-            candidates,
-            key=lambda x: (
-                x['min_distance_to_carwash_km'] or 0,
-                x['population'] or 0
-            ),
-            reverse=True
-        )
-
-        serializer = CarwashRecommendationSerializer(
-            candidates[:10], many=True
-        )
+        if request.GET.get('candidates') == 'hex':
+            candidates = hex_grid.recommend_circle(
+                lng, lat, radius_km, min_distance_km, max_settlement_distance_km,
+                cell_km=float(request.GET.get('cell_km', hex_grid.DEFAULT_CELL_KM)),
+            )
+        else:
+            # Settlements within radius_km (great-circle) of the centre
+            candidates = recommendations.recommend_circle(
+                lng, lat, radius_km, min_distance_km, max_settlement_distance_km
+            )
+
+        serializer = CarwashRecommendationSerializer(candidates, many=True)
         return Response({'recommendations': serializer.data})
 
     except Exception as e:
@@ -324,6 +484,10 @@ def recommend_carwash_locations_polygon_api(request):
 
     This endpoint uses POST because it accepts complex GeoJSON geometry.
     It is intended for advanced business users performing spatial analysis.
+
+    With "candidates": "hex" the polygon is tiled with a hexagonal grid of
+    cell_km cells (default 1) and the best cell is returned, falling back
+    to the settlement recommendation when no cell qualifies.
     """
 
     try:
@@ -337,74 +501,170 @@ def recommend_carwash_locations_polygon_api(request):
 
         min_distance_km = float(data.get('min_distance_km', 5))
 
-        # Get car washes inside polygon
-        carwashes = Location.objects.filter(point__within=polygon)
-        carwash_points = [cw.point for cw in carwashes]
-
-        # Get settlements inside polygon
-        settlements = PopulationPoint.objects.filter(point__within=polygon)
-
-        # If no settlements, return polygon centroid
-        if not settlements.exists():
-            centroid = polygon.centroid
-            return Response({
-                'lat': centroid.y,
-                'lng': centroid.x,
-                'name': 'Polygon Centroid',
-                'population': None,
-                'min_distance_to_carwash_km': None,
-                'nearby_settlements': 0,
-                'reason': 'No settlements inside polygon, using centroid'
-            })
-
-        best_candidate = None
-        best_score = -1
-
-        for settlement in settlements:
-            if carwash_points:
-                dist_km = min(
-                    settlement.point.distance(cw) * 111
-                    for cw in carwash_points
-                )
-                if dist_km < min_distance_km:
-                    continue
-            else:
-                dist_km = None
-
-            score = dist_km or 1000  # simple heuristic
-
-            if score > best_score:
-                best_candidate = settlement
-                best_score = score
-
-        # If a suitable settlement was found
-        if best_candidate:
-            serializer = CarwashRecommendationSerializer({
-                'lat': best_candidate.point.y,
-                'lng': best_candidate.point.x,
-                'name': best_candidate.name,
-                'population': best_candidate.population,
-                'min_distance_to_carwash_km': best_score,
-                'nearby_settlements': settlements.count(),
-                'reason': 'Best settlement inside selected polygon'
-            })
-            return Response(serializer.data)
-
-        # Otherwise, fallback to centroid
-        centroid = polygon.centroid
-        return Response({
-            'lat': centroid.y,
-            'lng': centroid.x,
-            'name': 'Polygon Centroid',
-            'population': None,
-            'min_distance_to_carwash_km': None,
-            'nearby_settlements': settlements.count(),
-            'reason': 'No suitable settlement found, using centroid'
+        result = None
+        if data.get('candidates') == 'hex':
+            result = hex_grid.recommend_polygon(
+                polygon,
+                min_distance_km,
+                float(data.get('max_settlement_distance_km', 10)),
+                cell_km=float(data.get('cell_km', hex_grid.DEFAULT_CELL_KM)),
+            )
+        if result is None:
+            result = recommendations.recommend_polygon(polygon, min_distance_km)
+
+        serializer = CarwashRecommendationSerializer(result)
+        return Response(serializer.data)
+
+    except Exception as e:
+        return Response({'error': str(e)}, status=400)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def recommend_carwash_locations_batch_api(request):
+    """
+    Recommend car wash locations for several areas in one request.
+
+    Body:
+    {
+        "min_distance_km": 5,
+        "max_settlement_distance_km": 10,
+        "areas": [
+            {"type": "county", "id": 3},
+            {"type": "circle", "lat": 53.3, "lng": -6.2, "radius_km": 10},
+            {"type": "polygon", "geometry": {...GeoJSON...}}
+        ]
+    }
+
+    Any area may override min_distance_km / max_settlement_distance_km.
+    Returns {"results": [...]} with one entry per area, in request order.
+    """
+    try:
+        tasks = batch.parse_areas(request.data)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    results = []
+    for (area_type, params), result in zip(tasks, batch.recommend_batch(tasks)):
+        area = {'type': area_type}
+        if area_type == 'county':
+            area['id'] = params['id']
+            area['name'] = params['name']
+        results.append({'area': area, **result})
+
+    return Response({'results': results})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def recommend_carwash_sites_coverage_api(request):
+    """
+    Place k new car washes together so they cover as many people as possible.
+
+    Body:
+    {
+        "area": {"type": "county", "id": 3},   (or a circle / polygon, as in
+                                                 /api/recommend_batch/)
+        "k": 10,
+        "min_distance_km": 5,
+        "max_settlement_distance_km": 10
+    }
+
+    A settlement counts as covered when it is within
+    max_settlement_distance_km of a chosen site or an existing car wash.
+    Candidates closer than min_distance_km to a car wash are skipped.
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Request body must be a JSON object'}, status=400)
+
+    try:
+        k = int(request.data.get('k', 10))
+        if not 1 <= k <= site_optimiser.MAX_SITES:
+            raise ValueError(f'k must be between 1 and {site_optimiser.MAX_SITES}')
+        [task] = batch.parse_areas({
+            'areas': [request.data.get('area')],
+            'min_distance_km': request.data.get('min_distance_km', 5),
+            'max_settlement_distance_km': request.data.get('max_settlement_distance_km', 10),
         })
+    except (TypeError, ValueError) as e:
+        return Response({'error': str(e)}, status=400)
+
+    _, params = task
+    settlements = settlement_index.get()
+    result = site_optimiser.optimise_sites(
+        batch.area_positions(task, settlements),
+        k,
+        coverage_km=params['max_settlement_distance_km'],
+        min_distance_km=params['min_distance_km'],
+        settlements=settlements,
+        carwashes=carwash_index.get(),
+    )
+    result['sites'] = CoverageSiteSerializer(result['sites'], many=True).data
+    return Response(result)
+
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_recommendation_job_api(request):
+    """
+    Run a circle or polygon recommendation in the background.
+
+    The body is {"mode": "circle" | "polygon", ...} plus the parameters of
+    the matching synchronous endpoint. Returns 202 with the job id; poll
+    /api/recommend_jobs/<id>/ for the result.
+
+    Access:
+    - Authenticated users only
+    """
+    mode = request.data.get('mode')
+    if mode not in jobs.MODES:
+        return Response({'error': 'mode must be one of: ' + ', '.join(jobs.MODES)}, status=400)
+
+    try:
+        job = jobs.submit(request.user, mode, request.data)
+    except jobs.QueueFull:
+        return Response({'error': 'Too many recommendation jobs queued, try again shortly'}, status=429)
     except Exception as e:
         return Response({'error': str(e)}, status=400)
 
+    return Response({'job_id': str(job.id), 'status': job.status}, status=202)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def recommendation_job_api(request, job_id):
+    """
+    GET returns a job's status, and its result once done. ?wait=<seconds>
+    holds the request open until the job finishes (long-polling), for at
+    most RECOMMENDATION_JOB_MAX_WAIT_SECONDS. Jobs whose worker died are
+    reported as failed.
+
+    DELETE cancels a queued or running job.
+
+    Users can only see their own jobs.
+    """
+    try:
+        job = RecommendationJob.objects.get(id=job_id, user=request.user)
+    except RecommendationJob.DoesNotExist:
+        return Response({'error': 'Job not found'}, status=404)
+
+    if request.method == 'DELETE':
+        if not jobs.cancel(job):
+            return Response({'error': 'Job already finished'}, status=409)
+        job.refresh_from_db()
+        return Response(RecommendationJobSerializer(job).data)
+
+    try:
+        wait_seconds = float(request.GET.get('wait', 0))
+    except ValueError:
+        return Response({'error': 'wait must be a number of seconds'}, status=400)
+
+    job = jobs.fail_if_stale(job)
+    if wait_seconds > 0:
+        job = jobs.wait(job, wait_seconds)
+
+    return Response(RecommendationJobSerializer(job).data)
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -516,28 +776,65 @@ def competition_density(request):
             status=400
         )
 
-    centre_point = Point(lon, lat, srid=4326)
+    # Same test as ST_DWithin on geom_itm, answered per geohash cell
+    competitor_count = geo_cache.competitor_count(lon, lat, radius_km)
 
-    competitors = Location.objects.filter(
-        point__distance_lte=(centre_point, D(km=radius_km))
-    )
+    return Response({
+        "radius_km": radius_km,
+        "competitor_count": competitor_count,
+        "saturation_level": competition_grid.saturation_level(competitor_count)
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def competition_grid_api(request):
+    """
+    Return a competitor-density heatmap for a bounding box.
 
-    competitor_count = competitors.count()
+    Every cell gets approximately the figures competition_density gives
+    for its centre, computed for the whole grid in one pass
+    (competition_grid.py). Car washes are snapped to the centre of their
+    cell_km cell, so counts can differ for car washes within about
+    0.7 * cell_km of the radius edge.
 
-    # Simple saturation classification
-    if competitor_count <= 3:
-        saturation_level = "Low"
-    elif competitor_count <= 8:
-        saturation_level = "Medium"
-    else:
-        saturation_level = "High"
+    Query parameters:
+    - bbox: min_lng,min_lat,max_lng,max_lat
+    - cell_km (optional): Grid cell size in kilometres (default = 1km)
+    - radius (optional): Search radius in kilometres (default = 3km)
+
+    Returns:
+    - cells: lat, lng (cell centre), competitor_count, saturation_level
+    """
+
+    try:
+        min_lng, min_lat, max_lng, max_lat = (
+            float(value) for value in request.GET.get("bbox", "").split(",")
+        )
+        cell_km = float(request.GET.get("cell_km", competition_grid.DEFAULT_CELL_KM))
+        radius_km = float(request.GET.get("radius", competition_grid.DEFAULT_RADIUS_KM))
+        cells = competition_grid.competition_grid(
+            min_lng, min_lat, max_lng, max_lat, cell_km=cell_km, radius_km=radius_km
+        )
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
 
     return Response({
+        "cell_km": cell_km,
         "radius_km": radius_km,
-        "competitor_count": competitor_count,
-        "saturation_level": saturation_level
+        "cells": cells
     })
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def geo_cache_stats_api(request):
+    """
+    Return this worker's geohash cache hit/miss counters (geo_cache.py).
+
+    Returns:
+    - nearest, competition: hits, misses, hit_ratio and entries
+    """
+    return Response(geo_cache.stats())
+
 @csrf_exempt
 def mobile_login(request):
     """
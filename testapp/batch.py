@@ -0,0 +1,178 @@
+"""
+Batch recommendations: many counties, circles and polygons in one request.
+
+The car wash and settlement indexes are loaded once per request and the
+areas are spread across a thread pool that shares them, so no data is
+copied or re-read per area. The heavy lifting is NumPy and GEOS, which
+release the GIL, so the threads run in parallel. (A process pool would
+have to fork a multithreaded WSGI worker, which can deadlock on locks
+held at fork time.) The pool is kept between requests.
+
+Every area is scored with the in-memory engine (recommendations.py), so
+the results match the single-area endpoints running RECOMMENDATION_ENGINE
+= 'index'. Workers never touch the database.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+
+from . import recommendations
+from .models import IrishCounty
+from .serializers import CarwashRecommendationSerializer
+from .spatial_index import carwash_index, settlement_index
+
+logger = logging.getLogger(__name__)
+
+AREA_TYPES = ('county', 'circle', 'polygon')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_areas(data):
+    """
+    Validate a batch request body and return a list of area tasks.
+
+    Each task is (type, params) where params is plain data (geometries as WKB).
+    Raises ValueError with a message suitable for a 400 response.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    areas = data.get('areas')
+    if not isinstance(areas, list) or not areas:
+        raise ValueError('areas must be a non-empty list')
+
+    max_areas = getattr(settings, 'RECOMMENDATION_BATCH_MAX_AREAS', 50)
+    if len(areas) > max_areas:
+        raise ValueError(f'At most {max_areas} areas per batch')
+
+    try:
+        default_min = float(data.get('min_distance_km', 5))
+        default_max = float(data.get('max_settlement_distance_km', 10))
+    except (TypeError, ValueError):
+        raise ValueError('min_distance_km and max_settlement_distance_km must be numbers')
+
+    tasks = []
+    county_ids = set()
+    for n, area in enumerate(areas):
+        if not isinstance(area, dict) or area.get('type') not in AREA_TYPES:
+            raise ValueError(f'areas[{n}].type must be one of: ' + ', '.join(AREA_TYPES))
+
+        try:
+            params = {
+                'min_distance_km': float(area.get('min_distance_km', default_min)),
+                'max_settlement_distance_km': float(
+                    area.get('max_settlement_distance_km', default_max)
+                ),
+            }
+            if area['type'] == 'county':
+                params['id'] = int(area['id'])
+                county_ids.add(params['id'])
+            elif area['type'] == 'circle':
+                params['lat'] = float(area['lat'])
+                params['lng'] = float(area['lng'])
+                params['radius_km'] = float(area.get('radius_km', 10))
+            else:
+                geometry = GEOSGeometry(json.dumps(area['geometry']), srid=4326)
+                params['wkb'] = bytes(geometry.wkb)
+        except Exception as e:
+            raise ValueError(f'areas[{n}]: {e}')
+        tasks.append((area['type'], params))
+
+    # One query for every county in the batch
+    counties = {
+        county.id: county
+        for county in IrishCounty.objects.filter(id__in=county_ids).only('id', 'name_en', 'geom')
+    }
+    missing = county_ids - set(counties)
+    if missing:
+        raise ValueError('Unknown county ids: ' + ', '.join(str(i) for i in sorted(missing)))
+
+    for area_type, params in tasks:
+        if area_type == 'county':
+            county = counties[params['id']]
+            params['name'] = county.name_en
+            params['wkb'] = bytes(county.geom.wkb)
+
+    return tasks
+
+
+def area_positions(task, settlements):
+    """
+    Index positions of the settlements inside an area task.
+    """
+    area_type, params = task
+    if area_type == 'circle':
+        return recommendations.settlements_in_circle(
+            params['lng'], params['lat'], params['radius_km'], settlements
+        )
+    geom = GEOSGeometry(memoryview(params['wkb']), srid=4326)
+    return recommendations.settlements_in_polygon(
+        geom, settlements, include_boundary=area_type == 'county'
+    )
+
+
+def evaluate(task, settlements, carwashes):
+    """
+    Recommendations for one area task against the given indexes.
+    """
+    area_type, params = task
+    min_distance_km = params['min_distance_km']
+
+    if area_type == 'polygon':
+        polygon = GEOSGeometry(memoryview(params['wkb']), srid=4326)
+        result = recommendations.best_in_polygon(polygon, min_distance_km, settlements, carwashes)
+        return {'recommendation': CarwashRecommendationSerializer(result).data}
+
+    positions = area_positions(task, settlements)
+    if area_type == 'county':
+        reason = f"Recommended location in {params['name']}"
+    else:
+        reason = 'Recommended location inside selected circle'
+
+    candidates = recommendations.rank_settlements(
+        positions,
+        min_distance_km,
+        params['max_settlement_distance_km'],
+        reason=reason,
+        settlements=settlements,
+        carwashes=carwashes,
+    )
+    return {'recommendations': CarwashRecommendationSerializer(candidates, many=True).data}
+
+
+def _get_pool():
+    """
+    Return the shared thread pool, or None when RECOMMENDATION_BATCH_THREADS
+    is below 2.
+    """
+    global _pool
+
+    threads = getattr(settings, 'RECOMMENDATION_BATCH_THREADS', 4)
+    if threads < 2:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='recommendation-batch')
+        return _pool
+
+
+def recommend_batch(tasks):
+    """
+    Evaluate area tasks (from parse_areas) and return one result per area,
+    in request order.
+    """
+    settlements = settlement_index.get()
+    carwashes = carwash_index.get()
+    run = partial(evaluate, settlements=settlements, carwashes=carwashes)
+
+    pool = _get_pool() if len(tasks) > 1 else None
+    if pool is None:
+        return [run(task) for task in tasks]
+    return list(pool.map(run, tasks))
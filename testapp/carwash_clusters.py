@@ -0,0 +1,199 @@
+"""
+Server-side clustering of the car wash layer for low map zooms.
+
+At national zoom most car wash markers overlap, and sending every one of
+them makes the payload grow with the dataset rather than with the
+viewport. Each worker keeps a hierarchical grid of the car washes in Web
+Mercator:
+
+- At zoom z the world is split into 2^z * 256 / CELL_PX cells per side,
+  so a cell is CELL_PX screen pixels wide at that zoom.
+- The finest level (CARWASH_CLUSTER_MAX_ZOOM) is built from the points;
+  every coarser level merges the four child cells of each parent, so the
+  whole hierarchy costs little more than one pass over the data.
+- A cell keeps its point count, the centroid of its points and, for a
+  single point, which car wash it is.
+
+A viewport query at a clustered zoom only reads the cells inside the
+bounding box, so the answer is bounded by the screen size: about
+(viewport pixels / CELL_PX)^2 features however many car washes there
+are. Above CARWASH_CLUSTER_MAX_ZOOM the API returns the car washes
+themselves, filtered by the GiST index (geojson_stream.py).
+
+The hierarchy is rebuilt when the car wash dataset version changes
+(spatial_index.ResidentIndex).
+"""
+import json
+import math
+
+import numpy as np
+from django.conf import settings
+
+from .dataset_version import CARWASH
+from .models import Location
+from .spatial_index import ResidentIndex
+
+# Screen size of a cluster cell; a power of two so cells nest across zooms
+CELL_PX = 64
+CELLS_PER_TILE = 256 // CELL_PX
+
+# Properties of a single car wash, as CarwashGeoSerializer sends them
+PROPERTIES = ('name', 'brand', 'operator', 'automated', 'self_service')
+
+# Web Mercator's latitude limit
+MAX_LAT = 85.0511
+
+
+def max_zoom():
+    """Highest zoom that is answered with clusters."""
+    return getattr(settings, 'CARWASH_CLUSTER_MAX_ZOOM', 11)
+
+
+def _mercator(lngs, lats):
+    """Normalised Web Mercator coordinates in [0, 1), y growing southwards."""
+    lats = np.clip(lats, -MAX_LAT, MAX_LAT)
+    x = (np.asarray(lngs) + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lats))) / math.pi) / 2.0
+    return np.clip(x, 0.0, np.nextafter(1.0, 0)), np.clip(y, 0.0, np.nextafter(1.0, 0))
+
+
+class Level:
+    """The occupied cells of one zoom, as parallel arrays."""
+
+    def __init__(self, cx, cy, count, lng_sum, lat_sum, member):
+        self.cx = cx
+        self.cy = cy
+        self.count = count
+        self.lng = lng_sum / count
+        self.lat = lat_sum / count
+        # Position of a point in the cell (the only one when count == 1)
+        self.member = member
+        self._lng_sum = lng_sum
+        self._lat_sum = lat_sum
+
+    def __len__(self):
+        return len(self.count)
+
+    def parent(self):
+        """The next coarser level: each cell merged with its siblings."""
+        px, py = self.cx >> 1, self.cy >> 1
+        _, first, inverse = np.unique((px << 32) | py, return_index=True, return_inverse=True)
+        return Level(
+            px[first],
+            py[first],
+            np.bincount(inverse, weights=self.count).astype(np.int64),
+            np.bincount(inverse, weights=self._lng_sum),
+            np.bincount(inverse, weights=self._lat_sum),
+            self.member[first],
+        )
+
+
+class ClusterIndex:
+    """Cluster levels 0..top of a set of points, with their properties."""
+
+    def __init__(self, keys, lngs, lats, properties, top):
+        self.keys = list(keys)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.properties = list(properties)
+        self.levels = [None] * (top + 1)
+
+        if not self.keys:
+            empty = np.zeros(0, dtype=np.int64)
+            for z in range(top + 1):
+                self.levels[z] = Level(empty, empty, empty, empty.astype(float), empty.astype(float), empty)
+            return
+
+        x, y = _mercator(self.lngs, self.lats)
+        n = CELLS_PER_TILE << top
+        cx = (x * n).astype(np.int64)
+        cy = (y * n).astype(np.int64)
+        _, first, inverse = np.unique((cx << 32) | cy, return_index=True, return_inverse=True)
+        level = Level(
+            cx[first],
+            cy[first],
+            np.bincount(inverse).astype(np.int64),
+            np.bincount(inverse, weights=self.lngs),
+            np.bincount(inverse, weights=self.lats),
+            first,
+        )
+        for z in range(top, -1, -1):
+            self.levels[z] = level
+            if z:
+                level = level.parent()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def cells(self, zoom, bbox=None):
+        """Level of a zoom and a mask of its cells overlapping bbox (all if None)."""
+        level = self.levels[zoom]
+        if bbox is None:
+            return level, np.ones(len(level), dtype=bool)
+        min_lng, min_lat, max_lng, max_lat = bbox
+        n = CELLS_PER_TILE << zoom
+        (x0, x1), (y1, y0) = _mercator(np.array([min_lng, max_lng]), np.array([min_lat, max_lat]))
+        mask = (
+            (level.cx >= int(x0 * n)) & (level.cx <= int(x1 * n))
+            & (level.cy >= int(y0 * n)) & (level.cy <= int(y1 * n))
+        )
+        return level, mask
+
+    def features(self, zoom, bbox=None, precision=6):
+        """
+        GeoJSON features of a zoom: a cluster (count and centroid) for each
+        cell of two or more car washes, the car wash itself otherwise.
+        """
+        level, mask = self.cells(zoom, bbox)
+        features = []
+        for i in np.flatnonzero(mask):
+            count = int(level.count[i])
+            if count == 1:
+                member = int(level.member[i])
+                features.append({
+                    'type': 'Feature',
+                    'id': self.keys[member],
+                    'geometry': {
+                        'type': 'Point',
+                        'coordinates': [
+                            round(float(self.lngs[member]), precision),
+                            round(float(self.lats[member]), precision),
+                        ],
+                    },
+                    'properties': self.properties[member],
+                })
+            else:
+                features.append({
+                    'type': 'Feature',
+                    'id': f'cluster/{zoom}/{int(level.cx[i])}/{int(level.cy[i])}',
+                    'geometry': {
+                        'type': 'Point',
+                        'coordinates': [
+                            round(float(level.lng[i]), precision),
+                            round(float(level.lat[i]), precision),
+                        ],
+                    },
+                    'properties': {'cluster': True, 'point_count': count},
+                })
+        return features
+
+
+def load_carwash_clusters() -> ClusterIndex:
+    """Build the cluster hierarchy over all car washes straight from the database."""
+    rows = list(Location.objects.values_list('id', 'point', *PROPERTIES))
+    return ClusterIndex(
+        keys=[row[0] for row in rows],
+        lngs=[row[1].x for row in rows],
+        lats=[row[1].y for row in rows],
+        properties=[dict(zip(PROPERTIES, row[2:])) for row in rows],
+        top=max_zoom(),
+    )
+
+
+carwash_clusters = ResidentIndex(CARWASH, load_carwash_clusters)
+
+
+def feature_collection(zoom, bbox=None, precision=6) -> str:
+    """FeatureCollection of the clusters of a zoom (at most max_zoom())."""
+    features = carwash_clusters.get().features(zoom, bbox, precision)
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':'))
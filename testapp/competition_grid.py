@@ -0,0 +1,171 @@
+"""
+Competitor-density heatmap over a bounding box.
+
+competition_density answers one point per request. This module answers a
+whole grid of cell_km cells at once. For each cell it counts the car
+washes within radius_km of the cell centre, and grades the count with the
+same Low/Medium/High thresholds.
+
+The grid is laid out in ITM metres, like geom_itm. Car washes are binned
+into the grid's own cells and summed into a summed-area table. A cell's
+count is then a few rectangle lookups: the disc of radius_km is covered by
+horizontal bands of whole cells, and every band is one rectangle query
+over the table, evaluated for all cells in one NumPy expression. The
+total work is O(cells * radius / cell_km) however many car washes there
+are. Car washes are snapped to their cell centre, so counts near the
+radius edge are accurate to half a cell.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import LineString, Polygon
+
+from .itm import ITM_SRID
+from .models import Location
+
+DEFAULT_CELL_KM = 1.0
+DEFAULT_RADIUS_KM = 3.0
+
+
+def saturation_level(competitor_count):
+    """Low / Medium / High, as shown by competition_density."""
+    if competitor_count <= 3:
+        return "Low"
+    if competitor_count <= 8:
+        return "Medium"
+    return "High"
+
+
+def _max_cells():
+    return getattr(settings, 'COMPETITION_GRID_MAX_CELLS', 100_000)
+
+
+def _max_radius_cells():
+    return getattr(settings, 'COMPETITION_GRID_MAX_RADIUS_CELLS', 100)
+
+
+def disc_bands(radius_cells):
+    """
+    Cover the cells whose centres are within radius_cells of the middle
+    cell with horizontal bands.
+
+    Returns [(first_row, last_row, half_width), ...] as offsets from the
+    middle cell: rows first_row..last_row, columns -half_width..half_width.
+    """
+    reach = int(math.floor(radius_cells))
+    bands = []
+    for dy in range(-reach, reach + 1):
+        half_width = int(math.floor(math.sqrt(radius_cells ** 2 - dy ** 2)))
+        if bands and bands[-1][2] == half_width and bands[-1][1] == dy - 1:
+            bands[-1] = (bands[-1][0], dy, half_width)
+        else:
+            bands.append((dy, dy, half_width))
+    return bands
+
+
+def count_grid(xs, ys, origin_x, origin_y, n_cols, n_rows, cell_m, radius_m):
+    """
+    Number of points within radius_m of every cell centre, as an
+    (n_rows, n_cols) array; points are snapped to their cell centre first.
+
+    Cell (row, col) is centred on (origin_x + (col + 0.5) * cell_m,
+    origin_y + (row + 0.5) * cell_m).
+    """
+    radius_cells = radius_m / cell_m
+    pad = int(math.floor(radius_cells))
+    height, width = n_rows + 2 * pad, n_cols + 2 * pad
+
+    cols = np.floor((np.asarray(xs, dtype=np.float64) - origin_x) / cell_m).astype(np.int64) + pad
+    rows = np.floor((np.asarray(ys, dtype=np.float64) - origin_y) / cell_m).astype(np.int64) + pad
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+
+    binned = np.zeros((height, width), dtype=np.int64)
+    np.add.at(binned, (rows[inside], cols[inside]), 1)
+
+    table = np.zeros((height + 1, width + 1), dtype=np.int64)
+    table[1:, 1:] = binned.cumsum(axis=0).cumsum(axis=1)
+
+    counts = np.zeros((n_rows, n_cols), dtype=np.int64)
+    for first_row, last_row, half_width in disc_bands(radius_cells):
+        top, bottom = pad + first_row, pad + last_row + 1
+        left, right = pad - half_width, pad + half_width + 1
+        counts += (
+            table[bottom:bottom + n_rows, right:right + n_cols]
+            - table[top:top + n_rows, right:right + n_cols]
+            - table[bottom:bottom + n_rows, left:left + n_cols]
+            + table[top:top + n_rows, left:left + n_cols]
+        )
+    return counts
+
+
+def competition_grid(min_lng, min_lat, max_lng, max_lat,
+                     cell_km=DEFAULT_CELL_KM, radius_km=DEFAULT_RADIUS_KM):
+    """
+    Competitor counts for a grid of cell_km cells over a bounding box.
+
+    Returns a list of {lat, lng, competitor_count, saturation_level}, one
+    per cell, with lat/lng the cell centre. Raises ValueError for a bad box,
+    a grid larger than COMPETITION_GRID_MAX_CELLS (also counting the
+    radius padding of the summed-area table), or a radius of more than
+    COMPETITION_GRID_MAX_RADIUS_CELLS cells.
+    """
+    if not all(map(math.isfinite, (min_lng, min_lat, max_lng, max_lat, cell_km, radius_km))):
+        raise ValueError('bbox, cell_km and radius must be finite numbers')
+    if not (min_lng < max_lng and min_lat < max_lat):
+        raise ValueError('bbox must be min_lng,min_lat,max_lng,max_lat')
+    if cell_km <= 0 or radius_km < 0:
+        raise ValueError('cell_km must be positive and radius_km not negative')
+    if radius_km / cell_km > _max_radius_cells():
+        raise ValueError(
+            f'radius is more than {_max_radius_cells()} cells; use a larger cell_km'
+        )
+
+    box = Polygon.from_bbox((min_lng, min_lat, max_lng, max_lat))
+    box.srid = 4326
+    box.transform(ITM_SRID)
+    origin_x, origin_y, max_x, max_y = box.extent
+
+    cell_m = cell_km * 1000.0
+    radius_m = radius_km * 1000.0
+    n_cols = max(1, int(math.ceil((max_x - origin_x) / cell_m)))
+    n_rows = max(1, int(math.ceil((max_y - origin_y) / cell_m)))
+    pad = int(math.floor(radius_m / cell_m))
+    if n_cols * n_rows > _max_cells() or (n_cols + 2 * pad) * (n_rows + 2 * pad) > 4 * _max_cells():
+        raise ValueError(
+            f'Grid of {n_cols * n_rows} cells is too large; use a larger cell_km'
+        )
+
+    # Car washes that can reach a cell: the grid extent grown by the radius
+    # and a cell for snapping
+    margin = radius_m + cell_m
+    reach = Polygon.from_bbox((
+        origin_x - margin, origin_y - margin,
+        origin_x + n_cols * cell_m + margin, origin_y + n_rows * cell_m + margin,
+    ))
+    reach.srid = ITM_SRID
+    points = Location.objects.filter(point_itm__bboxoverlaps=reach).values_list('point_itm', flat=True)
+    coords = np.array([(p.x, p.y) for p in points], dtype=np.float64).reshape(-1, 2)
+
+    counts = count_grid(
+        coords[:, 0], coords[:, 1], origin_x, origin_y, n_cols, n_rows, cell_m, radius_m
+    )
+
+    # One GEOS transform for all centres (a LineString needs two points)
+    col, row = np.meshgrid(np.arange(n_cols), np.arange(n_rows))
+    centres = np.column_stack((
+        origin_x + (col.ravel() + 0.5) * cell_m,
+        origin_y + (row.ravel() + 0.5) * cell_m,
+    ))
+    line = LineString(np.vstack((centres, centres[:1])), srid=ITM_SRID)
+    line.transform(4326)
+
+    return [
+        {
+            'lat': lat,
+            'lng': lng,
+            'competitor_count': count,
+            'saturation_level': saturation_level(count),
+        }
+        for (lng, lat), count in zip(line.coords, counts.ravel().tolist())
+    ]
@@ -0,0 +1,119 @@
+"""
+Precomputed county membership for car washes and settlements.
+
+County-scoped queries used to test every point against a large
+MultiPolygon with point__within. Instead, assign_counties() runs one
+point-in-polygon pass per dataset and stores the result in the
+county_assignment side table. County filters then become integer
+equality lookups on an index.
+
+The pass works on the subdivided county pieces (county_pieces.py). A
+NumPy bounding-box pre-filter per piece means prepared geometry is only
+tested for points that can be inside, and each test is against a small
+polygon. It runs after imports (bump_dataset_version) and after every
+car wash refresh (osm_import.carwashes_changed).
+
+Rows record the dataset version they were computed from. current()
+tells callers whether they can use the table; when they can't, they
+fall back to the geometry test.
+"""
+import logging
+
+import numpy as np
+from django.contrib.gis.geos import Point
+from django.db import transaction
+
+from . import county_pieces
+from .dataset_version import CARWASH, POPULATION, current_version, get_version
+from .models import CountyAssignment
+from .spatial_index import load_carwash_points, load_settlement_points
+
+logger = logging.getLogger(__name__)
+
+LOADERS = {
+    CARWASH: load_carwash_points,
+    POPULATION: load_settlement_points,
+}
+
+# dataset -> version the table was last confirmed current for (per worker)
+_current_for = {}
+
+
+def county_of_points(lngs, lats, counties):
+    """
+    County id for every point, or -1 if it is in none.
+
+    counties is an iterable of (id, geometry); a county may appear several
+    times, once per piece. A point on a shared border goes to the first
+    piece that covers it.
+    """
+    lngs = np.asarray(lngs, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    assigned = np.full(len(lngs), -1, dtype=np.int64)
+
+    for county_id, geom in counties:
+        min_lng, min_lat, max_lng, max_lat = geom.extent
+        candidates = np.flatnonzero(
+            (assigned < 0)
+            & (lngs >= min_lng) & (lngs <= max_lng)
+            & (lats >= min_lat) & (lats <= max_lat)
+        )
+        prepared = geom.prepared
+        for i in candidates:
+            if prepared.covers(Point(lngs[i], lats[i], srid=4326)):
+                assigned[i] = county_id
+
+    return assigned
+
+
+@transaction.atomic
+def assign_counties(dataset) -> int:
+    """
+    Recompute county membership for one dataset. Returns the number of
+    points assigned to a county.
+    """
+    points = LOADERS[dataset]()
+    version = get_version(dataset)
+    assigned = county_of_points(points.lng_array, points.lat_array, list(county_pieces.pieces()))
+
+    rows = [
+        CountyAssignment(
+            dataset=dataset,
+            point_id=points.keys[i],
+            county_id=int(county_id),
+            dataset_version=version,
+        )
+        for i, county_id in enumerate(assigned)
+        if county_id >= 0
+    ]
+
+    CountyAssignment.objects.filter(dataset=dataset).delete()
+    CountyAssignment.objects.bulk_create(rows, batch_size=1000)
+    _current_for[dataset] = version
+
+    logger.info(
+        "Assigned %d of %d %s points to counties", len(rows), len(points), dataset
+    )
+    return len(rows)
+
+
+def current(dataset) -> bool:
+    """
+    True if the assignments for a dataset match its current version.
+    """
+    version = current_version(dataset)
+    if _current_for.get(dataset) == version:
+        return True
+
+    rows = CountyAssignment.objects.filter(dataset=dataset)
+    is_current = rows.exists() and not rows.exclude(dataset_version=version).exists()
+    if is_current:
+        _current_for[dataset] = version
+    return is_current
+
+
+def point_ids(dataset, county_id):
+    """Query of the ids of a dataset's points inside a county."""
+    return CountyAssignment.objects.filter(
+        dataset=dataset, county_id=county_id
+    ).values_list('point_id', flat=True)
@@ -0,0 +1,82 @@
+"""
+Subdivided county boundaries (the county_pieces table).
+
+IrishCounty.geom holds whole coastline MultiPolygons. A containment test
+against one of them walks thousands of vertices, and its bounding box
+covers most of the county, so the GiST pre-filter hardly helps.
+county_pieces stores every county cut by ST_Subdivide into polygons of at
+most COUNTY_PIECE_MAX_VERTICES vertices. Each piece has its own GiST
+entry and a tight box, so a point is tested against one or two small
+polygons. Nothing here is specific to counties: finer boundaries
+(electoral divisions, small areas) can be cut the same way.
+
+Pieces share edges. A point exactly on an internal edge is inside
+neither piece, so tests against pieces use intersects/covers, not
+within/contains.
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import CountyPiece
+
+logger = logging.getLogger(__name__)
+
+SUBDIVIDE_SQL = """
+    INSERT INTO county_pieces (county_id, geom)
+    SELECT id, ST_Subdivide(geom, %(max_vertices)s)
+    FROM irish_counties
+"""
+
+# Whether this worker has seen a populated table
+_built = False
+
+
+def _max_vertices():
+    return getattr(settings, 'COUNTY_PIECE_MAX_VERTICES', 256)
+
+
+@transaction.atomic
+def rebuild_county_pieces() -> int:
+    """
+    Re-cut every county boundary. Returns the number of pieces.
+    """
+    global _built
+
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM county_pieces")
+        cursor.execute(SUBDIVIDE_SQL, {'max_vertices': _max_vertices()})
+        pieces = cursor.rowcount
+
+    _built = True
+    logger.info("Subdivided county boundaries into %d pieces", pieces)
+    return pieces
+
+
+def ensure_pieces():
+    """Build the table on first use if it is empty."""
+    global _built
+
+    if not _built:
+        if not CountyPiece.objects.exists():
+            rebuild_county_pieces()
+        _built = True
+
+
+def pieces():
+    """All pieces as (county_id, polygon) pairs."""
+    ensure_pieces()
+    return CountyPiece.objects.values_list('county_id', 'geom')
+
+
+def in_county(county_id, field='point'):
+    """
+    ORM filter: the point in `field` lies in the county (GiST-filtered
+    against its pieces).
+    """
+    ensure_pieces()
+    return Exists(
+        CountyPiece.objects.filter(county_id=county_id, geom__intersects=OuterRef(field))
+    )
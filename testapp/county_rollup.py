@@ -0,0 +1,132 @@
+"""
+Car wash counts per county (the county_wash_rollup table).
+
+Counting with one point__within query per county costs 26+ polygon
+queries every time the business map loads. Instead, the rollup is rebuilt
+with a single grouped join of irish_counties and carwash. The join goes
+through county_assignment when it is current, and tests against the
+subdivided county_pieces otherwise.
+
+Rows are broken down by brand, operator and self_service. Readers sum
+over whichever dimensions they don't need, which means a few hundred rows
+and no geometry.
+
+The table is rebuilt whenever the car washes change
+(osm_import.carwashes_changed). It is also rebuilt on first read if it is
+missing or was built from an older car wash version. Rebuilds take an
+exclusive lock on the table, so two workers that both notice a new
+version don't insert the rows twice.
+"""
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from . import county_assignment, county_pieces
+from .dataset_version import CARWASH, current_version, get_version
+from .models import CountyWashCount
+
+logger = logging.getLogger(__name__)
+
+# Columns a caller may break the counts down by
+DIMENSIONS = ('brand', 'operator', 'self_service')
+
+ROLLUP_SQL = """
+    INSERT INTO county_wash_rollup
+        (county_id, county_name, brand, operator, self_service, wash_count, carwash_version)
+    SELECT c.id, c.name_en, w.brand, w.operator, w.self_service, count(DISTINCT w.id), %(version)s
+    FROM irish_counties c
+    LEFT JOIN county_pieces cp ON cp.county_id = c.id
+    LEFT JOIN carwash w ON ST_Intersects(cp.geom, w.wkb_geometry)
+    GROUP BY c.id, c.name_en, w.brand, w.operator, w.self_service
+"""
+
+# Same rollup joined through county_assignment (no geometry tests)
+ROLLUP_ASSIGNED_SQL = """
+    INSERT INTO county_wash_rollup
+        (county_id, county_name, brand, operator, self_service, wash_count, carwash_version)
+    SELECT c.id, c.name_en, w.brand, w.operator, w.self_service, count(w.id), %(version)s
+    FROM irish_counties c
+    LEFT JOIN county_assignment a ON a.county_id = c.id AND a.dataset = %(dataset)s
+    LEFT JOIN carwash w ON w.id = a.point_id
+    GROUP BY c.id, c.name_en, w.brand, w.operator, w.self_service
+"""
+
+# Car wash version the table was last confirmed current for (per worker)
+_current_for = None
+
+
+def _is_current(version: int) -> bool:
+    rollup = CountyWashCount.objects.all()
+    return rollup.exists() and not rollup.exclude(carwash_version=version).exists()
+
+
+@transaction.atomic
+def refresh_county_rollup(only_if_stale: bool = False) -> int:
+    """
+    Rebuild the rollup with one spatial join. Returns the number of rows.
+
+    With only_if_stale, the rebuild is skipped (returning 0) when another
+    worker already rebuilt the table for the current car wash version
+    while this one was waiting for the lock.
+    """
+    global _current_for
+
+    with connection.cursor() as cursor:
+        # Readers still see the old rows; concurrent rebuilds queue here
+        cursor.execute("LOCK TABLE county_wash_rollup IN EXCLUSIVE MODE")
+
+    version = get_version(CARWASH)
+    if only_if_stale and _is_current(version):
+        _current_for = version
+        return 0
+
+    if county_assignment.current(CARWASH):
+        sql = ROLLUP_ASSIGNED_SQL
+    else:
+        county_pieces.ensure_pieces()
+        sql = ROLLUP_SQL
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM county_wash_rollup")
+        cursor.execute(sql, {'version': version, 'dataset': CARWASH})
+        rows = cursor.rowcount
+
+    _current_for = version
+    logger.info("Rebuilt county wash rollup (%d rows)", rows)
+    return rows
+
+
+def _ensure_current():
+    global _current_for
+
+    version = current_version(CARWASH)
+    if version == _current_for:
+        return
+
+    if not _is_current(version):
+        refresh_county_rollup(only_if_stale=True)
+    _current_for = version
+
+
+def county_counts(*dimensions):
+    """
+    Car wash counts per county, optionally broken down by DIMENSIONS.
+
+    Returns dicts with county_id, county_name, wash_count and one key per
+    requested dimension, ordered by county_id. Raises ValueError for an
+    unknown dimension.
+    """
+    unknown = set(dimensions) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError('Unknown dimension: ' + ', '.join(sorted(unknown)))
+
+    _ensure_current()
+    fields = ('county_id', 'county_name') + tuple(dimensions)
+    rows = CountyWashCount.objects.values(*fields).annotate(total=Sum('wash_count'))
+    if dimensions:
+        # Counties without car washes only matter for the per-county totals
+        rows = rows.filter(total__gt=0)
+    return [
+        {**{field: row[field] for field in fields}, 'wash_count': row['total']}
+        for row in rows.order_by(*fields)
+    ]
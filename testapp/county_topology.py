@@ -0,0 +1,344 @@
+"""
+County boundaries as a topology, with precomputed levels of detail.
+
+The full-resolution coastline MultiPolygons are by far the heaviest
+payload on the business map, and at national zoom almost all of their
+vertices fall on the same pixel. This module turns them into a
+TopoJSON-style topology:
+
+1. Coordinates are quantised to a COUNTY_TOPOLOGY_QUANTISATION grid over
+   the counties' bounding box, so shared vertices match exactly.
+2. Every ring is cut at junctions: points where the neighbouring vertices
+   differ between the rings passing through them. The pieces become arcs.
+   A border shared by two counties is one arc, referenced forwards by one
+   county and reversed (~index) by the other.
+3. Each level of detail simplifies every arc once with Douglas-Peucker,
+   at its COUNTY_LOD_TOLERANCES tolerance, keeping the arc's endpoints.
+   Neighbours share the same simplified arc, so no gaps or overlaps open
+   up between counties. Islands smaller than the tolerance are dropped,
+   and so are rings left with fewer than 4 positions.
+
+A level is rendered as TopoJSON (arcs delta-encoded, with a transform)
+or as plain GeoJSON built from the same arcs. geojson_snapshots stores
+both as precompressed files, so the topology is only computed when the
+snapshots are (re)built.
+"""
+import json
+import math
+
+import numpy as np
+from django.conf import settings
+
+from .models import IrishCounty
+
+# Properties of each county, as IrishCountyGeoSerializer sends them
+PROPERTIES = ('name_en', 'name_ga', 'alt_name', 'area', 'latitude', 'longitude')
+
+# Per-process topology, built on first use
+_topology = None
+
+
+def tolerances():
+    """Simplification tolerance of each level, in degrees, coarsest first."""
+    return tuple(getattr(settings, 'COUNTY_LOD_TOLERANCES', (0.02, 0.005, 0.001, 0.0002)))
+
+
+def lod_for_tolerance(tolerance):
+    """The coarsest level whose tolerance is at most `tolerance`."""
+    levels = tolerances()
+    for lod, level_tolerance in enumerate(levels):
+        if level_tolerance <= tolerance:
+            return lod
+    return len(levels) - 1
+
+
+def lod_for_zoom(zoom):
+    """The level that is accurate to about a pixel at a web map zoom level."""
+    return lod_for_tolerance(360.0 / (256 * 2 ** zoom))
+
+
+def _junctions(rings):
+    """Points whose neighbours differ between the rings passing through them."""
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            pair = {ring[i - 1], ring[(i + 1) % n]}
+            seen = neighbours.setdefault(point, pair)
+            if seen != pair:
+                junctions.add(point)
+    return junctions
+
+
+class Topology:
+    """
+    Quantised county rings cut into shared arcs.
+
+    arcs[i] is a list of integer (x, y) grid points; objects holds, per
+    county, (id, properties, polygons) where a polygon is a list of rings
+    and a ring a list of arc references (i, or ~i for arc i reversed).
+    """
+
+    def __init__(self, counties, quantisation):
+        points = np.array([
+            point
+            for _, _, polygons in counties
+            for polygon in polygons
+            for ring in polygon
+            for point in ring
+        ], dtype=np.float64).reshape(-1, 2)
+        if len(points):
+            self.bbox = tuple(points.min(axis=0).tolist()) + tuple(points.max(axis=0).tolist())
+        else:
+            # No boundaries imported yet: an empty topology
+            self.bbox = (0.0, 0.0, 0.0, 0.0)
+        self.translate = (self.bbox[0], self.bbox[1])
+        self.scale = (
+            (self.bbox[2] - self.bbox[0]) / (quantisation - 1) or 1.0,
+            (self.bbox[3] - self.bbox[1]) / (quantisation - 1) or 1.0,
+        )
+
+        quantised = [
+            (county_id, properties, [
+                [self._quantise(ring) for ring in polygon] for polygon in polygons
+            ])
+            for county_id, properties, polygons in counties
+        ]
+        # Rings that collapsed to fewer than three distinct points are dropped
+        quantised = [
+            (county_id, properties, [
+                [ring for ring in polygon if len(ring) >= 3]
+                for polygon in polygons if len(polygon[0]) >= 3
+            ])
+            for county_id, properties, polygons in quantised
+        ]
+
+        junctions = _junctions([
+            ring for _, _, polygons in quantised for polygon in polygons for ring in polygon
+        ])
+        self.arcs = []
+        self._arc_index = {}
+        self.objects = [
+            (county_id, properties, [
+                [self._ring_arcs(ring, junctions) for ring in polygon]
+                for polygon in polygons
+            ])
+            for county_id, properties, polygons in quantised
+        ]
+
+    def _quantise(self, ring):
+        """Grid points of a ring, without repeats or the closing point."""
+        x0, y0 = self.translate
+        kx, ky = self.scale
+        points = []
+        for x, y in ring:
+            point = (int(round((x - x0) / kx)), int(round((y - y0) / ky)))
+            if not points or points[-1] != point:
+                points.append(point)
+        while len(points) > 1 and points[-1] == points[0]:
+            points.pop()
+        return points
+
+    def _arc(self, points):
+        key = tuple(points)
+        if key in self._arc_index:
+            return self._arc_index[key]
+        reverse = key[::-1]
+        if reverse in self._arc_index:
+            return ~self._arc_index[reverse]
+        self._arc_index[key] = len(self.arcs)
+        self.arcs.append(points)
+        return len(self.arcs) - 1
+
+    def _ring_arcs(self, ring, junctions):
+        cuts = [i for i, point in enumerate(ring) if point in junctions]
+        if not cuts:
+            # A ring without junctions is one closed arc. Start it at its
+            # smallest point so a ring shared whole (e.g. a county inside
+            # another's hole) is found again, in either direction.
+            start = ring.index(min(ring))
+            ring = ring[start:] + ring[:start]
+            return [self._arc(ring + [ring[0]])]
+
+        ring = ring[cuts[0]:] + ring[:cuts[0]]
+        offsets = [i - cuts[0] for i in cuts] + [len(ring)]
+        ring = ring + [ring[0]]
+        return [self._arc(ring[a:b + 1]) for a, b in zip(offsets, offsets[1:])]
+
+    def dequantise(self, points):
+        x0, y0 = self.translate
+        kx, ky = self.scale
+        return [(x0 + x * kx, y0 + y * ky) for x, y in points]
+
+
+def _douglas_peucker(points, tolerance):
+    """Indices of the points Douglas-Peucker keeps, endpoints included."""
+    xy = np.asarray(points, dtype=np.float64)
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = xy[last] - xy[first]
+        offsets = xy[first + 1:last] - xy[first]
+        length = math.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(offsets[:, 0] * segment[1] - offsets[:, 1] * segment[0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def _simplify_arc(topo, points, tolerance):
+    """
+    Simplified arc (as grid points), or None for a closed arc smaller than
+    the tolerance.
+    """
+    if tolerance <= 0 or len(points) <= 2:
+        return points
+    coords = topo.dequantise(points)
+    if points[0] != points[-1]:
+        return [points[i] for i in _douglas_peucker(coords, tolerance)]
+
+    # Closed arc: drop it when it is smaller than the tolerance, otherwise
+    # split it at its farthest point and keep a ring of at least 4 points
+    xy = np.asarray(coords)
+    if (xy.max(axis=0) - xy.min(axis=0)).max() < tolerance:
+        return None
+    far = int(np.argmax(np.hypot(*(xy - xy[0]).T)))
+    kept = sorted(
+        set(_douglas_peucker(coords[:far + 1], tolerance))
+        | {far + i for i in _douglas_peucker(coords[far:], tolerance)}
+    )
+    if len(kept) < 4:
+        kept = sorted({0, far // 2, far, (far + len(points) - 1) // 2, len(points) - 1})
+    return [points[i] for i in kept]
+
+
+def load_counties():
+    """[(id, properties, [[ring, ...], ...]), ...] with rings as (lng, lat) lists."""
+    counties = []
+    for row in IrishCounty.objects.values_list('id', *PROPERTIES, 'geom').order_by('id'):
+        county_id, values, geom = row[0], row[1:-1], row[-1]
+        properties = {
+            name: str(value) if value is not None and name in ('area', 'latitude', 'longitude') else value
+            for name, value in zip(PROPERTIES, values)
+        }
+        polygons = [[list(ring.coords) for ring in polygon] for polygon in geom]
+        counties.append((county_id, properties, polygons))
+    return counties
+
+
+def topology():
+    """The per-process Topology of the counties table."""
+    global _topology
+    if _topology is None:
+        _topology = Topology(
+            load_counties(), getattr(settings, 'COUNTY_TOPOLOGY_QUANTISATION', 100_000)
+        )
+    return _topology
+
+
+def reset():
+    """
+    Forget the per-process topology (after a boundary import).
+
+    build_geojson_snapshots calls this before it rebuilds the levels.
+    """
+    global _topology
+    _topology = None
+
+
+def _level(lod):
+    """Simplified arcs of a level and each county's polygons with dropped rings removed."""
+    topo = topology()
+    tolerance = tolerances()[lod]
+    arcs = [_simplify_arc(topo, arc, tolerance) for arc in topo.arcs]
+
+    def valid(ring):
+        # Every arc still there, and at least 4 positions once joined (the
+        # arcs share their end points), as a GeoJSON LinearRing needs
+        ring_arcs = [arcs[ref if ref >= 0 else ~ref] for ref in ring]
+        if any(arc is None for arc in ring_arcs):
+            return False
+        return sum(len(arc) for arc in ring_arcs) - (len(ring) - 1) >= 4
+
+    objects = []
+    for county_id, properties, polygons in topo.objects:
+        kept = []
+        for polygon in polygons:
+            # An exterior ring gone means the whole (tiny) polygon goes
+            if not valid(polygon[0]):
+                continue
+            kept.append([ring for ring in polygon if valid(ring)])
+        objects.append((county_id, properties, kept))
+    return topo, arcs, objects
+
+
+def render_topojson(lod) -> str:
+    """TopoJSON document of one level; arcs that were dropped are kept as []."""
+    topo, arcs, objects = _level(lod)
+
+    encoded = []
+    for arc in arcs:
+        if arc is None:
+            encoded.append([])
+            continue
+        deltas = [list(arc[0])]
+        for (x0, y0), (x1, y1) in zip(arc, arc[1:]):
+            deltas.append([x1 - x0, y1 - y0])
+        encoded.append(deltas)
+
+    return json.dumps({
+        'type': 'Topology',
+        'bbox': list(topo.bbox),
+        'transform': {'scale': list(topo.scale), 'translate': list(topo.translate)},
+        'objects': {
+            'counties': {
+                'type': 'GeometryCollection',
+                'geometries': [
+                    {'type': 'MultiPolygon', 'id': county_id, 'properties': properties, 'arcs': polygons}
+                    for county_id, properties, polygons in objects
+                ],
+            },
+        },
+        'arcs': encoded,
+    }, separators=(',', ':'))
+
+
+def render_geojson(lod) -> str:
+    """The same level as a GeoJSON FeatureCollection (coordinates to 6 decimals)."""
+    topo, arcs, objects = _level(lod)
+
+    def ring_coords(refs):
+        coords = []
+        for ref in refs:
+            arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+            points = topo.dequantise(arc)
+            coords.extend(points if not coords else points[1:])
+        return [[round(x, 6), round(y, 6)] for x, y in coords]
+
+    return json.dumps({
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'id': county_id,
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'MultiPolygon',
+                    'coordinates': [[ring_coords(ring) for ring in polygon] for polygon in polygons],
+                },
+                'properties': properties,
+            }
+            for county_id, properties, polygons in objects
+        ],
+    }, separators=(',', ':'))
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import DatasetVersion
+
+# Dataset names used as DatasetVersion primary keys
+CARWASH = 'carwash'
+POPULATION = 'population'
+
+# Per-process memo of name -> (version, monotonic time it was read)
+_seen = {}
+
+
+def get_version(name: str) -> int:
+    """
+    Return the current version of a dataset (0 if it was never bumped).
+    """
+    row = DatasetVersion.objects.filter(name=name).values_list('version', flat=True).first()
+    return row or 0
+
+
+def bump_version(name: str) -> int:
+    """
+    Increment the version of a dataset after its rows have changed.
+
+    Returns the new version. Inside a transaction the per-process memo is
+    only dropped once it commits, so other threads never see the new
+    version while they can still read the old rows.
+    """
+    DatasetVersion.objects.get_or_create(name=name)
+    DatasetVersion.objects.filter(name=name).update(version=F('version') + 1)
+    transaction.on_commit(lambda: _seen.pop(name, None))
+    return get_version(name)
+
+
+def current_version(name: str) -> int:
+    """
+    Like get_version(), but re-reads the database at most every
+    DATASET_VERSION_CHECK_SECONDS so hot paths can call it per request.
+    """
+    check_seconds = getattr(settings, 'DATASET_VERSION_CHECK_SECONDS', 5)
+    seen = _seen.get(name)
+    if seen is not None and time.monotonic() - seen[1] < check_seconds:
+        return seen[0]
+
+    version = get_version(name)
+    _seen[name] = (version, time.monotonic())
+    return version
@@ -0,0 +1,164 @@
+"""
+Geohash-snapped cache for /api/nearest, /api/nearby and /api/competition.
+
+The mobile app sends a request on every location update, so consecutive
+requests come from almost the same spot. Each request point is snapped to
+its geohash cell (GEO_CACHE_PRECISION characters). The cache stores the
+candidates that can matter to any point in that cell, then re-ranks them
+exactly for the real point. Answers are the same as without the cache.
+
+- nearest k: with d_k the distance from the cell centre to its k-th
+  nearest car wash and h the centre-to-corner distance, every point in
+  the cell has its k nearest within d_k + 2h of the centre (triangle
+  inequality). Those are the candidates.
+- competition within r: the candidates are the car washes within r + h of
+  the centre. They are kept as ITM coordinates, so the count for the real
+  point is the same planar test ST_DWithin does on geom_itm.
+
+Entries sit in per-worker LRUCaches. Keys carry the car wash dataset
+version, and osm_import.carwashes_changed() clears them eagerly.
+stats() reports hits and misses.
+"""
+import numpy as np
+from django.conf import settings
+
+from . import itm, nearest_service
+from .dataset_version import CARWASH, current_version
+from .models import Location
+from .result_cache import LRUCache
+from .spatial_index import haversine_km
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+nearest_cells = LRUCache(
+    maxsize=getattr(settings, 'GEO_CACHE_SIZE', 4096),
+    ttl_seconds=getattr(settings, 'GEO_CACHE_TTL', 3600),
+)
+competition_cells = LRUCache(
+    maxsize=getattr(settings, 'GEO_CACHE_SIZE', 4096),
+    ttl_seconds=getattr(settings, 'GEO_CACHE_TTL', 3600),
+)
+
+
+def geohash_cell(lng, lat, precision):
+    """
+    Geohash of a point and the bounds of its cell,
+    as (hash, (min_lng, min_lat, max_lng, max_lat)).
+    """
+    min_lng, max_lng, min_lat, max_lat = -180.0, 180.0, -90.0, 90.0
+    chars = []
+    bits = value = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            mid = (min_lng + max_lng) / 2
+            if lng >= mid:
+                value, min_lng = value * 2 + 1, mid
+            else:
+                value, max_lng = value * 2, mid
+        else:
+            mid = (min_lat + max_lat) / 2
+            if lat >= mid:
+                value, min_lat = value * 2 + 1, mid
+            else:
+                value, max_lat = value * 2, mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+
+    return ''.join(chars), (min_lng, min_lat, max_lng, max_lat)
+
+
+def _cell(lng, lat):
+    """(geohash, centre_lng, centre_lat, half_diagonal_km) of a point's cell."""
+    geohash, (min_lng, min_lat, max_lng, max_lat) = geohash_cell(
+        lng, lat, getattr(settings, 'GEO_CACHE_PRECISION', 6)
+    )
+    centre_lng = (min_lng + max_lng) / 2
+    centre_lat = (min_lat + max_lat) / 2
+    # 1% slack, as in spatial_index.search_box
+    half_diagonal_km = 1.01 * max(
+        haversine_km(centre_lng, centre_lat, corner_lng, corner_lat)
+        for corner_lng in (min_lng, max_lng)
+        for corner_lat in (min_lat, max_lat)
+    )
+    return geohash, centre_lng, centre_lat, half_diagonal_km
+
+
+def nearest_carwashes(lng, lat, k=10):
+    """
+    Cached nearest_service.nearest_carwashes(): the k nearest car washes
+    as [(distance_km, fields), ...], nearest first.
+    """
+    geohash, centre_lng, centre_lat, h = _cell(lng, lat)
+    key = (geohash, k, current_version(CARWASH))
+
+    candidates = nearest_cells.get(key)
+    if candidates is None:
+        nearest = nearest_service.nearest_carwashes(centre_lng, centre_lat, k)
+        if len(nearest) < k:
+            # Fewer than k car washes in total: all of them are candidates
+            candidates = [fields for _, fields in nearest]
+        else:
+            radius_km = nearest[-1][0] + 2 * h
+            candidates = [
+                fields for _, fields
+                in nearest_service.carwashes_within(centre_lng, centre_lat, radius_km)
+            ]
+        nearest_cells.set(key, candidates)
+
+    ranked = sorted(
+        (haversine_km(lng, lat, fields['lng'], fields['lat']), n)
+        for n, fields in enumerate(candidates)
+    )
+    return [(distance_km, candidates[n]) for distance_km, n in ranked[:k]]
+
+
+def competitor_count(lng, lat, radius_km):
+    """
+    Cached count of the car washes within radius_km of (lng, lat), with the
+    same planar ITM test as itm.within().
+    """
+    geohash, centre_lng, centre_lat, h = _cell(lng, lat)
+    key = (geohash, round(float(radius_km), 6), current_version(CARWASH))
+
+    candidates = competition_cells.get(key)
+    if candidates is None:
+        points = Location.objects.filter(
+            itm.within(centre_lng, centre_lat, radius_km + h)
+        ).values_list('point_itm', flat=True)
+        candidates = np.array([(p.x, p.y) for p in points], dtype=np.float64).reshape(-1, 2)
+        competition_cells.set(key, candidates)
+
+    point = itm.to_itm(lng, lat)
+    dx = candidates[:, 0] - point.x
+    dy = candidates[:, 1] - point.y
+    radius_m = radius_km * 1000.0
+    return int(np.count_nonzero(dx * dx + dy * dy <= radius_m * radius_m))
+
+
+def _cache_stats(cache):
+    lookups = cache.hits + cache.misses
+    return {
+        'hits': cache.hits,
+        'misses': cache.misses,
+        'hit_ratio': cache.hits / lookups if lookups else None,
+        'entries': len(cache),
+    }
+
+
+def stats():
+    """Hit/miss counters of this worker's caches."""
+    return {
+        'nearest': _cache_stats(nearest_cells),
+        'competition': _cache_stats(competition_cells),
+    }
+
+
+def clear():
+    """Drop this worker's cached cells (other workers rely on the version key)."""
+    nearest_cells.clear()
+    competition_cells.clear()
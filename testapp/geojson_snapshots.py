@@ -0,0 +1,230 @@
+"""
+Prebuilt, precompressed GeoJSON snapshots of the map layers.
+
+carwashes.geojson and counties.geojson are fetched on every page load,
+but they only change when the car washes are refreshed or boundaries are
+imported. build_snapshot() renders a layer once (the same document
+geojson_stream produces) and writes it to GEOJSON_SNAPSHOT_DIR:
+- the raw file;
+- a gzip copy;
+- a brotli copy, when the brotli package is installed.
+File names carry the dataset version and content hash. A small
+<name>.json manifest points at the current files.
+
+The views answer from the manifest:
+- the ETag is the strong content hash and Last-Modified the build time,
+  so repeat visits get 304 Not Modified;
+- everything else is a FileResponse of the best precompressed copy the
+  client accepts, which the WSGI server can send with sendfile.
+
+The county levels of detail (county_topology.py) are stored the same
+way, as TopoJSON and as GeoJSON per level.
+
+Car wash snapshots are rebuilt when the data changes
+(osm_import.carwashes_changed) or, failing that, on the first request
+that sees a new dataset version. build_geojson_snapshots rebuilds them by
+hand, e.g. after a county boundary import. Workers check the manifest's
+mtime on every request, so a rebuild in another process is picked up
+straight away even when the version (always 0 for counties) is unchanged.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from . import county_topology, geojson_stream
+from .dataset_version import CARWASH, current_version
+from .models import IrishCounty, Location
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# GeoJSON layer -> (model, geometry field, properties, dataset or None)
+LAYERS = {
+    'carwashes': (
+        Location, 'point',
+        ('name', 'brand', 'amenity', 'operator', 'building', 'automated', 'self_service', 'note'),
+        CARWASH,
+    ),
+    'counties': (
+        IrishCounty, 'geom',
+        ('name_en', 'name_ga', 'alt_name', 'area', 'latitude', 'longitude'),
+        None,
+    ),
+}
+
+
+
+def _render_layer(name):
+    model, geometry_field, properties, _ = LAYERS[name]
+    return ''.join(geojson_stream.feature_collection(model, geometry_field, properties, crs=True))
+
+
+def lod_name(lod, topojson=True):
+    """Snapshot name of a county level of detail."""
+    return f"counties-{'topojson' if topojson else 'lod'}-{lod}"
+
+
+# name -> (render, dataset or None, file extension)
+SNAPSHOTS = {
+    name: (partial(_render_layer, name), layer[3], '.geojson')
+    for name, layer in LAYERS.items()
+}
+for _lod in range(len(county_topology.tolerances())):
+    SNAPSHOTS[lod_name(_lod)] = (partial(county_topology.render_topojson, _lod), None, '.topojson')
+    SNAPSHOTS[lod_name(_lod, topojson=False)] = (
+        partial(county_topology.render_geojson, _lod), None, '.geojson'
+    )
+
+# Precompressed Content-Encodings, in order of preference
+ENCODINGS = ('br', 'gzip')
+
+Snapshot = namedtuple('Snapshot', 'name version etag built_at files')
+
+# name -> (Snapshot this worker last read or built, manifest mtime_ns)
+_current = {}
+_lock = threading.Lock()
+
+
+def _snapshot_dir():
+    return Path(getattr(
+        settings, 'GEOJSON_SNAPSHOT_DIR', Path(settings.BASE_DIR) / 'cache' / 'geojson'
+    ))
+
+
+def _manifest_path(name):
+    return _snapshot_dir() / f'{name}.json'
+
+
+def _write(path, data):
+    # Write to a temporary file and rename it, so readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _manifest_mtime(name):
+    try:
+        return _manifest_path(name).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _version(name):
+    dataset = SNAPSHOTS[name][1]
+    return current_version(dataset) if dataset else 0
+
+
+def build_snapshot(name) -> Snapshot:
+    """Render a snapshot, write its raw and compressed files and the manifest."""
+    render, _, extension = SNAPSHOTS[name]
+    version = _version(name)
+    data = render().encode()
+    etag = hashlib.sha256(data).hexdigest()[:32]
+
+    directory = _snapshot_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    base = f'{name}-v{version}-{etag}{extension}'
+    files = {'identity': base}
+    _write(directory / base, data)
+    # mtime=0 keeps the gzip bytes a function of the content alone
+    _write(directory / (base + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+    files['gzip'] = base + '.gz'
+    if brotli is not None:
+        _write(directory / (base + '.br'), brotli.compress(data))
+        files['br'] = base + '.br'
+
+    snapshot = Snapshot(name, version, etag, time.time(), files)
+    _write(_manifest_path(name), json.dumps(snapshot._asdict()).encode())
+    _current[name] = (snapshot, _manifest_mtime(name))
+
+    # Older snapshots of this layer are no longer referenced
+    for path in directory.glob(f'{name}-v*{extension}*'):
+        if path.name not in files.values():
+            path.unlink(missing_ok=True)
+
+    logger.info("Built %s GeoJSON snapshot v%s (%d bytes)", name, version, len(data))
+    return snapshot
+
+
+def current(name) -> Snapshot:
+    """The snapshot for the layer's current version, building it if needed."""
+    version = _version(name)
+    memo = _current.get(name)
+    if memo is not None and memo[0].version == version and memo[1] == _manifest_mtime(name):
+        return memo[0]
+
+    with _lock:
+        mtime = _manifest_mtime(name)
+        try:
+            snapshot = Snapshot(**json.loads(_manifest_path(name).read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            snapshot = None
+        if snapshot is None or snapshot.version != version or not all(
+            (_snapshot_dir() / f).exists() for f in snapshot.files.values()
+        ):
+            return build_snapshot(name)
+        _current[name] = (snapshot, mtime)
+    return snapshot
+
+
+def choose_file(snapshot, accept_encoding):
+    """(path, content_encoding or None) of the best copy the client accepts."""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding in accepted and encoding in snapshot.files:
+            return _snapshot_dir() / snapshot.files[encoding], encoding
+    return _snapshot_dir() / snapshot.files['identity'], None
+
+
+def snapshot_response(request, name, content_type='application/json'):
+    """
+    Serve a snapshot with conditional GET: 304 when the client's copy is
+    current, otherwise a FileResponse of the best encoding it accepts.
+    """
+    snapshot = current(name)
+    path, encoding = choose_file(snapshot, request.headers.get('Accept-Encoding'))
+    # Strong validator per representation
+    etag = f'"{snapshot.etag}-{encoding or "identity"}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(snapshot.built_at))
+    if response is None:
+        try:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        except FileNotFoundError:
+            # Replaced by another process since the manifest was read
+            _current.pop(name, None)
+            return snapshot_response(request, name, content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(snapshot.built_at)
+    # ?v=<etag> URLs never change; the plain URL is revalidated (a 304) each time
+    if request.GET.get('v') == snapshot.etag:
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,112 @@
+"""
+GeoJSON FeatureCollections built by PostGIS and streamed to the client.
+
+serialize('geojson') and GeoFeatureModelSerializer build a model instance
+per row and the whole document in Python before the first byte is sent.
+Here every feature is built as JSON text by the database
+(json_build_object + ST_AsGeoJSON). Rows are read from a server-side
+cursor GEOJSON_STREAM_CHUNK_SIZE at a time and passed on as they arrive.
+Memory stays flat as the layers grow, and the map starts receiving
+features as soon as the first chunk is ready.
+
+Features have the same shape as before: id, geometry and the listed
+properties. Decimal columns stay strings, as both serializers render them.
+Rows come in table order; sorting first would hold back the first byte.
+
+A bounding box limits the collection to the rows whose geometry overlaps
+it, tested with && so the GiST index on the geometry column does the work.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import DecimalField
+
+# ST_AsGeoJSON's own default; 9 decimal places of a degree is under a millimetre
+DEFAULT_PRECISION = 9
+MAX_PRECISION = 15
+
+CRS_4326 = '{"type": "name", "properties": {"name": "EPSG:4326"}}'
+
+
+def parse_precision(value):
+    """
+    Coordinate decimal places from a query parameter (default
+    DEFAULT_PRECISION). Raises ValueError outside 0..MAX_PRECISION.
+    """
+    if value in (None, ''):
+        return DEFAULT_PRECISION
+    precision = int(value)
+    if not 0 <= precision <= MAX_PRECISION:
+        raise ValueError(f'precision must be between 0 and {MAX_PRECISION}')
+    return precision
+
+
+def feature_sql(model, geometry_field, properties):
+    """SELECT returning one GeoJSON Feature (as text) per row of model's table."""
+    opts = model._meta
+    quote = connection.ops.quote_name
+
+    def column(name):
+        field = opts.get_field(name)
+        expression = 't.' + quote(field.column)
+        return expression + '::text' if isinstance(field, DecimalField) else expression
+
+    props = ', '.join(f"'{name}', {column(name)}" for name in properties)
+    return (
+        f"SELECT json_build_object("
+        f"'type', 'Feature', "
+        f"'id', t.{quote(opts.pk.column)}, "
+        f"'geometry', ST_AsGeoJSON(t.{quote(opts.get_field(geometry_field).column)}, %s)::json, "
+        f"'properties', json_build_object({props})"
+        f")::text "
+        f"FROM {quote(opts.db_table)} t"
+    )
+
+
+def parse_bbox(value):
+    """
+    (min_lng, min_lat, max_lng, max_lat) from "min_lng,min_lat,max_lng,max_lat",
+    or None when absent. Raises ValueError for a malformed box.
+    """
+    if value in (None, ''):
+        return None
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError('bbox must be min_lng,min_lat,max_lng,max_lat')
+    if not (min_lng < max_lng and min_lat < max_lat):
+        raise ValueError('bbox must be min_lng,min_lat,max_lng,max_lat')
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def feature_collection(model, geometry_field, properties, precision=DEFAULT_PRECISION, crs=False,
+                       bbox=None):
+    """
+    Yield a FeatureCollection of every row of model (or of those overlapping
+    bbox) in text chunks, for a StreamingHttpResponse.
+
+    crs=True adds the "crs" member Django's geojson serializer writes.
+    """
+    chunk_size = getattr(settings, 'GEOJSON_STREAM_CHUNK_SIZE', 2000)
+    sql = feature_sql(model, geometry_field, properties)
+    params = [precision]
+    if bbox is not None:
+        column = connection.ops.quote_name(model._meta.get_field(geometry_field).column)
+        sql += f" WHERE t.{column} && ST_MakeEnvelope(%s, %s, %s, %s, 4326)"
+        params.extend(bbox)
+
+    yield '{"type": "FeatureCollection", '
+    if crs:
+        yield f'"crs": {CRS_4326}, '
+    yield '"features": ['
+
+    separator = ''
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield separator + ', '.join(row[0] for row in rows)
+            separator = ', '
+
+    yield ']}'
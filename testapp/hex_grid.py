@@ -0,0 +1,192 @@
+"""
+Hexagonal grid candidates for county, circle and polygon areas.
+
+Settlements are the only candidates the ranked recommenders consider, so
+the rural gaps between them are never suggested. This module tiles an
+area with hexagon centres cell_km apart. It scores every cell in one
+vectorised pass:
+- demand: the total population of settlements within
+  max_settlement_distance_km;
+- the distance to the nearest car wash.
+Cells are then ranked by demand.
+
+The grid is laid out on a local equirectangular plane around the area's
+middle latitude. Over an area the size of a county this is accurate to a
+few metres, which is far below the cell size.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import LineString
+
+from .distance_kernel import demand_within, nearest
+from .recommendations import DEFAULT_LIMIT
+from .spatial_index import KM_PER_DEGREE, carwash_index, search_box, settlement_index
+
+DEFAULT_CELL_KM = 1.0
+
+
+def _max_cells():
+    return getattr(settings, 'HEX_GRID_MAX_CELLS', 250_000)
+
+
+def _hex_rows(min_lng, min_lat, max_lng, max_lat, cell_km):
+    """
+    Hexagon centres covering a bounding box, as (lngs, row_lats) where lngs
+    is an (n_rows, n_cols) array and row_lats the latitude of each row.
+    """
+    if cell_km <= 0:
+        raise ValueError('cell_km must be positive')
+
+    mid_lat = (min_lat + max_lat) / 2
+    km_per_lng = KM_PER_DEGREE * max(math.cos(math.radians(mid_lat)), 0.01)
+    width_km = (max_lng - min_lng) * km_per_lng
+    height_km = (max_lat - min_lat) * KM_PER_DEGREE
+    row_km = cell_km * math.sqrt(3) / 2
+
+    n_cols = int(width_km // cell_km) + 2
+    n_rows = int(height_km // row_km) + 2
+    if n_cols * n_rows > _max_cells():
+        raise ValueError(
+            f'Grid of {n_cols * n_rows} cells is too large; use a larger cell_km'
+        )
+
+    # Every other row is shifted by half a cell
+    x = np.arange(n_cols)[None, :] * cell_km + (np.arange(n_rows) % 2)[:, None] * (cell_km / 2)
+    lngs = min_lng + x / km_per_lng
+    row_lats = min_lat + np.arange(n_rows) * row_km / KM_PER_DEGREE
+    return lngs, row_lats
+
+
+def hex_centres(min_lng, min_lat, max_lng, max_lat, cell_km=DEFAULT_CELL_KM):
+    """
+    (lngs, lats) arrays of hexagon centres covering a bounding box.
+
+    Centres are cell_km apart and rows cell_km * sqrt(3) / 2 apart. Raises
+    ValueError if the grid would exceed HEX_GRID_MAX_CELLS.
+    """
+    lngs, row_lats = _hex_rows(min_lng, min_lat, max_lng, max_lat, cell_km)
+    lats = np.broadcast_to(row_lats[:, None], lngs.shape)
+    return lngs.ravel(), lats.ravel()
+
+
+def _row_spans(polygon, lat, min_lng, max_lng):
+    """(start_lng, end_lng) spans where the line of latitude lat is inside polygon."""
+    hit = polygon.intersection(LineString((min_lng, lat), (max_lng, lat), srid=polygon.srid))
+    if hit.geom_type == 'LineString':
+        parts = [hit]
+    elif hit.geom_type in ('MultiLineString', 'GeometryCollection'):
+        parts = [part for part in hit if part.geom_type == 'LineString']
+    else:
+        # Empty, or a Point / MultiPoint where the line only touches a vertex
+        parts = []
+    return [(min(part.x), max(part.x)) for part in parts if not part.empty]
+
+
+def cells_in_polygon(polygon, cell_km=DEFAULT_CELL_KM):
+    """
+    Hexagon centres inside a polygon (e.g. a county geometry).
+
+    Each grid row is clipped with one line intersection, so a county at
+    1 km needs a few hundred GEOS calls rather than one per cell.
+    """
+    min_lng, min_lat, max_lng, max_lat = polygon.extent
+    lngs, row_lats = _hex_rows(min_lng, min_lat, max_lng, max_lat, cell_km)
+    inside = np.zeros(lngs.shape, dtype=bool)
+    for row, lat in enumerate(row_lats):
+        for start, end in _row_spans(polygon, lat, min_lng - 1, max_lng + 1):
+            inside[row] |= (lngs[row] >= start) & (lngs[row] <= end)
+
+    lats = np.broadcast_to(row_lats[:, None], lngs.shape)
+    return lngs[inside], lats[inside]
+
+
+def cells_in_circle(lng, lat, radius_km, cell_km=DEFAULT_CELL_KM):
+    """Hexagon centres within radius_km (great-circle) of a centre."""
+    lngs, lats = hex_centres(*search_box(lng, lat, radius_km), cell_km=cell_km)
+    distance_km, _ = nearest(lngs, lats, [lng], [lat])
+    inside = distance_km <= radius_km
+    return lngs[inside], lats[inside]
+
+
+def rank_cells(lngs, lats, min_distance_km, max_settlement_distance_km, reason,
+               limit=DEFAULT_LIMIT, settlements=None, carwashes=None):
+    """
+    Score grid cells and return the best `limit` in the recommendation format.
+
+    Cells closer than min_distance_km to a car wash are dropped. The rest
+    are ranked by the population within max_settlement_distance_km, then
+    by distance from car washes.
+    """
+    if settlements is None:
+        settlements = settlement_index.get()
+    if carwashes is None:
+        carwashes = carwash_index.get()
+    if not len(lngs):
+        return []
+
+    distance_km, _ = nearest(lngs, lats, carwashes.lng_array, carwashes.lat_array)
+    keep = np.isnan(distance_km) | (distance_km >= min_distance_km)
+    lngs, lats, distance_km = lngs[keep], lats[keep], distance_km[keep]
+    if not len(lngs):
+        return []
+
+    # Only settlements that can reach some cell take part in the demand pass
+    min_lng, min_lat, _, _ = search_box(lngs.min(), lats.min(), max_settlement_distance_km)
+    _, _, max_lng, max_lat = search_box(lngs.max(), lats.max(), max_settlement_distance_km)
+    nearby = np.asarray(settlements.in_bbox(min_lng, min_lat, max_lng, max_lat), dtype=np.int64)
+    population = np.array(
+        [settlements.payloads[i]['population'] or 0 for i in nearby], dtype=np.float64
+    )
+    counts, demand = demand_within(
+        lngs, lats,
+        settlements.lng_array[nearby], settlements.lat_array[nearby],
+        population, max_settlement_distance_km,
+    )
+
+    # Highest demand first; cells with no car washes at all sort as furthest
+    order = np.lexsort((-np.nan_to_num(distance_km, nan=np.inf), -demand))[:limit]
+
+    return [
+        {
+            'id': None,
+            'lat': float(lats[i]),
+            'lng': float(lngs[i]),
+            'name': 'Grid cell',
+            'population': int(demand[i]),
+            'place': None,
+            'min_distance_to_carwash_km': None if np.isnan(distance_km[i]) else float(distance_km[i]),
+            'nearby_settlements': int(counts[i]),
+            'reason': reason,
+        }
+        for i in order
+    ]
+
+
+def recommend_county(county, min_distance_km, max_settlement_distance_km, cell_km=DEFAULT_CELL_KM):
+    lngs, lats = cells_in_polygon(county.geom, cell_km)
+    return rank_cells(
+        lngs, lats, min_distance_km, max_settlement_distance_km,
+        reason=f'Recommended grid cell in {county.name_en}',
+    )
+
+
+def recommend_circle(lng, lat, radius_km, min_distance_km, max_settlement_distance_km,
+                     cell_km=DEFAULT_CELL_KM):
+    lngs, lats = cells_in_circle(lng, lat, radius_km, cell_km)
+    return rank_cells(
+        lngs, lats, min_distance_km, max_settlement_distance_km,
+        reason='Recommended grid cell inside selected circle',
+    )
+
+
+def recommend_polygon(polygon, min_distance_km, max_settlement_distance_km,
+                      cell_km=DEFAULT_CELL_KM):
+    """Best grid cell inside a user-drawn polygon, or None if no cell qualifies."""
+    lngs, lats = cells_in_polygon(polygon, cell_km)
+    best = rank_cells(
+        lngs, lats, min_distance_km, max_settlement_distance_km,
+        reason='Recommended grid cell inside selected polygon', limit=1,
+    )
+    return best[0] if best else None
@@ -0,0 +1,116 @@
+"""
+Irish Transverse Mercator (EPSG:2157) shadow geometry.
+
+The carwash and population_points tables carry a geom_itm column next
+to wkb_geometry. testapp_savedrecommendation carries point_itm next to
+point. Each has a GiST index, and a trigger keeps it in sync on every
+insert or update, so ORM writes and bulk imports never need to set it.
+
+Metres in ITM are planar. That lets distance queries use ST_DWithin and
+the <-> KNN operator directly on the index, with radii in real
+kilometres. Degrees of SRID 4326 can't do that. ITM's scale error over
+Ireland is below 0.1%.
+
+ogr2ogr -overwrite recreates its tables, so bump_dataset_version calls
+ensure_shadow_geometry() after every import. That is the only place the
+columns are (re)created: request paths never run DDL. If an import
+skipped that step, the queries that read geom_itm fail, and
+ShadowGeometryMiddleware turns the error into a 503 that says which
+command to run (shadow_geometry_missing()). Plain ORM reads defer
+point_itm, so they keep working meanwhile.
+"""
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import ProgrammingError, connection
+from django.db.models import Q
+
+from .models import Location, PopulationPoint
+
+ITM_SRID = 2157
+
+# Imported tables that get a geom_itm shadow of wkb_geometry
+SHADOW_TABLES = ('carwash', 'population_points')
+
+SHADOW_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION set_geom_itm() RETURNS trigger AS $$
+    BEGIN
+        NEW.geom_itm := ST_Transform(NEW.wkb_geometry, 2157);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def shadow_table_sql(table):
+    """Idempotent statements adding, filling and indexing geom_itm on a table."""
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS geom_itm geometry(Point, 2157);",
+        f"UPDATE {table} SET geom_itm = ST_Transform(wkb_geometry, 2157) WHERE geom_itm IS NULL;",
+        f"CREATE INDEX IF NOT EXISTS {table}_geom_itm_gist_idx ON {table} USING GIST (geom_itm);",
+        f"DROP TRIGGER IF EXISTS {table}_geom_itm_sync ON {table};",
+        f"CREATE TRIGGER {table}_geom_itm_sync BEFORE INSERT OR UPDATE OF wkb_geometry ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION set_geom_itm();",
+    ]
+
+
+def ensure_shadow_geometry(tables=SHADOW_TABLES):
+    """(Re)create the geom_itm column, index and trigger after an import."""
+    with connection.cursor() as cursor:
+        cursor.execute(SHADOW_FUNCTION_SQL)
+        for table in tables:
+            for statement in shadow_table_sql(table):
+                cursor.execute(statement)
+
+
+# SQLSTATE of "column does not exist"
+UNDEFINED_COLUMN = '42703'
+
+MISSING_MESSAGE = (
+    'The ITM distance columns are missing (the data was re-imported); '
+    'run python manage.py bump_dataset_version'
+)
+
+
+def shadow_geometry_missing(error):
+    """True if a database error was caused by a geom_itm column an import dropped."""
+    return (
+        isinstance(error, ProgrammingError)
+        and getattr(error.__cause__, 'pgcode', None) == UNDEFINED_COLUMN
+        and 'geom_itm' in str(error)
+    )
+
+
+def to_itm(lng, lat):
+    return Point(lng, lat, srid=4326).transform(ITM_SRID, clone=True)
+
+
+def within(lng, lat, radius_km, field='point_itm'):
+    """ORM filter: `field` is within radius_km of (lng, lat), index-assisted."""
+    return Q(**{f'{field}__dwithin': (to_itm(lng, lat), D(km=radius_km))})
+
+
+KNN_SQL = """
+    SELECT t.*, ST_Distance(t.geom_itm, q.geom) / 1000.0 AS distance_km
+    FROM {table} t,
+         (SELECT ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), 4326), 2157) AS geom) q
+    WHERE t.geom_itm IS NOT NULL
+    ORDER BY t.geom_itm <-> q.geom
+    LIMIT %s
+"""
+
+
+def _nearest(model, lng, lat, limit):
+    return list(model.objects.raw(KNN_SQL.format(table=model._meta.db_table), [lng, lat, limit]))
+
+
+def nearest_carwashes(lng, lat, limit=10):
+    """
+    The `limit` nearest Location rows, each with a distance_km attribute,
+    found by a KNN index scan.
+    """
+    return _nearest(Location, lng, lat, limit)
+
+
+def nearest_settlements(lng, lat, limit=10):
+    """Like nearest_carwashes(), for PopulationPoint rows."""
+    return _nearest(PopulationPoint, lng, lat, limit)
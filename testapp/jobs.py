@@ -0,0 +1,256 @@
+"""
+Background execution of circle and polygon recommendations.
+
+A large polygon can keep a request busy for seconds, so the job API
+accepts the same parameters, records a RecommendationJob row and returns
+straight away. The work runs on a thread pool in the worker process that
+accepted it. No broker is needed. Status and results live in the
+database, so any worker can answer a poll or a cancellation.
+
+- The number of jobs waiting in or running on a worker's pool is capped
+  at RECOMMENDATION_JOB_MAX_QUEUED; beyond that submit() raises QueueFull.
+- Cancelling a queued job stops it from starting. Cancelling a running
+  job discards its result when it finishes.
+- While a worker holds queued or running jobs, a heartbeat thread
+  refreshes their heartbeat_at every RECOMMENDATION_JOB_HEARTBEAT_SECONDS,
+  however long they take. A job whose heartbeat is older than
+  RECOMMENDATION_JOB_STALE_SECONDS is marked failed, since the worker that
+  held it was restarted or killed. This is checked on submit and on every
+  poll rather than at startup, because other workers may still be running
+  their own jobs.
+- A long-poll blocks one request thread for up to
+  RECOMMENDATION_JOB_MAX_WAIT_SECONDS, so a handful of clients waiting at
+  once can tie up a small WSGI thread pool; keep the cap short.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from . import recommendations
+from .models import RecommendationJob
+from .serializers import CarwashRecommendationSerializer
+
+logger = logging.getLogger(__name__)
+
+# Seconds between status checks while long-polling
+POLL_INTERVAL = 0.25
+
+
+class QueueFull(Exception):
+    """Raised when this worker already has the maximum number of jobs."""
+
+
+def parse_circle_params(data):
+    """Validate circle parameters; raises TypeError/ValueError on bad input."""
+    return {
+        'lat': float(data.get('lat')),
+        'lng': float(data.get('lng')),
+        'radius_km': float(data.get('radius_km', 10)),
+        'min_distance_km': float(data.get('min_distance_km', 5)),
+        'max_settlement_distance_km': float(data.get('max_settlement_distance_km', 10)),
+    }
+
+
+def parse_polygon_params(data):
+    """Validate polygon parameters; raises on bad input."""
+    geometry = data.get('geometry')
+    # Parse once up front so invalid GeoJSON is rejected at submit time
+    GEOSGeometry(json.dumps(geometry), srid=4326)
+    return {
+        'geometry': geometry,
+        'min_distance_km': float(data.get('min_distance_km', 5)),
+    }
+
+
+def run_circle(params):
+    candidates = recommendations.recommend_circle(
+        params['lng'],
+        params['lat'],
+        params['radius_km'],
+        params['min_distance_km'],
+        params['max_settlement_distance_km'],
+    )
+    return {'recommendations': CarwashRecommendationSerializer(candidates, many=True).data}
+
+
+def run_polygon(params):
+    polygon = GEOSGeometry(json.dumps(params['geometry']), srid=4326)
+    result = recommendations.recommend_polygon(polygon, params['min_distance_km'])
+    return CarwashRecommendationSerializer(result).data
+
+
+# mode -> (parameter parser, runner)
+MODES = {
+    'circle': (parse_circle_params, run_circle),
+    'polygon': (parse_polygon_params, run_polygon),
+}
+
+_executor = None
+_pending = 0
+# ids of the jobs this process has queued or is running
+_owned = set()
+_lock = threading.Lock()
+
+
+def _heartbeat():
+    """Keep this process's jobs from being taken for orphans, however long they run."""
+    while True:
+        time.sleep(getattr(settings, 'RECOMMENDATION_JOB_HEARTBEAT_SECONDS', 15))
+        with _lock:
+            owned = list(_owned)
+        if not owned:
+            continue
+        try:
+            RecommendationJob.objects.filter(
+                pk__in=owned,
+                status__in=[RecommendationJob.QUEUED, RecommendationJob.RUNNING],
+            ).update(heartbeat_at=timezone.now())
+        except DatabaseError:
+            logger.exception("Recommendation job heartbeat failed")
+        finally:
+            close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'RECOMMENDATION_JOB_WORKERS', 2),
+            thread_name_prefix='recommendation-job',
+        )
+        threading.Thread(target=_heartbeat, name='recommendation-job-heartbeat', daemon=True).start()
+    return _executor
+
+
+def submit(user, mode, data):
+    """
+    Validate parameters, record a job and queue it.
+
+    Raises KeyError for an unknown mode, TypeError/ValueError for bad
+    parameters and QueueFull when this worker is saturated.
+    """
+    global _pending
+
+    parse, _ = MODES[mode]
+    params = parse(data)
+
+    job = None
+    with _lock:
+        if _pending >= getattr(settings, 'RECOMMENDATION_JOB_MAX_QUEUED', 20):
+            raise QueueFull()
+        _pending += 1
+
+    try:
+        _prune_finished_jobs()
+        job = RecommendationJob.objects.create(user=user, mode=mode, params=params)
+        with _lock:
+            _owned.add(job.pk)
+        _get_executor().submit(_execute, job.pk)
+    except Exception:
+        with _lock:
+            _pending -= 1
+            if job is not None:
+                _owned.discard(job.pk)
+        raise
+
+    return job
+
+
+def _execute(job_id):
+    global _pending
+
+    try:
+        # Claim the job; 0 rows means it was cancelled while queued
+        if not RecommendationJob.objects.filter(
+            pk=job_id, status=RecommendationJob.QUEUED
+        ).update(status=RecommendationJob.RUNNING):
+            return
+
+        job = RecommendationJob.objects.get(pk=job_id)
+        _, run = MODES[job.mode]
+        running = RecommendationJob.objects.filter(pk=job_id, status=RecommendationJob.RUNNING)
+
+        try:
+            result = run(job.params)
+        except Exception as e:
+            logger.exception("Recommendation job %s failed", job_id)
+            running.update(status=RecommendationJob.FAILED, error=str(e), finished_at=timezone.now())
+        else:
+            # A cancelled job is no longer RUNNING, so its result is dropped here
+            running.update(status=RecommendationJob.DONE, result=result, finished_at=timezone.now())
+    finally:
+        with _lock:
+            _pending -= 1
+            _owned.discard(job_id)
+        close_old_connections()
+
+
+def cancel(job):
+    """
+    Cancel a queued or running job. Returns False if it already finished.
+    """
+    return bool(
+        RecommendationJob.objects.filter(
+            pk=job.pk,
+            status__in=[RecommendationJob.QUEUED, RecommendationJob.RUNNING],
+        ).update(status=RecommendationJob.CANCELLED, finished_at=timezone.now())
+    )
+
+
+def _stale_jobs():
+    stale_before = timezone.now() - timedelta(
+        seconds=getattr(settings, 'RECOMMENDATION_JOB_STALE_SECONDS', 120)
+    )
+    return RecommendationJob.objects.filter(
+        status__in=[RecommendationJob.QUEUED, RecommendationJob.RUNNING],
+        heartbeat_at__lt=stale_before,
+    )
+
+
+def _fail_stale(jobs):
+    return jobs.update(
+        status=RecommendationJob.FAILED,
+        error='The worker running this job stopped before it finished',
+        finished_at=timezone.now(),
+    )
+
+
+def fail_if_stale(job):
+    """
+    Mark a job failed if its worker stopped sending heartbeats, e.g.
+    because it was restarted. Returns the (reloaded) job.
+    """
+    if not job.is_finished and _fail_stale(_stale_jobs().filter(pk=job.pk)):
+        job.refresh_from_db()
+    return job
+
+
+def wait(job, timeout):
+    """
+    Long-poll: reload the job until it finishes or timeout seconds pass.
+
+    The calling request thread is blocked (polling the database every
+    POLL_INTERVAL) for up to RECOMMENDATION_JOB_MAX_WAIT_SECONDS.
+    """
+    timeout = min(timeout, getattr(settings, 'RECOMMENDATION_JOB_MAX_WAIT_SECONDS', 10))
+    deadline = time.monotonic() + timeout
+
+    while not job.is_finished and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        job.refresh_from_db()
+    return job
+
+
+def _prune_finished_jobs():
+    retention = timedelta(seconds=getattr(settings, 'RECOMMENDATION_JOB_RETENTION_SECONDS', 86400))
+    RecommendationJob.objects.filter(finished_at__lt=timezone.now() - retention).delete()
+    # Jobs orphaned by a worker restart would otherwise stay pending forever
+    _fail_stale(_stale_jobs())
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from testapp.county_assignment import LOADERS, assign_counties
+
+
+class Command(BaseCommand):
+    help = 'Recompute the county_assignment table (which county each car wash / settlement is in)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'datasets',
+            nargs='*',
+            help=f"Datasets to assign: {', '.join(LOADERS)} (default: all)",
+        )
+
+    def handle(self, *args, **options):
+        datasets = options['datasets'] or list(LOADERS)
+        unknown = set(datasets) - set(LOADERS)
+        if unknown:
+            raise CommandError(f"Unknown dataset(s): {', '.join(sorted(unknown))}")
+
+        for name in datasets:
+            assigned = assign_counties(name)
+            self.stdout.write(self.style.SUCCESS(f"Assigned {assigned} {name} points to counties"))
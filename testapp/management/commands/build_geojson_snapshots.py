@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from testapp import county_topology
+from testapp.geojson_snapshots import SNAPSHOTS, build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the precompressed snapshots: carwashes.geojson, counties.geojson and '
+        'the county levels of detail'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names',
+            nargs='*',
+            help=f"Snapshots to rebuild: {', '.join(SNAPSHOTS)} (default: all)",
+        )
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(SNAPSHOTS)
+        unknown = set(names) - set(SNAPSHOTS)
+        if unknown:
+            raise CommandError(f"Unknown snapshot(s): {', '.join(sorted(unknown))}")
+
+        # Re-read the boundaries for the county levels of detail
+        county_topology.reset()
+        for name in names:
+            snapshot = build_snapshot(name)
+            self.stdout.write(self.style.SUCCESS(
+                f"Built {name} snapshot v{snapshot.version} ({', '.join(snapshot.files)})"
+            ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from testapp.county_assignment import assign_counties
+from testapp.dataset_version import CARWASH, POPULATION, bump_version
+from testapp.itm import ensure_shadow_geometry
+
+# Imported table behind each dataset
+TABLES = {CARWASH: 'carwash', POPULATION: 'population_points'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Mark a dataset as changed so workers rebuild their in-memory indexes, '
+        'and reassign its points to counties (run after ogr2ogr imports)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'datasets',
+            nargs='*',
+            help=f'Datasets to bump: {CARWASH}, {POPULATION} (default: all)',
+        )
+
+    def handle(self, *args, **options):
+        datasets = options['datasets'] or [CARWASH, POPULATION]
+        unknown = set(datasets) - {CARWASH, POPULATION}
+        if unknown:
+            raise CommandError(f"Unknown dataset(s): {', '.join(sorted(unknown))}")
+
+        # ogr2ogr -overwrite drops the ITM column and trigger; put them back first
+        ensure_shadow_geometry([TABLES[name] for name in datasets])
+
+        for name in datasets:
+            version = bump_version(name)
+            self.stdout.write(self.style.SUCCESS(f"{name} dataset is now at version {version}"))
+            assigned = assign_counties(name)
+            self.stdout.write(self.style.SUCCESS(f"Assigned {assigned} {name} points to counties"))
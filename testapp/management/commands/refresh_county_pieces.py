@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from testapp.county_pieces import rebuild_county_pieces
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the county_pieces table (ST_Subdivide of irish_counties); run after importing county boundaries'
+
+    def handle(self, *args, **options):
+        pieces = rebuild_county_pieces()
+        self.stdout.write(self.style.SUCCESS(f"Subdivided counties into {pieces} pieces"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from testapp.county_rollup import refresh_county_rollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the county_wash_rollup table (car wash counts per county and tag)'
+
+    def handle(self, *args, **options):
+        rows = refresh_county_rollup()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} county rollup rows"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from testapp.settlement_features import rebuild_settlement_features, refresh_carwash_features
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed settlement_features table used by the recommenders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--carwashes-only',
+            action='store_true',
+            help='Only recompute nearest car wash columns (after a car wash import)',
+        )
+
+    def handle(self, *args, **options):
+        if options['carwashes_only']:
+            changed = refresh_carwash_features()
+            self.stdout.write(self.style.SUCCESS(f"Updated {changed} settlement feature rows"))
+        else:
+            rows = rebuild_settlement_features()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} settlement feature rows"))
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from testapp import vector_tiles
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete cached vector tiles that show changed features (run after an Overpass refresh '
+        'or import) and pre-render the low zoom levels'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'layers',
+            nargs='*',
+            help=f"Layers to refresh: {', '.join(vector_tiles.LAYERS)} (default: all)",
+        )
+        parser.add_argument(
+            '--max-zoom',
+            type=int,
+            default=getattr(settings, 'TILE_SEED_MAX_ZOOM', 8),
+            help='Pre-render tiles up to this zoom level',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete every cached tile of the layers first (e.g. after a county boundary import)',
+        )
+
+    def handle(self, *args, **options):
+        layers = options['layers'] or list(vector_tiles.LAYERS)
+        unknown = set(layers) - set(vector_tiles.LAYERS)
+        if unknown:
+            raise CommandError(f"Unknown layer(s): {', '.join(sorted(unknown))}")
+
+        for layer in layers:
+            if options['clear']:
+                vector_tiles.clear_layer(layer)
+                self.stdout.write(f"Cleared {layer} tiles")
+            elif vector_tiles.LAYERS[layer][3] is not None:
+                deleted = vector_tiles.sync_layer(layer)
+                self.stdout.write(f"Deleted {deleted} outdated {layer} tiles")
+
+            rendered = vector_tiles.seed_layer(layer, options['max_zoom'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Rendered {rendered} {layer} tiles up to zoom {options['max_zoom']}"
+            ))
@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand
 from django.contrib.gis.geos import Point
 from django.contrib.gis.db.models.functions import Distance
 from testapp.models import Location, IrishCounty, PopulationPoint
+from testapp import county_assignment, county_pieces
+from testapp.dataset_version import CARWASH
 import time
 
 class Command(BaseCommand):
@@ -41,6 +43,26 @@ class Command(BaseCommand):
             f"Car washes in county '{county.display_name}': {query_time:.2f}ms, found {len(washes_in_county)}"
         )
 
+        # Test: The same county via the subdivided county pieces
+        start_time = time.time()
+        washes_in_county = list(Location.objects.filter(county_pieces.in_county(county.id)))
+        end_time = time.time()
+        query_time = (end_time - start_time) * 1000
+        self.stdout.write(
+            f"Car washes in county '{county.display_name}' (county_pieces): {query_time:.2f}ms, found {len(washes_in_county)}"
+        )
+
+        # Test: The same county via the precomputed county assignments
+        start_time = time.time()
+        washes_in_county = list(Location.objects.filter(
+            id__in=county_assignment.point_ids(CARWASH, county.id)
+        ))
+        end_time = time.time()
+        query_time = (end_time - start_time) * 1000
+        self.stdout.write(
+            f"Car washes in county '{county.display_name}' (county_assignment): {query_time:.2f}ms, found {len(washes_in_county)}"
+        )
+
         # Test: Population points within a buffer/circle
         search_point = Point(-6.2603, 53.3498, srid=4326)  # Dublin
         buffer = search_point.buffer(0.05)  # ~5.5km radius
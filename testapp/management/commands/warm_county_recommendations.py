@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from testapp import result_cache
+from testapp.models import IrishCounty
+
+
+class Command(BaseCommand):
+    help = 'Pre-compute county recommendations into the shared recommendation cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-distance-km', type=float, default=5)
+        parser.add_argument('--max-settlement-distance-km', type=float, default=10)
+
+    def handle(self, *args, **options):
+        counties = IrishCounty.objects.order_by('id')
+        for county in counties:
+            start_time = time.time()
+            candidates = result_cache.recommend_county(
+                county.id,
+                options['min_distance_km'],
+                options['max_settlement_distance_km'],
+            )
+            query_time = (time.time() - start_time) * 1000
+            self.stdout.write(
+                f"{county.display_name}: {query_time:.2f}ms, {len(candidates)} recommendations"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Warmed {counties.count()} counties"))
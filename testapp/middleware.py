@@ -0,0 +1,26 @@
+import logging
+
+from django.http import JsonResponse
+
+from . import itm
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowGeometryMiddleware:
+    """
+    Answer 503 with the repair command when a query fails because an
+    ogr2ogr re-import dropped geom_itm (see itm.py), instead of a bare 500.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not itm.shadow_geometry_missing(exception):
+            return None
+        logger.error("%s: %s", request.path, exception)
+        return JsonResponse({'error': itm.MISSING_MESSAGE}, status=503)
@@ -0,0 +1,32 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0004_datasetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementFeature',
+            fields=[
+                ('settlement_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=200, null=True)),
+                ('population', models.IntegerField(blank=True, null=True)),
+                ('place', models.CharField(blank=True, max_length=50, null=True)),
+                ('point', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('nearest_carwash_id', models.CharField(blank=True, max_length=32, null=True)),
+                ('nearest_carwash_km', models.FloatField(blank=True, db_index=True, null=True)),
+                ('neighbours_5km', models.IntegerField(default=0)),
+                ('neighbours_10km', models.IntegerField(default=0)),
+                ('neighbours_20km', models.IntegerField(default=0)),
+                ('carwash_version', models.PositiveIntegerField(default=0)),
+                ('population_version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'settlement_features',
+            },
+        ),
+    ]
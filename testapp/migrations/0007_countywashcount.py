@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-16 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0006_recommendationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountyWashCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('county_id', models.IntegerField(db_index=True)),
+                ('county_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('brand', models.CharField(blank=True, max_length=100, null=True)),
+                ('operator', models.CharField(blank=True, max_length=100, null=True)),
+                ('self_service', models.CharField(blank=True, max_length=10, null=True)),
+                ('wash_count', models.IntegerField(default=0)),
+                ('carwash_version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'county_wash_rollup',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-16 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0007_countywashcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountyAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(max_length=50)),
+                ('point_id', models.CharField(max_length=32)),
+                ('county_id', models.IntegerField()),
+                ('dataset_version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'county_assignment',
+                'unique_together': {('dataset', 'point_id')},
+                'indexes': [models.Index(fields=['dataset', 'county_id'], name='county_assignment_county_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-16 14:31
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0008_countyassignment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountyPiece',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('county_id', models.IntegerField(db_index=True)),
+                ('geom', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+            ],
+            options={
+                'db_table': 'county_pieces',
+            },
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.7 on 2026-10-16 15:20
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+SHADOW_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION set_geom_itm() RETURNS trigger AS $$
+    BEGIN
+        NEW.geom_itm := ST_Transform(NEW.wkb_geometry, 2157);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+"""
+
+SAVED_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION set_point_itm() RETURNS trigger AS $$
+    BEGIN
+        NEW.point_itm := ST_Transform(NEW.point, 2157);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def shadow_table_sql(table):
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS geom_itm geometry(Point, 2157);",
+        f"UPDATE {table} SET geom_itm = ST_Transform(wkb_geometry, 2157) WHERE geom_itm IS NULL;",
+        f"CREATE INDEX IF NOT EXISTS {table}_geom_itm_gist_idx ON {table} USING GIST (geom_itm);",
+        f"DROP TRIGGER IF EXISTS {table}_geom_itm_sync ON {table};",
+        f"CREATE TRIGGER {table}_geom_itm_sync BEFORE INSERT OR UPDATE OF wkb_geometry ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION set_geom_itm();",
+    ]
+
+
+def drop_shadow_table_sql(table):
+    return [
+        f"DROP TRIGGER IF EXISTS {table}_geom_itm_sync ON {table};",
+        f"ALTER TABLE {table} DROP COLUMN IF EXISTS geom_itm;",
+    ]
+
+
+def shadow_field():
+    return django.contrib.gis.db.models.fields.PointField(
+        blank=True, db_column='geom_itm', editable=False, null=True, srid=2157
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0009_countypiece'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SHADOW_FUNCTION_SQL, reverse_sql="DROP FUNCTION IF EXISTS set_geom_itm();"),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(shadow_table_sql('carwash'), reverse_sql=drop_shadow_table_sql('carwash')),
+                migrations.RunSQL(
+                    shadow_table_sql('population_points'),
+                    reverse_sql=drop_shadow_table_sql('population_points'),
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(model_name='location', name='point_itm', field=shadow_field()),
+                migrations.AddField(model_name='populationpoint', name='point_itm', field=shadow_field()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='savedrecommendation',
+            name='point_itm',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, null=True, srid=2157),
+        ),
+        migrations.RunSQL(
+            [
+                SAVED_FUNCTION_SQL,
+                "UPDATE testapp_savedrecommendation SET point_itm = ST_Transform(point, 2157);",
+                "CREATE TRIGGER savedrecommendation_point_itm_sync BEFORE INSERT OR UPDATE OF point "
+                "ON testapp_savedrecommendation FOR EACH ROW EXECUTE FUNCTION set_point_itm();",
+            ],
+            reverse_sql=[
+                "DROP TRIGGER IF EXISTS savedrecommendation_point_itm_sync ON testapp_savedrecommendation;",
+                "DROP FUNCTION IF EXISTS set_point_itm();",
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-16 16:05
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0010_itm_shadow_geometry'),
+    ]
+
+    operations = [
+        # The rollup is rebuilt on first read; clear any duplicated rows
+        migrations.RunSQL("DELETE FROM county_wash_rollup", migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='countywashcount',
+            constraint=models.UniqueConstraint(
+                models.F('county_id'),
+                django.db.models.functions.comparison.Coalesce('brand', models.Value('')),
+                django.db.models.functions.comparison.Coalesce('operator', models.Value('')),
+                django.db.models.functions.comparison.Coalesce('self_service', models.Value('')),
+                name='county_wash_rollup_unique_row',
+            ),
+        ),
+    ]
@@ -1,5 +1,21 @@
+import uuid
+
 from django.contrib.gis.db import models 
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+
+class ShadowGeometryManager(models.Manager):
+    """
+    Defers point_itm, so plain reads of an imported table work even when
+    a re-import dropped geom_itm. Distance queries name it explicitly.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('point_itm')
+
  
 class Location(models.Model):
     """Model matching the imported 'carwash' table from OSM/GeoJSON"""
@@ -18,12 +34,16 @@ class Location(models.Model):
     addr_street = models.CharField(max_length=100, blank=True, null=True, db_column='addr:street')
     addr_postcode = models.CharField(max_length=20, blank=True, null=True, db_column='addr:postcode')
     point = models.PointField(db_column='wkb_geometry')
+    # ITM shadow of point, maintained by a database trigger (see testapp/itm.py)
+    point_itm = models.PointField(srid=2157, db_column='geom_itm', blank=True, null=True, editable=False)
     website = models.CharField(max_length=200, blank=True, null=True)
     phone = models.CharField(max_length=50, blank=True, null=True)
     opening_hours = models.CharField(max_length=100, blank=True, null=True)
     email = models.CharField(max_length=100, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
 
+    objects = ShadowGeometryManager()
+
     def __str__(self):
         return self.name or self.id
 
@@ -93,6 +113,10 @@ class PopulationPoint(models.Model):
     place_county = models.CharField(max_length=100, blank=True, null=True)
     is_in = models.CharField(max_length=100, blank=True, null=True)
     point = models.PointField(db_column='wkb_geometry')
+    # ITM shadow of point, maintained by a database trigger (see testapp/itm.py)
+    point_itm = models.PointField(srid=2157, db_column='geom_itm', blank=True, null=True, editable=False)
+
+    objects = ShadowGeometryManager()
 
     class Meta:
         db_table = 'population_points'
@@ -118,6 +142,8 @@ class SavedRecommendation(models.Model):
     )
 
     point = models.PointField(srid=4326)
+    # ITM shadow of point, maintained by a database trigger (see testapp/itm.py)
+    point_itm = models.PointField(srid=2157, blank=True, null=True, editable=False)
 
     source_type = models.CharField(
         max_length=20,
@@ -129,4 +155,175 @@ class SavedRecommendation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.user.username} - {self.source_type} ({self.created_at.date()})"
\ No newline at end of file
+        return f"{self.user.username} - {self.source_type} ({self.created_at.date()})"
+
+class DatasetVersion(models.Model):
+    """
+    Version counter for an imported spatial dataset.
+
+    Bumped whenever the rows of a dataset are replaced so that per-worker
+    in-memory indexes and caches know they have to rebuild.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'dataset_version'
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class SettlementFeature(models.Model):
+    """
+    Precomputed recommendation features for one PopulationPoint.
+
+    Rebuilt by the refresh_settlement_features command and refreshed
+    incrementally whenever the car wash data is replaced. The
+    carwash_version / population_version columns record which dataset
+    versions the row was computed from.
+    """
+    settlement_id = models.CharField(max_length=32, primary_key=True)
+    name = models.CharField(max_length=200, blank=True, null=True)
+    population = models.IntegerField(blank=True, null=True)
+    place = models.CharField(max_length=50, blank=True, null=True)
+    point = models.PointField(srid=4326)
+    nearest_carwash_id = models.CharField(max_length=32, blank=True, null=True)
+    nearest_carwash_km = models.FloatField(blank=True, null=True, db_index=True)
+    neighbours_5km = models.IntegerField(default=0)
+    neighbours_10km = models.IntegerField(default=0)
+    neighbours_20km = models.IntegerField(default=0)
+    carwash_version = models.PositiveIntegerField(default=0)
+    population_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'settlement_features'
+
+    def __str__(self):
+        return f"{self.name or self.settlement_id} features"
+
+
+class RecommendationJob(models.Model):
+    """
+    A recommendation request executed in the background (see testapp/jobs.py).
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    MODE_CHOICES = [
+        ('circle', 'Circle'),
+        ('polygon', 'Polygon'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recommendation_jobs'
+    )
+
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    params = models.JSONField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the owning worker while the job is queued or running
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED, self.CANCELLED)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.mode} job ({self.status})"
+
+
+class CountyWashCount(models.Model):
+    """
+    Materialised rollup of car washes per county and brand / operator /
+    self_service (see testapp/county_rollup.py).
+
+    Counties without car washes have one row with a count of 0. A NULL
+    dimension means the tag was missing.
+    """
+    county_id = models.IntegerField(db_index=True)
+    county_name = models.CharField(max_length=255, blank=True, null=True)
+    brand = models.CharField(max_length=100, blank=True, null=True)
+    operator = models.CharField(max_length=100, blank=True, null=True)
+    self_service = models.CharField(max_length=10, blank=True, null=True)
+    wash_count = models.IntegerField(default=0)
+    carwash_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'county_wash_rollup'
+        constraints = [
+            # NULL dimensions are coalesced so a missing tag still collides
+            models.UniqueConstraint(
+                F('county_id'),
+                Coalesce('brand', Value('')),
+                Coalesce('operator', Value('')),
+                Coalesce('self_service', Value('')),
+                name='county_wash_rollup_unique_row',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.county_name}: {self.wash_count}"
+
+
+class CountyAssignment(models.Model):
+    """
+    The county a car wash or settlement lies in (see testapp/county_assignment.py).
+
+    A side table, because the carwash and population_points tables are
+    imported by ogr2ogr. dataset is a DatasetVersion name and point_id
+    the Location / PopulationPoint id. Points outside every county have
+    no row.
+    """
+    dataset = models.CharField(max_length=50)
+    point_id = models.CharField(max_length=32)
+    county_id = models.IntegerField()
+    dataset_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'county_assignment'
+        unique_together = [('dataset', 'point_id')]
+        indexes = [
+            models.Index(fields=['dataset', 'county_id'], name='county_assignment_county_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.dataset} {self.point_id} -> county {self.county_id}"
+
+
+class CountyPiece(models.Model):
+    """
+    One ST_Subdivide()d piece of an IrishCounty boundary (see
+    testapp/county_pieces.py). Each piece has few vertices and a tight
+    bounding box, so GiST-filtered containment tests are cheap.
+    """
+    county_id = models.IntegerField(db_index=True)
+    geom = models.PolygonField(srid=4326)
+
+    class Meta:
+        db_table = 'county_pieces'
+
+    def __str__(self):
+        return f"County {self.county_id} piece {self.pk}"
@@ -0,0 +1,183 @@
+"""
+Nearest car washes answered from the resident car wash index.
+
+/api/nearest and /api/nearby are the busiest public endpoints, because
+the mobile app calls them on every location update. They are answered
+from the per-worker grid index (spatial_index.carwash_index):
+- it uses great-circle distances;
+- it carries each car wash's public fields as its payload;
+- a request does no ORM or serializer work;
+- the only database access is the periodic dataset version check.
+
+The index rebuilds itself when the car wash version changes. If it
+cannot be built (e.g. the database is briefly unavailable at worker
+start), requests fall back to the PostGIS KNN query in itm.py.
+
+nearest_carwashes_many() serves the batch endpoint. It handles many
+points in one vectorised pass over the same index, and its fallback is a
+single LATERAL KNN statement per call. NDJSON batches are read and
+answered in chunks of NEAREST_BATCH_CHUNK_SIZE points
+(parse_point_chunks()), so their memory use does not grow with the input,
+and the fallback runs one statement per chunk.
+"""
+import logging
+from itertools import islice
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from . import itm
+from .distance_kernel import k_nearest
+from .models import Location
+from .serializers import CarwashSerializer
+from .spatial_index import carwash_index, format_address, haversine_km
+
+logger = logging.getLogger(__name__)
+
+
+def _from_postgis(lng, lat, k):
+    return [
+        (row.distance_km, CarwashSerializer(row).data)
+        for row in itm.nearest_carwashes(lng, lat, limit=k)
+    ]
+
+
+def nearest_carwashes(lng, lat, k=10):
+    """
+    The k nearest car washes as [(distance_km, fields), ...], nearest first.
+
+    fields is the CarwashSerializer representation (id, name, lat, lng,
+    address); treat it as read-only, it is shared between requests.
+    """
+    try:
+        index = carwash_index.get()
+    except DatabaseError as e:
+        logger.warning("Car wash index unavailable, using PostGIS: %s", e)
+        return _from_postgis(lng, lat, k)
+
+    return [(distance_km, index.payloads[i]) for distance_km, i in index.nearest(lng, lat, k)]
+
+
+def carwashes_within(lng, lat, radius_km):
+    """
+    Car washes within radius_km as [(distance_km, fields), ...], nearest
+    first. Same fields and fallback as nearest_carwashes().
+    """
+    try:
+        index = carwash_index.get()
+    except DatabaseError as e:
+        logger.warning("Car wash index unavailable, using PostGIS: %s", e)
+        rows = Location.objects.filter(itm.within(lng, lat, radius_km))
+        return sorted(
+            (
+                (haversine_km(lng, lat, row.point.x, row.point.y), CarwashSerializer(row).data)
+                for row in rows
+            ),
+            key=lambda hit: hit[0],
+        )
+
+    return [(distance_km, index.payloads[i]) for distance_km, i in index.within(lng, lat, radius_km)]
+
+
+def _max_points():
+    return getattr(settings, 'NEAREST_BATCH_MAX_POINTS', 50000)
+
+
+def _parse_point(n, item):
+    """(lng, lat) of the n-th input point; raises ValueError if it is malformed."""
+    if n >= _max_points():
+        raise ValueError(f'At most {_max_points()} points per request')
+    try:
+        lat, lng = (item['lat'], item['lng']) if isinstance(item, dict) else item
+        lat, lng = float(lat), float(lng)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f'Point {n} must be [lat, lng] or {{"lat": ..., "lng": ...}}')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError(f'Point {n} is out of range')
+    return lng, lat
+
+
+def parse_points(items):
+    """
+    Turn [lat, lng] pairs or {"lat": ..., "lng": ...} objects into
+    (lngs, lats) lists.
+
+    Raises ValueError for a malformed point or more than
+    NEAREST_BATCH_MAX_POINTS points.
+    """
+    lngs, lats = [], []
+    for n, item in enumerate(items):
+        lng, lat = _parse_point(n, item)
+        lngs.append(lng)
+        lats.append(lat)
+    return lngs, lats
+
+
+def parse_point_chunks(items, chunk_size):
+    """
+    Like parse_points(), but yields (lngs, lats) chunks of at most
+    chunk_size points while items is still being read. A malformed point
+    raises ValueError when its chunk is reached.
+    """
+    items = enumerate(items)
+    while True:
+        chunk = [_parse_point(n, item) for n, item in islice(items, chunk_size)]
+        if not chunk:
+            return
+        lngs, lats = zip(*chunk)
+        yield list(lngs), list(lats)
+
+
+MANY_KNN_SQL = """
+    SELECT q.n - 1, w.id, w.name, w."addr:street", w."addr:city", w."addr:postcode",
+           ST_X(w.wkb_geometry), ST_Y(w.wkb_geometry), w.distance_km
+    FROM unnest(%(lngs)s::float8[], %(lats)s::float8[]) WITH ORDINALITY AS q(lng, lat, n)
+    CROSS JOIN LATERAL (
+        SELECT c.*, ST_Distance(c.geom_itm, p.geom) / 1000.0 AS distance_km
+        FROM carwash c,
+             (SELECT ST_Transform(ST_SetSRID(ST_MakePoint(q.lng, q.lat), 4326), 2157) AS geom) p
+        WHERE c.geom_itm IS NOT NULL
+        ORDER BY c.geom_itm <-> p.geom
+        LIMIT %(k)s
+    ) w
+    ORDER BY q.n, w.distance_km
+"""
+
+
+def _many_from_postgis(lngs, lats, k):
+    with connection.cursor() as cursor:
+        cursor.execute(MANY_KNN_SQL, {'lngs': list(lngs), 'lats': list(lats), 'k': k})
+        rows = cursor.fetchall()
+
+    results = [[] for _ in range(len(lngs))]
+    for n, pk, name, street, city, postcode, lng, lat, distance_km in rows:
+        fields = {
+            'id': pk,
+            'name': name,
+            'lat': lat,
+            'lng': lng,
+            'address': format_address(street, city, postcode),
+        }
+        results[n].append((distance_km, fields))
+    return results
+
+
+def nearest_carwashes_many(lngs, lats, k=1):
+    """
+    nearest_carwashes() for many points at once.
+
+    Returns one [(distance_km, fields), ...] list per input point, in
+    input order.
+    """
+    try:
+        index = carwash_index.get()
+    except DatabaseError as e:
+        logger.warning("Car wash index unavailable, using PostGIS: %s", e)
+        return _many_from_postgis(lngs, lats, k)
+
+    distance_km, nearest = k_nearest(lngs, lats, index.lng_array, index.lat_array, k)
+    payloads = index.payloads
+    return [
+        [(float(d), payloads[i]) for d, i in zip(row_dist, row_idx)]
+        for row_dist, row_idx in zip(distance_km.tolist(), nearest.tolist())
+    ]
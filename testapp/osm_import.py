@@ -5,7 +5,12 @@ from django.conf import settings
 from django.contrib.gis.geos import Point
 from django.db import transaction
 
+from .dataset_version import CARWASH, bump_version
+from . import geo_cache, geojson_snapshots, result_cache, vector_tiles
+from .county_assignment import assign_counties
+from .county_rollup import refresh_county_rollup
 from .models import Location
+from .settlement_features import refresh_carwash_features
 
 logger = logging.getLogger(__name__)
 
@@ -114,6 +119,27 @@ def _element_to_location_kwargs(element: dict) -> dict | None:
     }
 
 
+def carwashes_changed() -> None:
+    """
+    Record that Location rows changed and refresh the data derived from them.
+
+    Bumps the car wash dataset version (so every worker rebuilds its
+    in-memory indexes), updates the county assignments, precomputed
+    settlement features and county rollup, and drops this worker's cached
+    recommendations and geohash cells. Once the change is committed, the
+    car wash GeoJSON snapshot is rebuilt and the outdated car wash vector
+    tiles are deleted.
+    """
+    bump_version(CARWASH)
+    assign_counties(CARWASH)
+    refresh_carwash_features()
+    refresh_county_rollup()
+    result_cache.clear()
+    geo_cache.clear()
+    transaction.on_commit(lambda: geojson_snapshots.build_snapshot('carwashes'))
+    transaction.on_commit(lambda: vector_tiles.sync_layer('carwashes'))
+
+
 @transaction.atomic
 def replace_carwashes_from_overpass() -> Tuple[int, int]:
     """
@@ -144,6 +170,8 @@ def replace_carwashes_from_overpass() -> Tuple[int, int]:
 
     Location.objects.bulk_create(locations, batch_size=500)
 
+    carwashes_changed()
+
     logger.info(
         "Deleted %d existing Location rows, imported %d new car washes from Overpass",
         deleted_count,
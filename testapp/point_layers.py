@@ -0,0 +1,258 @@
+"""
+Compact binary encoding of the point layers for the mobile app.
+
+The car wash GeoJSON repeats every property name for every feature and
+has to be parsed with JSON.parse. This format stores the same points as
+typed arrays that a client can wrap in Float32Array / Uint16Array views
+without parsing:
+
+    magic     4 bytes  b'PTL1'
+    length    uint32   byte length of the JSON header
+    header    JSON, padded with spaces to a multiple of 8 bytes
+    groups    one row group per non-empty grid cell, each 8-byte aligned
+
+Points are bucketed into a grid of POINT_LAYER_CELL_DEG cells over the
+layer's extent. Cells are numbered row-major from the south-west corner,
+and groups are stored in cell order. The header lists every group as
+[cell, byte offset, byte length, count]. A bounding box therefore maps to
+one contiguous byte range per grid row, which the client fetches with an
+HTTP Range request. Within a group the columns follow each other, each
+padded to 4 bytes:
+
+    float32  lng, lat                  (count values each)
+    dict     uint16 codes              (0 = null, else 1 + index into
+                                        header.dictionaries[column])
+    int32    values                    (-1 = null)
+    string   uint32 offsets (count+1)  then the UTF-8 bytes (null = '')
+
+Files are built once per dataset version into POINT_LAYER_DIR and served
+as they are, whole or by range.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .dataset_version import CARWASH, POPULATION, current_version
+from .models import Location, PopulationPoint
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PTL1'
+CONTENT_TYPE = 'application/octet-stream'
+
+# layer -> (model, dataset, [(column, type), ...]) besides lng/lat
+LAYERS = {
+    'carwashes': (Location, CARWASH, [
+        ('id', 'string'),
+        ('name', 'string'),
+        ('brand', 'dict'),
+        ('operator', 'dict'),
+        ('automated', 'dict'),
+        ('self_service', 'dict'),
+    ]),
+    'settlements': (PopulationPoint, POPULATION, [
+        ('id', 'string'),
+        ('name', 'string'),
+        ('place', 'dict'),
+        ('population', 'int32'),
+    ]),
+}
+
+# layer -> (dataset version, path, etag) this worker last built or found
+_current = {}
+_lock = threading.Lock()
+
+
+def _layer_dir():
+    return Path(getattr(settings, 'POINT_LAYER_DIR', Path(settings.BASE_DIR) / 'cache' / 'points'))
+
+
+def _pad(data, multiple):
+    return data + b'\0' * (-len(data) % multiple)
+
+
+def _encode_dict(values):
+    """(uint16 codes, dictionary) with code 0 for null."""
+    dictionary = sorted({v for v in values if v is not None})
+    if len(dictionary) >= 2 ** 16:
+        raise ValueError('Too many distinct values for a dictionary column')
+    lookup = {value: code for code, value in enumerate(dictionary, start=1)}
+    return np.array([lookup.get(v, 0) for v in values], dtype='<u2'), dictionary
+
+
+def _encode_strings(values):
+    blobs = [(v or '').encode() for v in values]
+    offsets = np.zeros(len(blobs) + 1, dtype='<u4')
+    offsets[1:] = np.cumsum([len(b) for b in blobs])
+    return offsets.tobytes() + b''.join(blobs)
+
+
+def encode(lngs, lats, columns, cell_deg):
+    """
+    Encode a point layer. columns is [(name, type, values), ...] with values
+    in the same order as lngs/lats. Returns the file's bytes.
+    """
+    lngs = np.asarray(lngs, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    n = len(lngs)
+
+    if n:
+        min_lng, min_lat = float(lngs.min()), float(lats.min())
+        cols = int((lngs.max() - min_lng) // cell_deg) + 1
+        rows = int((lats.max() - min_lat) // cell_deg) + 1
+    else:
+        min_lng = min_lat = 0.0
+        cols = rows = 1
+    cells = (
+        np.floor((lats - min_lat) / cell_deg).astype(np.int64) * cols
+        + np.floor((lngs - min_lng) / cell_deg).astype(np.int64)
+    )
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+
+    encoded = []
+    dictionaries = {}
+    for name, kind, values in columns:
+        values = [values[i] for i in order]
+        if kind == 'dict':
+            codes, dictionaries[name] = _encode_dict(values)
+            encoded.append((kind, codes))
+        elif kind == 'int32':
+            encoded.append((kind, np.array([-1 if v is None else v for v in values], dtype='<i4')))
+        else:
+            encoded.append((kind, values))
+    lng32 = lngs[order].astype('<f4')
+    lat32 = lats[order].astype('<f4')
+
+    groups = []
+    blocks = []
+    starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]]) if n else np.array([], dtype=np.int64)
+    for start, end in zip(starts, np.r_[starts[1:], n]):
+        parts = [lng32[start:end].tobytes(), lat32[start:end].tobytes()]
+        for kind, data in encoded:
+            if kind == 'string':
+                parts.append(_pad(_encode_strings(data[start:end]), 4))
+            else:
+                parts.append(_pad(data[start:end].tobytes(), 4))
+        block = _pad(b''.join(parts), 8)
+        groups.append([int(cells[start]), len(block), int(end - start)])
+        blocks.append(block)
+
+    def header_bytes(first_offset):
+        offset = first_offset
+        listed = []
+        for cell, length, count in groups:
+            listed.append([cell, offset, length, count])
+            offset += length
+        header = {
+            'count': n,
+            'grid': {
+                'min_lng': min_lng, 'min_lat': min_lat,
+                'cell_deg': cell_deg, 'cols': cols, 'rows': rows,
+            },
+            'columns': [['lng', 'float32'], ['lat', 'float32']]
+            + [[name, kind] for name, kind, _ in columns],
+            'dictionaries': dictionaries,
+            'groups': listed,
+        }
+        data = json.dumps(header, separators=(',', ':')).encode()
+        return data + b' ' * (-(len(data) + 8) % 8)
+
+    # Group offsets depend on the header's length; settle it by iterating
+    header = header_bytes(0)
+    while True:
+        candidate = header_bytes(8 + len(header))
+        if len(candidate) == len(header):
+            header = candidate
+            break
+        header = candidate
+
+    return MAGIC + struct.pack('<I', len(header)) + header + b''.join(blocks)
+
+
+def _load(layer):
+    model, _, columns = LAYERS[layer]
+    names = [name for name, _ in columns]
+    rows = list(model.objects.values_list('point', *names))
+    return (
+        [row[0].x for row in rows],
+        [row[0].y for row in rows],
+        [(name, kind, [row[1 + i] for row in rows]) for i, (name, kind) in enumerate(columns)],
+    )
+
+
+def _write(path, data):
+    # Write to a temporary file and rename it, so readers never see a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(layer):
+    """Encode a layer for its current dataset version. Returns (path, etag)."""
+    version = current_version(LAYERS[layer][1])
+    lngs, lats, columns = _load(layer)
+    data = encode(lngs, lats, columns, getattr(settings, 'POINT_LAYER_CELL_DEG', 0.25))
+
+    path = _layer_dir() / f'{layer}-v{version}.bin'
+    _write(path, data)
+    for old in _layer_dir().glob(f'{layer}-v*.bin'):
+        if old != path:
+            old.unlink(missing_ok=True)
+
+    etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+    _current[layer] = (version, path, etag)
+    logger.info("Encoded %s point layer v%s (%d points, %d bytes)", layer, version, len(lngs), len(data))
+    return path, etag
+
+
+def current(layer):
+    """(path, etag) of the layer's file for the current dataset version."""
+    version = current_version(LAYERS[layer][1])
+    cached = _current.get(layer)
+    if cached and cached[0] == version and cached[1].exists():
+        return cached[1], cached[2]
+
+    with _lock:
+        path = _layer_dir() / f'{layer}-v{version}.bin'
+        if path.exists():
+            etag = f'"{hashlib.sha256(path.read_bytes()).hexdigest()[:32]}"'
+            _current[layer] = (version, path, etag)
+            return path, etag
+        return build(layer)
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range "bytes=" header, None when
+    the header should be ignored (absent, malformed or several ranges),
+    or 'unsatisfiable'.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first == '':
+            suffix = int(last)
+            if suffix <= 0:
+                return 'unsatisfiable'
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    if start > end:
+        return None
+    return start, min(end, size - 1)
@@ -0,0 +1,214 @@
+"""
+Set-based PostGIS implementation of the car wash recommenders.
+
+Each recommendation is answered by a single SQL statement:
+
+- candidate settlements are selected by the area predicate,
+- the nearest car wash is found with a KNN (<->) LATERAL join,
+- the min-distance filter and ranking run inside PostGIS,
+- neighbour counts use ST_DWithin, and only for the rows that survive
+  the LIMIT.
+
+Distances use the ITM (EPSG:2157) geom_itm shadow columns (see itm.py),
+so <-> and ST_DWithin work in metres directly on the GiST indexes.
+
+The number of queries per request is therefore constant no matter how
+many settlements fall inside the area. Results have the same shape as
+testapp.recommendations so the two engines are interchangeable.
+"""
+from django.db import connection
+
+from . import county_assignment, county_pieces
+from .dataset_version import POPULATION
+
+# Polygon score of a settlement with no car wash at all, or one at distance
+# 0: dist_km or 1000, the original heuristic. Every engine uses this rule,
+# and breaks ties by settlement id (byte order), so they pick the same best.
+NO_CARWASH_SCORE_KM = 1000.0
+
+# Area predicates, each binding the candidate settlement geometry as p.wkb_geometry
+# Tested against the subdivided county_pieces, which the GiST index can prune
+COUNTY_AREA_SQL = """
+    EXISTS (
+        SELECT 1 FROM county_pieces cp
+        WHERE cp.county_id = %(county_id)s AND ST_Intersects(cp.geom, p.wkb_geometry)
+    )
+"""
+
+# Used instead of COUNTY_AREA_SQL while the county assignments are current
+COUNTY_ASSIGNED_AREA_SQL = """
+    p.id IN (
+        SELECT point_id FROM county_assignment
+        WHERE dataset = %(dataset)s AND county_id = %(county_id)s
+    )
+"""
+
+CIRCLE_AREA_SQL = """
+    ST_DWithin(
+        p.geom_itm,
+        ST_Transform(ST_SetSRID(ST_MakePoint(%(lng)s, %(lat)s), 4326), 2157),
+        %(radius_km)s * 1000
+    )
+"""
+
+POLYGON_AREA_SQL = """
+    ST_Within(p.wkb_geometry, ST_GeomFromEWKT(%(polygon)s))
+"""
+
+CANDIDATES_CTE = """
+    candidates AS (
+        SELECT p.id, p.name, p.population, p.place, p.wkb_geometry AS geom, p.geom_itm
+        FROM population_points p
+        WHERE {area}
+    ),
+    scored AS (
+        SELECT c.*, nearest.dist_km
+        FROM candidates c
+        LEFT JOIN LATERAL (
+            SELECT ST_Distance(w.geom_itm, c.geom_itm) / 1000.0 AS dist_km
+            FROM carwash w
+            ORDER BY w.geom_itm <-> c.geom_itm
+            LIMIT 1
+        ) nearest ON true
+    )
+"""
+
+RANKED_SQL = """
+WITH {candidates},
+ranked AS (
+    SELECT *
+    FROM scored
+    WHERE dist_km IS NULL OR dist_km >= %(min_distance_km)s
+    ORDER BY COALESCE(dist_km, 0) DESC, COALESCE(population, 0) DESC
+    LIMIT %(limit)s
+)
+SELECT
+    r.id, r.name, r.population, r.place,
+    ST_X(r.geom), ST_Y(r.geom), r.dist_km,
+    (
+        SELECT count(*)
+        FROM population_points n
+        WHERE ST_DWithin(n.geom_itm, r.geom_itm, %(neighbour_km)s * 1000)
+    ) AS nearby_settlements
+FROM ranked r
+ORDER BY COALESCE(r.dist_km, 0) DESC, COALESCE(r.population, 0) DESC
+"""
+
+BEST_SQL = """
+WITH {candidates},
+best AS (
+    SELECT *
+    FROM scored
+    WHERE dist_km IS NULL OR dist_km >= %(min_distance_km)s
+    ORDER BY CASE WHEN dist_km IS NULL OR dist_km = 0 THEN %(no_carwash_km)s ELSE dist_km END DESC,
+             id COLLATE "C"
+    LIMIT 1
+)
+SELECT
+    b.id, b.name, b.population, b.place,
+    ST_X(b.geom), ST_Y(b.geom), b.dist_km,
+    (SELECT count(*) FROM candidates) AS total,
+    ST_X(ST_Centroid(ST_GeomFromEWKT(%(polygon)s))),
+    ST_Y(ST_Centroid(ST_GeomFromEWKT(%(polygon)s)))
+FROM (SELECT 1) one
+LEFT JOIN best b ON true
+"""
+
+
+def _candidates_cte(area_sql):
+    return CANDIDATES_CTE.format(area=area_sql)
+
+
+def _ranked(area_sql, params, min_distance_km, max_settlement_distance_km, reason, limit):
+    sql = RANKED_SQL.format(candidates=_candidates_cte(area_sql))
+    params = dict(
+        params,
+        min_distance_km=min_distance_km,
+        neighbour_km=max_settlement_distance_km,
+        limit=limit,
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    return [
+        {
+            'id': pk,
+            'lat': lat,
+            'lng': lng,
+            'name': name,
+            'population': population,
+            'place': place,
+            'min_distance_to_carwash_km': dist_km,
+            'nearby_settlements': nearby,
+            'reason': reason,
+        }
+        for pk, name, population, place, lng, lat, dist_km, nearby in rows
+    ]
+
+
+def recommend_county(county, min_distance_km, max_settlement_distance_km, limit):
+    if county_assignment.current(POPULATION):
+        area_sql, params = COUNTY_ASSIGNED_AREA_SQL, {'dataset': POPULATION, 'county_id': county.id}
+    else:
+        county_pieces.ensure_pieces()
+        area_sql, params = COUNTY_AREA_SQL, {'county_id': county.id}
+
+    return _ranked(
+        area_sql,
+        params,
+        min_distance_km,
+        max_settlement_distance_km,
+        f'Recommended location in {county.name_en}',
+        limit,
+    )
+
+
+def recommend_circle(lng, lat, radius_km, min_distance_km, max_settlement_distance_km, limit):
+    return _ranked(
+        CIRCLE_AREA_SQL,
+        {'lng': lng, 'lat': lat, 'radius_km': radius_km},
+        min_distance_km,
+        max_settlement_distance_km,
+        'Recommended location inside selected circle',
+        limit,
+    )
+
+
+def recommend_polygon(polygon, min_distance_km):
+    sql = BEST_SQL.format(candidates=_candidates_cte(POLYGON_AREA_SQL))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'polygon': polygon.ewkt,
+            'min_distance_km': min_distance_km,
+            'no_carwash_km': NO_CARWASH_SCORE_KM,
+        })
+        pk, name, population, place, lng, lat, dist_km, total, centroid_x, centroid_y = cursor.fetchone()
+
+    if pk is None:
+        return {
+            'lat': centroid_y,
+            'lng': centroid_x,
+            'name': 'Polygon Centroid',
+            'population': None,
+            'min_distance_to_carwash_km': None,
+            'nearby_settlements': total,
+            'reason': (
+                'No suitable settlement found, using centroid' if total
+                else 'No settlements inside polygon, using centroid'
+            ),
+        }
+
+    return {
+        'id': pk,
+        'lat': lat,
+        'lng': lng,
+        'name': name,
+        'population': population,
+        'place': place,
+        'min_distance_to_carwash_km': dist_km,
+        'nearby_settlements': total,
+        'reason': 'Best settlement inside selected polygon',
+    }
@@ -0,0 +1,310 @@
+"""
+Car wash site recommendation logic shared by the map views and the REST API.
+
+Settlements (PopulationPoint rows) are the candidate locations. Each one is
+scored by the great-circle distance to its nearest existing car wash and the
+number of settlements around it. Candidates are selected with the resident
+spatial indexes and scored in blocks by the NumPy distance kernel, then
+streamed through a bounded top-k heap so only the winners pay for the
+neighbour count.
+
+When the request's max_settlement_distance_km is one of the stored radii
+and the settlement_features table is current, the answer is read straight
+from that table (see settlement_features.py). Otherwise setting
+RECOMMENDATION_ENGINE = 'sql' answers with one set-based PostGIS statement
+(see recommendation_sql.py) instead of the in-memory path.
+"""
+import heapq
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Point
+
+from . import county_assignment, recommendation_sql, settlement_features
+from .dataset_version import POPULATION
+from .distance_kernel import count_within, nearest
+from .recommendation_sql import NO_CARWASH_SCORE_KM
+from .spatial_index import carwash_index, settlement_index
+
+DEFAULT_LIMIT = 10
+
+# Candidates scored per distance-kernel call while streaming
+CANDIDATE_BLOCK_SIZE = 4096
+
+
+def _use_sql():
+    return getattr(settings, 'RECOMMENDATION_ENGINE', 'index') == 'sql'
+
+
+def settlements_in_polygon(polygon, settlements=None, include_boundary=False):
+    """
+    Return index positions of settlements strictly inside a polygon.
+
+    With include_boundary, settlements on the boundary count too: the
+    ST_Intersects test the SQL engine runs against county_pieces.
+    """
+    if settlements is None:
+        settlements = settlement_index.get()
+    prepared = polygon.prepared
+    test = prepared.intersects if include_boundary else prepared.contains
+    min_lng, min_lat, max_lng, max_lat = polygon.extent
+    return [
+        i for i in settlements.in_bbox(min_lng, min_lat, max_lng, max_lat)
+        if test(Point(settlements.lngs[i], settlements.lats[i], srid=4326))
+    ]
+
+
+def settlements_in_county(county, settlements=None):
+    """
+    Return index positions of settlements in a county.
+
+    Uses the precomputed county assignments when they are current, and
+    the county geometry otherwise.
+    """
+    if settlements is None:
+        settlements = settlement_index.get()
+    if not county_assignment.current(POPULATION):
+        return settlements_in_polygon(county.geom, settlements, include_boundary=True)
+
+    position = settlements.position
+    return sorted(
+        position[key] for key in county_assignment.point_ids(POPULATION, county.id)
+        if key in position
+    )
+
+
+def settlements_in_circle(lng, lat, radius_km, settlements=None):
+    """
+    Return index positions of settlements within radius_km of a centre.
+    """
+    if settlements is None:
+        settlements = settlement_index.get()
+    return [i for _, i in settlements.within(lng, lat, radius_km)]
+
+
+def _candidate(settlements, i, min_dist_km, nearby_settlements, reason):
+    payload = settlements.payloads[i]
+    return {
+        'id': settlements.keys[i],
+        'lat': settlements.lats[i],
+        'lng': settlements.lngs[i],
+        'name': payload['name'],
+        'population': payload['population'],
+        'place': payload['place'],
+        'min_distance_to_carwash_km': min_dist_km,
+        'nearby_settlements': nearby_settlements,
+        'reason': reason,
+    }
+
+
+def top_k(items, key, k):
+    """
+    Return the k items with the largest key, best first.
+
+    Items are consumed from an iterable into a bounded min-heap, so memory
+    is O(k). Ties keep their input order, like sorted(..., reverse=True).
+    """
+    heap = []
+    for seq, item in enumerate(items):
+        entry = (key(item), -seq, item)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    return [item for _, _, item in sorted(heap, reverse=True)]
+
+
+def _far_enough_settlements(positions, min_distance_km, settlements, carwashes):
+    """
+    Yield (position, distance_km) for settlements at least min_distance_km
+    from the nearest car wash, scoring them block by block.
+    """
+    positions = iter(positions)
+
+    while True:
+        block = np.fromiter(islice(positions, CANDIDATE_BLOCK_SIZE), dtype=np.int64)
+        if not len(block):
+            return
+        distance_km, _ = nearest(
+            settlements.lng_array[block], settlements.lat_array[block],
+            carwashes.lng_array, carwashes.lat_array,
+        )
+        # NaN means there are no car washes at all
+        keep = np.isnan(distance_km) | (distance_km >= min_distance_km)
+        for i, dist in zip(block[keep], distance_km[keep]):
+            yield int(i), None if np.isnan(dist) else float(dist)
+
+
+def rank_settlements(positions, min_distance_km, max_settlement_distance_km, reason,
+                     limit=DEFAULT_LIMIT, settlements=None, carwashes=None):
+    """
+    Score candidate settlements and return the best `limit` of them.
+
+    - Exclude candidates closer than min_distance_km to an existing car wash
+    - Rank by distance from car washes, then by population
+    - Count settlements within max_settlement_distance_km, for the winners only
+
+    settlements / carwashes default to the resident indexes.
+    """
+    if settlements is None:
+        settlements = settlement_index.get()
+    if carwashes is None:
+        carwashes = carwash_index.get()
+
+    def rank_key(scored):
+        i, dist = scored
+        return (dist or 0, settlements.payloads[i]['population'] or 0)
+
+    winners = top_k(
+        _far_enough_settlements(positions, min_distance_km, settlements, carwashes), rank_key, limit
+    )
+    if not winners:
+        return []
+
+    # The ranking does not depend on neighbour counts, so they are only
+    # computed for the settlements that made it into the top k
+    winner_positions = np.array([i for i, _ in winners], dtype=np.int64)
+    neighbour_counts = count_within(
+        settlements.lng_array[winner_positions], settlements.lat_array[winner_positions],
+        settlements.lng_array, settlements.lat_array,
+        max_settlement_distance_km,
+    )
+
+    return [
+        _candidate(settlements, i, dist, int(count), reason)
+        for (i, dist), count in zip(winners, neighbour_counts)
+    ]
+
+
+def recommend_county(county, min_distance_km, max_settlement_distance_km):
+    """
+    Recommend locations among the settlements of an IrishCounty.
+    """
+    reason = f'Recommended location in {county.name_en}'
+
+    if settlement_features.available(max_settlement_distance_km):
+        return settlement_features.ranked(
+            settlement_features.in_county(county),
+            min_distance_km, max_settlement_distance_km, reason, DEFAULT_LIMIT,
+        )
+
+    if _use_sql():
+        return recommendation_sql.recommend_county(
+            county, min_distance_km, max_settlement_distance_km, DEFAULT_LIMIT
+        )
+
+    return rank_settlements(
+        settlements_in_county(county),
+        min_distance_km,
+        max_settlement_distance_km,
+        reason=reason,
+    )
+
+
+def recommend_circle(lng, lat, radius_km, min_distance_km, max_settlement_distance_km):
+    """
+    Recommend locations among the settlements inside a circle.
+    """
+    reason = 'Recommended location inside selected circle'
+
+    if settlement_features.available(max_settlement_distance_km):
+        return settlement_features.ranked(
+            settlement_features.in_circle(lng, lat, radius_km),
+            min_distance_km, max_settlement_distance_km, reason, DEFAULT_LIMIT,
+        )
+
+    if _use_sql():
+        return recommendation_sql.recommend_circle(
+            lng, lat, radius_km, min_distance_km, max_settlement_distance_km, DEFAULT_LIMIT
+        )
+
+    return rank_settlements(
+        settlements_in_circle(lng, lat, radius_km),
+        min_distance_km,
+        max_settlement_distance_km,
+        reason=reason,
+    )
+
+
+def _centroid_result(polygon, nearby_settlements, reason):
+    centroid = polygon.centroid
+    return {
+        'lat': centroid.y,
+        'lng': centroid.x,
+        'name': 'Polygon Centroid',
+        'population': None,
+        'min_distance_to_carwash_km': None,
+        'nearby_settlements': nearby_settlements,
+        'reason': reason,
+    }
+
+
+def recommend_polygon(polygon, min_distance_km):
+    """
+    Pick the single best settlement inside a user-drawn polygon.
+
+    The settlement furthest from any existing car wash wins; if no
+    settlement qualifies the polygon centroid is returned instead.
+    """
+    if settlement_features.available():
+        feature, total = settlement_features.best(
+            settlement_features.in_polygon(polygon), min_distance_km
+        )
+        if feature is not None:
+            return settlement_features.candidate(
+                feature, total, 'Best settlement inside selected polygon'
+            )
+        if total:
+            return _centroid_result(polygon, total, 'No suitable settlement found, using centroid')
+        return _centroid_result(polygon, 0, 'No settlements inside polygon, using centroid')
+
+    if _use_sql():
+        return recommendation_sql.recommend_polygon(polygon, min_distance_km)
+
+    return best_in_polygon(polygon, min_distance_km)
+
+
+def best_in_polygon(polygon, min_distance_km, settlements=None, carwashes=None):
+    """
+    In-memory polygon recommendation (see recommend_polygon).
+
+    settlements / carwashes default to the resident indexes.
+    """
+    if settlements is None:
+        settlements = settlement_index.get()
+    if carwashes is None:
+        carwashes = carwash_index.get()
+
+    positions = settlements_in_polygon(polygon, settlements)
+
+    if not positions:
+        return _centroid_result(polygon, 0, 'No settlements inside polygon, using centroid')
+
+    positions = np.asarray(positions, dtype=np.int64)
+
+    distance_km, _ = nearest(
+        settlements.lng_array[positions], settlements.lat_array[positions],
+        carwashes.lng_array, carwashes.lat_array,
+    )
+    no_carwash = np.isnan(distance_km)
+    eligible = no_carwash | (distance_km >= min_distance_km)
+
+    # Furthest from any car wash wins, with the same no-car-wash score and
+    # settlement id tie-break as the SQL engines
+    score = np.where(no_carwash | (distance_km == 0), NO_CARWASH_SCORE_KM, distance_km)
+    score = np.where(eligible, score, -np.inf)
+    if not eligible.any():
+        return _centroid_result(
+            polygon, len(positions), 'No suitable settlement found, using centroid'
+        )
+    best = min(
+        np.flatnonzero(score == score.max()),
+        key=lambda j: settlements.keys[positions[j]].encode(),
+    )
+
+    best_dist_km = None if no_carwash[best] else float(distance_km[best])
+    return _candidate(
+        settlements, int(positions[best]), best_dist_km, len(positions),
+        'Best settlement inside selected polygon',
+    )
@@ -0,0 +1,132 @@
+"""
+Memoised county recommendations.
+
+recommend_county is called with a small fixed set of county ids and a
+handful of slider values, so its answers are cached under
+(county_id, quantised min_distance_km, quantised max_settlement_distance_km,
+dataset versions).
+
+There are two levels:
+
+- a per-worker LRU with a TTL, which answers repeat clicks without touching
+  the database;
+- the Django cache alias named by RECOMMENDATION_CACHE_ALIAS, shared
+  between workers, which the warm_county_recommendations command fills.
+
+Bumping a dataset version (e.g. an Overpass refresh) changes the key, so
+stale answers are never served; clear() drops them eagerly.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import recommendations
+from .dataset_version import CARWASH, POPULATION, current_version
+from .models import IrishCounty
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache whose entries expire after
+    ttl_seconds.
+    """
+
+    def __init__(self, maxsize=256, ttl_seconds=3600):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+county_recommendations = LRUCache(
+    maxsize=getattr(settings, 'RECOMMENDATION_CACHE_SIZE', 512),
+    ttl_seconds=getattr(settings, 'RECOMMENDATION_CACHE_TTL', 3600),
+)
+
+
+def quantise_km(value):
+    """
+    Snap a distance to the RECOMMENDATION_CACHE_QUANTUM_KM grid (the step
+    of the sidebar inputs) so equivalent requests share a cache entry.
+    """
+    quantum = getattr(settings, 'RECOMMENDATION_CACHE_QUANTUM_KM', 0.1)
+    return round(round(float(value) / quantum) * quantum, 6)
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'RECOMMENDATION_CACHE_ALIAS', 'default')]
+
+
+def _cache_key(county_id, min_distance_km, max_settlement_distance_km):
+    return (
+        int(county_id),
+        min_distance_km,
+        max_settlement_distance_km,
+        current_version(CARWASH),
+        current_version(POPULATION),
+    )
+
+
+def recommend_county(county_id, min_distance_km, max_settlement_distance_km):
+    """
+    Cached recommendations.recommend_county() for a county id.
+
+    Distances are quantised before computing, so a cached answer is always
+    exactly the answer for its key. Raises IrishCounty.DoesNotExist for an
+    unknown county.
+    """
+    min_distance_km = quantise_km(min_distance_km)
+    max_settlement_distance_km = quantise_km(max_settlement_distance_km)
+    key = _cache_key(county_id, min_distance_km, max_settlement_distance_km)
+
+    result = county_recommendations.get(key)
+    if result is not None:
+        return result
+
+    shared_key = 'recommend_county:' + ':'.join(str(part) for part in key)
+    result = _shared_cache().get(shared_key)
+    if result is None:
+        county = IrishCounty.objects.get(id=county_id)
+        result = recommendations.recommend_county(
+            county, min_distance_km, max_settlement_distance_km
+        )
+        _shared_cache().set(shared_key, result, county_recommendations.ttl_seconds)
+
+    county_recommendations.set(key, result)
+    return result
+
+
+def clear():
+    """Drop this worker's cached recommendations (other workers rely on the version key)."""
+    county_recommendations.clear()
@@ -0,0 +1,151 @@
+"""
+Car washes along a route ("car washes on my way").
+
+The route arrives as an encoded polyline (Google / OSRM format). It is
+projected to ITM once and cut into pieces of at most
+ROUTE_CORRIDOR_SEGMENT_KM. Each piece is matched against carwash.geom_itm
+with ST_DWithin. One buffer polygon around a cross-country route would
+have a bounding box covering half the country, so the GiST index would
+let almost everything through. A short piece has a small box, and the
+index does the work.
+
+Pieces are queried in route order, and each piece's results are ordered
+by ST_LineLocatePoint. That makes the output ordered by distance along the
+route without collecting it first. carwashes_along() is a generator, so
+memory stays flat however long the route is.
+"""
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import LineString
+from django.db import connection
+
+from .itm import ITM_SRID
+from .spatial_index import format_address
+
+SEGMENT_SQL = """
+    SELECT w.id, w.name, w."addr:street", w."addr:city", w."addr:postcode",
+           ST_X(w.wkb_geometry), ST_Y(w.wkb_geometry),
+           ST_Distance(w.geom_itm, s.geom) AS offset_m,
+           ST_LineLocatePoint(s.geom, w.geom_itm) * ST_Length(s.geom) AS along_m
+    FROM carwash w, (SELECT %(segment)s::geometry AS geom) s
+    WHERE ST_DWithin(w.geom_itm, s.geom, %(width_m)s)
+    ORDER BY along_m
+"""
+
+
+def decode_polyline(encoded, precision=5):
+    """
+    Decode an encoded polyline into [(lat, lng), ...].
+
+    Raises ValueError if the string is truncated or has invalid characters.
+    """
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= len(encoded):
+                    raise ValueError('Truncated polyline')
+                byte = ord(encoded[index]) - 63
+                index += 1
+                if not 0 <= byte < 64:
+                    raise ValueError('Invalid polyline character')
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append((lat / factor, lng / factor))
+
+    return coordinates
+
+
+def parse_route(encoded, precision=5):
+    """
+    Decode and validate a route. Returns [(lat, lng), ...] with at least
+    two points; raises ValueError otherwise.
+    """
+    if precision not in (5, 6):
+        raise ValueError('precision must be 5 or 6')
+    points = decode_polyline(encoded, precision)
+
+    max_points = getattr(settings, 'ROUTE_CORRIDOR_MAX_POINTS', 20000)
+    if len(points) > max_points:
+        raise ValueError(f'At most {max_points} route points')
+    if len(points) < 2:
+        raise ValueError('A route needs at least two points')
+    if not all(-90 <= lat <= 90 and -180 <= lng <= 180 for lat, lng in points):
+        raise ValueError('Route point out of range')
+    return points
+
+
+def segments(coords, max_length):
+    """
+    Cut a planar line into consecutive pieces of at most max_length.
+
+    Yields (offset, piece): piece is a list of (x, y) vertices, offset the
+    length of the line before it. Long edges are split by interpolation,
+    so every piece is short even on a straight motorway.
+    """
+    piece = [coords[0]]
+    piece_length = offset = 0.0
+
+    for (x0, y0), (x1, y1) in zip(coords, coords[1:]):
+        edge = math.hypot(x1 - x0, y1 - y0)
+        done = 0.0
+        while piece_length + (edge - done) > max_length:
+            done += max_length - piece_length
+            cut = (x0 + (x1 - x0) * done / edge, y0 + (y1 - y0) * done / edge)
+            piece.append(cut)
+            yield offset, piece
+            offset += max_length
+            piece, piece_length = [cut], 0.0
+        piece.append((x1, y1))
+        piece_length += edge - done
+
+    if piece_length > 0 or offset == 0:
+        yield offset, piece
+
+
+def carwashes_along(points, width_km):
+    """
+    Yield the car washes within width_km of the route, ordered by distance
+    along it.
+
+    points is [(lat, lng), ...] as returned by parse_route(). Each car wash
+    is a dict with the CarwashSerializer fields plus distance_km (from the
+    route) and along_km (from the start of the route). A car wash near
+    several pieces is reported once, at its first.
+    """
+    route = LineString([(lng, lat) for lat, lng in points], srid=4326)
+    route.transform(ITM_SRID)
+    segment_m = getattr(settings, 'ROUTE_CORRIDOR_SEGMENT_KM', 5) * 1000.0
+
+    seen = set()
+    with connection.cursor() as cursor:
+        for offset_m, piece in segments(route.coords, segment_m):
+            segment = LineString(piece, srid=ITM_SRID)
+            cursor.execute(SEGMENT_SQL, {
+                'segment': segment.hexewkb.decode(),
+                'width_m': width_km * 1000.0,
+            })
+            for pk, name, street, city, postcode, lng, lat, offset_from_route, along_m in cursor.fetchall():
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                yield {
+                    'id': pk,
+                    'name': name,
+                    'lat': lat,
+                    'lng': lng,
+                    'address': format_address(street, city, postcode),
+                    'distance_km': offset_from_route / 1000.0,
+                    'along_km': (offset_m + along_m) / 1000.0,
+                }
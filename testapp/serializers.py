@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
-from .models import Location, IrishCounty, IrishCounty, SavedRecommendation
+from .models import Location, IrishCounty, IrishCounty, SavedRecommendation, RecommendationJob
 
 class CarwashSerializer(serializers.ModelSerializer):
     lat = serializers.SerializerMethodField()
@@ -85,6 +85,9 @@ class CarwashRecommendationSerializer(serializers.Serializer):
     nearby_settlements = serializers.IntegerField()
     reason = serializers.CharField()
 
+class CoverageSiteSerializer(CarwashRecommendationSerializer):
+    covered_population = serializers.IntegerField()
+
 class SavedRecommendationSerializer(serializers.ModelSerializer):
     lat = serializers.SerializerMethodField()
     lng = serializers.SerializerMethodField()
@@ -105,3 +108,16 @@ class SavedRecommendationSerializer(serializers.ModelSerializer):
 
     def get_lng(self, obj):
         return obj.point.x
+
+class RecommendationJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RecommendationJob
+        fields = [
+            'id',
+            'mode',
+            'status',
+            'result',
+            'error',
+            'created_at',
+            'finished_at'
+        ]
@@ -0,0 +1,229 @@
+"""
+Precomputed settlement features (the settlement_features table).
+
+For every PopulationPoint the table stores the nearest car wash and its
+distance, plus neighbour counts at the standard radii. When a request's
+max_settlement_distance_km matches a stored radius the recommenders answer
+with a single indexed filter-and-sort on this table.
+
+- rebuild_settlement_features() recomputes everything (settlement data
+  changed, or first run).
+- refresh_carwash_features() only recomputes the nearest-car-wash columns,
+  which is all that changes when car washes are replaced.
+"""
+import logging
+
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Coalesce, Collate
+
+from . import county_assignment, county_pieces
+from .dataset_version import CARWASH, POPULATION, current_version, get_version
+from .distance_kernel import count_within_radii, nearest
+from .models import SettlementFeature
+from .recommendation_sql import NO_CARWASH_SCORE_KM
+from .spatial_index import load_carwash_points, load_settlement_points, search_box
+
+logger = logging.getLogger(__name__)
+
+# Radii (km) that have a stored neighbour count, and the column holding it
+STANDARD_RADII_KM = {
+    5: 'neighbours_5km',
+    10: 'neighbours_10km',
+    20: 'neighbours_20km',
+}
+
+# Dataset versions the table was last confirmed current for (per worker)
+_current_for = None
+
+
+def _nearest_carwashes(lngs, lats, carwashes):
+    """Return [(carwash_id, distance_km), ...]; (None, None) if there are none."""
+    distance_km, argmin = nearest(lngs, lats, carwashes.lng_array, carwashes.lat_array)
+    return [
+        (None, None) if idx < 0 else (carwashes.keys[idx], float(dist))
+        for dist, idx in zip(distance_km, argmin)
+    ]
+
+
+@transaction.atomic
+def rebuild_settlement_features() -> int:
+    """
+    Recompute every settlement_features row. Returns the number of rows.
+    """
+    settlements = load_settlement_points()
+    carwashes = load_carwash_points()
+    carwash_version = get_version(CARWASH)
+    population_version = get_version(POPULATION)
+
+    nearest_carwashes = _nearest_carwashes(settlements.lng_array, settlements.lat_array, carwashes)
+    counts = count_within_radii(
+        settlements.lng_array, settlements.lat_array,
+        settlements.lng_array, settlements.lat_array,
+        list(STANDARD_RADII_KM),
+    )
+
+    rows = []
+    for i, (carwash_id, distance_km) in enumerate(nearest_carwashes):
+        payload = settlements.payloads[i]
+        row = SettlementFeature(
+            settlement_id=settlements.keys[i],
+            name=payload['name'],
+            population=payload['population'],
+            place=payload['place'],
+            point=Point(settlements.lngs[i], settlements.lats[i], srid=4326),
+            nearest_carwash_id=carwash_id,
+            nearest_carwash_km=distance_km,
+            carwash_version=carwash_version,
+            population_version=population_version,
+        )
+        for col, column in enumerate(STANDARD_RADII_KM.values()):
+            setattr(row, column, int(counts[i, col]))
+        rows.append(row)
+
+    SettlementFeature.objects.all().delete()
+    SettlementFeature.objects.bulk_create(rows, batch_size=500)
+
+    logger.info("Rebuilt %d settlement feature rows", len(rows))
+    return len(rows)
+
+
+@transaction.atomic
+def refresh_carwash_features() -> int:
+    """
+    Recompute the nearest-car-wash columns after the car washes changed.
+
+    Neighbour counts only depend on settlements, so they are kept. Falls
+    back to a full rebuild if the table is empty or was built from older
+    settlement data. Returns the number of rows that changed.
+    """
+    features = SettlementFeature.objects.all()
+    population_version = get_version(POPULATION)
+    if not features.exists() or features.exclude(population_version=population_version).exists():
+        return rebuild_settlement_features()
+
+    carwashes = load_carwash_points()
+    rows = list(features.only('settlement_id', 'point', 'nearest_carwash_id', 'nearest_carwash_km'))
+    nearest_carwashes = _nearest_carwashes(
+        [row.point.x for row in rows], [row.point.y for row in rows], carwashes
+    )
+
+    changed = []
+    for row, (carwash_id, distance_km) in zip(rows, nearest_carwashes):
+        if row.nearest_carwash_id != carwash_id or row.nearest_carwash_km != distance_km:
+            row.nearest_carwash_id = carwash_id
+            row.nearest_carwash_km = distance_km
+            changed.append(row)
+
+    SettlementFeature.objects.bulk_update(
+        changed, ['nearest_carwash_id', 'nearest_carwash_km'], batch_size=500
+    )
+    features.update(carwash_version=get_version(CARWASH))
+
+    logger.info("Updated nearest car wash for %d of %d settlements", len(changed), len(rows))
+    return len(changed)
+
+
+def features_current() -> bool:
+    """
+    True if every row was computed from the current dataset versions.
+    """
+    global _current_for
+
+    versions = (current_version(CARWASH), current_version(POPULATION))
+    if versions == _current_for:
+        return True
+
+    features = SettlementFeature.objects.all()
+    current = features.exists() and not features.exclude(
+        carwash_version=versions[0], population_version=versions[1]
+    ).exists()
+    if current:
+        _current_for = versions
+    return current
+
+
+def available(max_settlement_distance_km=None) -> bool:
+    """
+    Whether a request can be answered from the table.
+
+    max_settlement_distance_km must be one of the stored radii (None when
+    the request does not use neighbour counts).
+    """
+    if max_settlement_distance_km is not None and max_settlement_distance_km not in STANDARD_RADII_KM:
+        return False
+    return features_current()
+
+
+def in_polygon(polygon):
+    return Q(point__within=polygon)
+
+
+def in_county(county):
+    # Integer lookup on county_assignment when current, subdivided pieces otherwise
+    if county_assignment.current(POPULATION):
+        return Q(settlement_id__in=county_assignment.point_ids(POPULATION, county.id))
+    return Q(county_pieces.in_county(county.id))
+
+
+def in_circle(lng, lat, radius_km):
+    # The bbox lets the GiST index prune before the exact distance test
+    centre = Point(lng, lat, srid=4326)
+    return Q(point__within=Polygon.from_bbox(search_box(lng, lat, radius_km))) & Q(
+        point__distance_lte=(centre, D(km=radius_km))
+    )
+
+
+def _far_enough(area, min_distance_km):
+    return SettlementFeature.objects.filter(area).filter(
+        Q(nearest_carwash_km__isnull=True) | Q(nearest_carwash_km__gte=min_distance_km)
+    )
+
+
+def candidate(feature, nearby_settlements, reason):
+    """Recommendation dict for a SettlementFeature row."""
+    return {
+        'id': feature.settlement_id,
+        'lat': feature.point.y,
+        'lng': feature.point.x,
+        'name': feature.name,
+        'population': feature.population,
+        'place': feature.place,
+        'min_distance_to_carwash_km': feature.nearest_carwash_km,
+        'nearby_settlements': nearby_settlements,
+        'reason': reason,
+    }
+
+
+def ranked(area, min_distance_km, max_settlement_distance_km, reason, limit):
+    """
+    Top `limit` settlements in an area, ranked by distance from car washes
+    then population, with neighbour counts read from the stored column.
+    """
+    column = STANDARD_RADII_KM[max_settlement_distance_km]
+    features = _far_enough(area, min_distance_km).order_by(
+        Coalesce('nearest_carwash_km', 0.0).desc(),
+        Coalesce('population', 0).desc(),
+        'settlement_id',
+    )[:limit]
+    return [candidate(f, getattr(f, column), reason) for f in features]
+
+
+def best(area, min_distance_km):
+    """
+    Return (best feature or None, number of settlements in the area) for
+    the polygon recommender.
+    """
+    score = Case(
+        When(Q(nearest_carwash_km__isnull=True) | Q(nearest_carwash_km=0), then=Value(NO_CARWASH_SCORE_KM)),
+        default=F('nearest_carwash_km'),
+        output_field=FloatField(),
+    )
+    feature = _far_enough(area, min_distance_km).order_by(
+        score.desc(),
+        Collate('settlement_id', 'C'),
+    ).first()
+    total = SettlementFeature.objects.filter(area).count()
+    return feature, total
@@ -0,0 +1,286 @@
+"""
+Resident in-memory spatial indexes for car washes and settlements.
+
+Each worker process keeps one uniform grid index per dataset. The grid
+buckets points by (lng, lat) cell so nearest-neighbour and radius lookups
+only measure distances to points in nearby cells instead of scanning the
+whole table. Distances are great-circle kilometres (haversine).
+
+Indexes are built on first use (or at worker startup via warm_indexes())
+and rebuilt when the DatasetVersion of their dataset changes.
+"""
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError
+
+from .dataset_version import CARWASH, POPULATION, current_version
+from .models import Location, PopulationPoint
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+DEFAULT_CELL_KM = 5.0
+
+
+def haversine_km(lng1: float, lat1: float, lng2: float, lat2: float) -> float:
+    """
+    Great-circle distance in kilometres between two WGS84 coordinates.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def search_box(lng, lat, radius_km):
+    """
+    (min_lng, min_lat, max_lng, max_lat) box guaranteed to contain every
+    point within radius_km of (lng, lat).
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    max_abs_lat = min(abs(lat) + dlat, 89.0)
+    # 1% slack covers the small-angle approximation near the box edges
+    dlng = 1.01 * radius_km / (KM_PER_DEGREE * math.cos(math.radians(max_abs_lat)))
+    return lng - dlng, lat - dlat, lng + dlng, lat + dlat
+
+
+class PointIndex:
+    """
+    Uniform grid index over a fixed set of points.
+
+    Points are addressed by their position (0..n-1) in the parallel
+    keys / lngs / lats / payloads lists.
+    """
+
+    def __init__(self, keys, lngs, lats, payloads=None, cell_km: float = DEFAULT_CELL_KM):
+        self.keys = list(keys)
+        self.lngs = [float(v) for v in lngs]
+        self.lats = [float(v) for v in lats]
+        self.payloads = list(payloads) if payloads is not None else [None] * len(self.keys)
+        self.position = {key: i for i, key in enumerate(self.keys)}
+        self.cell_km = cell_km
+
+        # Array views of the coordinates for the vectorised distance kernels
+        self.lng_array = np.asarray(self.lngs, dtype=np.float64)
+        self.lat_array = np.asarray(self.lats, dtype=np.float64)
+
+        # Cells are square in degrees of latitude; the longitude size is
+        # stretched so cells are roughly square on the ground.
+        mid_lat = (min(self.lats) + max(self.lats)) / 2 if self.lats else 0.0
+        self.cell_lat = cell_km / KM_PER_DEGREE
+        self.cell_lng = cell_km / (KM_PER_DEGREE * max(math.cos(math.radians(mid_lat)), 0.01))
+
+        self.extent = (
+            (min(self.lngs), min(self.lats), max(self.lngs), max(self.lats))
+            if self.keys else None
+        )
+
+        self.cells = {}
+        for i, (lng, lat) in enumerate(zip(self.lngs, self.lats)):
+            self.cells.setdefault(self._cell(lng, lat), []).append(i)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cell(self, lng, lat):
+        return (math.floor(lng / self.cell_lng), math.floor(lat / self.cell_lat))
+
+    def in_bbox(self, min_lng, min_lat, max_lng, max_lat):
+        """
+        Return the positions of all points inside a lng/lat bounding box.
+        """
+        x0, y0 = self._cell(min_lng, min_lat)
+        x1, y1 = self._cell(max_lng, max_lat)
+
+        # Walk whichever is smaller: the cells in the box or the occupied cells
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self.cells):
+            cells = (
+                self.cells.get((x, y), ())
+                for x in range(x0, x1 + 1)
+                for y in range(y0, y1 + 1)
+            )
+        else:
+            cells = (
+                members for (x, y), members in self.cells.items()
+                if x0 <= x <= x1 and y0 <= y <= y1
+            )
+
+        return [
+            i for members in cells for i in members
+            if min_lng <= self.lngs[i] <= max_lng and min_lat <= self.lats[i] <= max_lat
+        ]
+
+    def within(self, lng, lat, radius_km):
+        """
+        Return [(distance_km, position), ...] for points within radius_km,
+        nearest first.
+        """
+        hits = []
+        for i in self.in_bbox(*search_box(lng, lat, radius_km)):
+            d = haversine_km(lng, lat, self.lngs[i], self.lats[i])
+            if d <= radius_km:
+                hits.append((d, i))
+        hits.sort()
+        return hits
+
+    def count_within(self, lng, lat, radius_km):
+        """
+        Number of points within radius_km of (lng, lat).
+        """
+        return sum(
+            1 for i in self.in_bbox(*search_box(lng, lat, radius_km))
+            if haversine_km(lng, lat, self.lngs[i], self.lats[i]) <= radius_km
+        )
+
+    def nearest(self, lng, lat, k=1):
+        """
+        Return the k nearest points as [(distance_km, position), ...].
+
+        The search radius doubles until at least k points fall inside it;
+        once the search box spans the whole dataset it falls back to a
+        full scan.
+        """
+        if not self.keys:
+            return []
+        k = min(k, len(self.keys))
+
+        radius_km = self.cell_km
+        while True:
+            min_lng, min_lat, max_lng, max_lat = search_box(lng, lat, radius_km)
+            if (
+                min_lng <= self.extent[0] and min_lat <= self.extent[1]
+                and max_lng >= self.extent[2] and max_lat >= self.extent[3]
+            ):
+                hits = sorted(
+                    (haversine_km(lng, lat, x, y), i)
+                    for i, (x, y) in enumerate(zip(self.lngs, self.lats))
+                )
+                return hits[:k]
+
+            hits = self.within(lng, lat, radius_km)
+            if len(hits) >= k:
+                return hits[:k]
+            radius_km *= 2
+
+
+class ResidentIndex:
+    """
+    Lazily built, per-process PointIndex tied to a dataset version.
+
+    Each get() checks the (briefly memoised) dataset version and rebuilds
+    the index from the database when it has changed.
+    """
+
+    def __init__(self, dataset: str, loader):
+        self.dataset = dataset
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def get(self) -> PointIndex:
+        version = current_version(self.dataset)
+        if self._index is not None and version == self._version:
+            return self._index
+
+        with self._lock:
+            if self._index is None or version != self._version:
+                started = time.monotonic()
+                self._index = self._loader()
+                self._version = version
+                logger.info(
+                    "Built %s spatial index v%s (%d points) in %.1fms",
+                    self.dataset, version, len(self._index),
+                    (time.monotonic() - started) * 1000,
+                )
+        return self._index
+
+    @property
+    def version(self):
+        """Dataset version of the index returned by the last get()."""
+        return self._version
+
+    def invalidate(self):
+        """Drop the cached index so the next get() rebuilds it."""
+        with self._lock:
+            self._index = None
+            self._version = None
+
+
+def _cell_km():
+    return getattr(settings, 'SPATIAL_INDEX_CELL_KM', DEFAULT_CELL_KM)
+
+
+def format_address(street, city, postcode):
+    # Same format as CarwashSerializer.get_address
+    return ', '.join(part for part in (street, city, postcode) if part)
+
+
+def load_carwash_points() -> PointIndex:
+    """
+    Build a PointIndex over all car washes straight from the database.
+
+    Payloads are the public fields of each car wash (id, name, lat, lng,
+    address), ready to return from the nearest-car-wash endpoints.
+    """
+    rows = list(Location.objects.values_list(
+        'id', 'point', 'name', 'addr_street', 'addr_city', 'addr_postcode'
+    ))
+    return PointIndex(
+        keys=[row[0] for row in rows],
+        lngs=[row[1].x for row in rows],
+        lats=[row[1].y for row in rows],
+        payloads=[
+            {
+                'id': pk,
+                'name': name,
+                'lat': point.y,
+                'lng': point.x,
+                'address': format_address(street, city, postcode),
+            }
+            for pk, point, name, street, city, postcode in rows
+        ],
+        cell_km=_cell_km(),
+    )
+
+
+def load_settlement_points() -> PointIndex:
+    """Build a PointIndex over all settlements straight from the database."""
+    rows = list(PopulationPoint.objects.values_list('id', 'point', 'name', 'population', 'place'))
+    return PointIndex(
+        keys=[row[0] for row in rows],
+        lngs=[row[1].x for row in rows],
+        lats=[row[1].y for row in rows],
+        payloads=[
+            {'name': name, 'population': population, 'place': place}
+            for _, _, name, population, place in rows
+        ],
+        cell_km=_cell_km(),
+    )
+
+
+carwash_index = ResidentIndex(CARWASH, load_carwash_points)
+settlement_index = ResidentIndex(POPULATION, load_settlement_points)
+
+
+def warm_indexes():
+    """
+    Build both indexes up front (called once per worker from wsgi.py).
+
+    Failures are logged rather than raised so a worker can still start
+    before migrations have been applied.
+    """
+    for resident in (carwash_index, settlement_index):
+        try:
+            resident.get()
+        except DatabaseError as e:
+            logger.warning("Could not build %s spatial index: %s", resident.dataset, e)
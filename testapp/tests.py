@@ -1,3 +1,988 @@
-from django.test import TestCase
+import json
+import math
+import struct
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Point, Polygon
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    batch, county_assignment, county_pieces, county_rollup, county_topology, dataset_version, geo_cache,
+    itm, jobs, nearest_service, recommendation_sql, recommendations, result_cache, settlement_features,
+)
+from .carwash_clusters import Level
+from .competition_grid import count_grid, disc_bands
+from .county_topology import Topology, _junctions, _simplify_arc
+from .dataset_version import CARWASH, POPULATION, bump_version
+from .geo_cache import geohash_cell
+from .models import IrishCounty, Location, PopulationPoint, RecommendationJob
+from .point_layers import MAGIC, encode, parse_range
+from .route_corridor import decode_polyline, segments
+from .spatial_index import KM_PER_DEGREE, PointIndex, carwash_index, haversine_km, settlement_index
+
+
+def reset_process_state():
+    """Forget every per-process memo, so each test reads its own data."""
+    dataset_version._seen.clear()
+    carwash_index.invalidate()
+    settlement_index.invalidate()
+    county_assignment._current_for.clear()
+    county_pieces._built = False
+    county_rollup._current_for = None
+    settlement_features._current_for = None
+    geo_cache.clear()
+    result_cache.clear()
+
+
+def km_east(lng, lat, km):
+    """The point km kilometres due east of (lng, lat), along the parallel."""
+    return lng + km / (KM_PER_DEGREE * math.cos(math.radians(lat))), lat
+
+
+def add_carwash(pk, lng, lat, **fields):
+    return Location.objects.create(id=pk, point=Point(lng, lat, srid=4326), **fields)
+
+
+def add_settlement(pk, lng, lat, population=None, name=None, place='village'):
+    return PopulationPoint.objects.create(
+        id=pk, point=Point(lng, lat, srid=4326), population=population,
+        name=name or pk, place=place,
+    )
+
+
+def add_county(name, min_lng, min_lat, max_lng, max_lat):
+    return IrishCounty.objects.create(
+        name_en=name, geom=MultiPolygon(Polygon.from_bbox((min_lng, min_lat, max_lng, max_lat)), srid=4326),
+    )
+
+
+class ImportedTablesTestCase(TestCase):
+    """
+    TestCase with the tables ogr2ogr imports in production.
+
+    The test database is built from the models (TEST MIGRATE is off), which
+    leaves out the unmanaged irish_counties and population_points. They are
+    created here inside the class transaction, with the geom_itm shadow
+    columns and triggers bump_dataset_version would add.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.schema_editor() as editor:
+            editor.create_model(IrishCounty)
+            editor.create_model(PopulationPoint)
+        itm.ensure_shadow_geometry()
+
+    def setUp(self):
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+
+
+class PointIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.lngs = rng.uniform(-10.5, -6.0, 500)
+        self.lats = rng.uniform(51.4, 55.4, 500)
+        self.index = PointIndex(range(500), self.lngs, self.lats, cell_km=5.0)
+
+    def _brute_force(self, lng, lat, k):
+        return sorted(
+            (haversine_km(lng, lat, x, y), i) for i, (x, y) in enumerate(zip(self.lngs, self.lats))
+        )[:k]
+
+    def test_nearest_matches_brute_force(self):
+        for lng, lat in [(-6.26, 53.35), (-8.47, 51.9), (-9.05, 53.27), (-12.0, 50.0)]:
+            for k in (1, 5, 20):
+                hits = self.index.nearest(lng, lat, k)
+                expected = self._brute_force(lng, lat, k)
+                self.assertEqual([i for _, i in hits], [i for _, i in expected])
+                for (d, _), (e, _) in zip(hits, expected):
+                    self.assertTrue(math.isclose(d, e))
+
+    def test_within_matches_brute_force(self):
+        hits = self.index.within(-8.0, 53.0, 40.0)
+        expected = [
+            (d, i) for d, i in self._brute_force(-8.0, 53.0, len(self.lngs)) if d <= 40.0
+        ]
+        self.assertEqual([i for _, i in hits], [i for _, i in expected])
+
+    def test_nearest_k_larger_than_index(self):
+        index = PointIndex(['a', 'b'], [-6.0, -7.0], [53.0, 53.0])
+        self.assertEqual([i for _, i in index.nearest(-6.1, 53.0, k=5)], [0, 1])
+
+    def test_nearest_in_empty_index(self):
+        self.assertEqual(PointIndex([], [], []).nearest(-6.0, 53.0), [])
+
+
+class ResidentIndexTests(ImportedTablesTestCase):
+
+    def test_index_holds_the_table(self):
+        add_carwash('node/1', -6.25, 53.35, name='Docks', addr_street='Quay St', addr_city='Dublin')
+        add_carwash('node/2', -8.47, 51.90, name='Harbour')
+        add_settlement('node/10', -6.26, 53.34, population=1200, name='Ringsend', place='suburb')
+
+        carwashes = carwash_index.get()
+        self.assertEqual(sorted(carwashes.keys), ['node/1', 'node/2'])
+        self.assertEqual(carwashes.payloads[carwashes.position['node/1']], {
+            'id': 'node/1', 'name': 'Docks', 'lat': 53.35, 'lng': -6.25, 'address': 'Quay St, Dublin',
+        })
+
+        settlements = settlement_index.get()
+        self.assertEqual(settlements.keys, ['node/10'])
+        self.assertEqual(
+            settlements.payloads[0], {'name': 'Ringsend', 'population': 1200, 'place': 'suburb'}
+        )
+
+    def test_rebuilt_after_a_version_bump(self):
+        add_carwash('node/1', -6.25, 53.35)
+        self.assertEqual(len(carwash_index.get()), 1)
+
+        add_carwash('node/2', -8.47, 51.90)
+        # The memoised version still matches until the bump commits
+        self.assertEqual(len(carwash_index.get()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(CARWASH)
+        self.assertEqual(len(carwash_index.get()), 2)
+        self.assertEqual(carwash_index.version, 1)
+
+
+class RankingEngineParityTests(ImportedTablesTestCase):
+    """The in-memory, SQL and settlement_features engines rank a county or circle alike."""
+
+    # km east of the car wash, and population; node/20 is too close to qualify
+    SETTLEMENTS = {
+        'node/20': (2, 5000),
+        'node/21': (7, 300),
+        'node/22': (11, None),
+        'node/23': (15, 1200),
+        'node/24': (19, 80),
+        'node/25': (23, 40),
+    }
+
+    def setUp(self):
+        super().setUp()
+        add_carwash('node/1', -8.0, 53.0)
+        add_carwash('node/2', -9.6, 54.6)
+        for pk, (km, population) in self.SETTLEMENTS.items():
+            add_settlement(pk, *km_east(-8.0, 53.0, km), population=population)
+        self.county = add_county('Testshire', -8.3, 52.8, -7.4, 53.3)
+
+    def _engines(self, recommend):
+        with override_settings(RECOMMENDATION_ENGINE='index'):
+            in_memory = recommend()
+        with override_settings(RECOMMENDATION_ENGINE='sql'):
+            sql = recommend()
+        settlement_features.rebuild_settlement_features()
+        self.assertTrue(settlement_features.available(10))
+        features = recommend()
+        return in_memory, sql, features
+
+    def assertSameRanking(self, results):
+        expected = ['node/25', 'node/24', 'node/23', 'node/22', 'node/21']
+        for ranked in results:
+            self.assertEqual([r['id'] for r in ranked], expected)
+            for r, first in zip(ranked, results[0]):
+                self.assertAlmostEqual(
+                    r['min_distance_to_carwash_km'], first['min_distance_to_carwash_km'], delta=0.05
+                )
+                for field in ('population', 'place', 'nearby_settlements', 'reason'):
+                    self.assertEqual(r[field], first[field])
+        # 23 km: itself, and the settlements 4 and 8 km away
+        self.assertEqual(results[0][0]['nearby_settlements'], 3)
+
+    def test_circle(self):
+        self.assertSameRanking(self._engines(
+            lambda: recommendations.recommend_circle(-8.0, 53.0, 30, 5, 10)
+        ))
+
+    def test_county(self):
+        self.assertSameRanking(self._engines(
+            lambda: recommendations.recommend_county(self.county, 5, 10)
+        ))
+
+    def test_county_through_assignments(self):
+        county_assignment.assign_counties(POPULATION)
+        self.assertTrue(county_assignment.current(POPULATION))
+        self.assertSameRanking(self._engines(
+            lambda: recommendations.recommend_county(self.county, 5, 10)
+        ))
+
+
+class PolygonEngineParityTests(ImportedTablesTestCase):
+    """The in-memory, SQL and settlement_features engines pick the same best settlement."""
+
+    def setUp(self):
+        super().setUp()
+        self.polygon = Polygon.from_bbox((-8.2, 52.9, -7.5, 53.1))
+        self.polygon.srid = 4326
+
+    def _engines(self, min_distance_km):
+        in_memory = recommendations.best_in_polygon(self.polygon, min_distance_km)
+        sql = recommendation_sql.recommend_polygon(self.polygon, min_distance_km)
+        settlement_features.rebuild_settlement_features()
+        self.assertTrue(settlement_features.available())
+        features = recommendations.recommend_polygon(self.polygon, min_distance_km)
+        return in_memory, sql, features
+
+    def assertSameBest(self, results, expected_id):
+        for result in results:
+            self.assertEqual(result.get('id'), expected_id)
+            self.assertEqual(result['nearby_settlements'], results[0]['nearby_settlements'])
+            self.assertEqual(result['reason'], results[0]['reason'])
+
+    def test_furthest_settlement_wins(self):
+        add_carwash('node/1', -8.0, 53.0)
+        for pk, km in (('node/10', 7), ('node/11', 15), ('node/12', 11)):
+            add_settlement(pk, *km_east(-8.0, 53.0, km), population=100)
+
+        results = self._engines(min_distance_km=5)
+        self.assertSameBest(results, 'node/11')
+        for result in results:
+            self.assertAlmostEqual(result['min_distance_to_carwash_km'], 15.0, delta=0.05)
+
+    def test_without_carwashes_ties_break_by_id(self):
+        # Every settlement scores NO_CARWASH_SCORE_KM; byte order puts node/12 first
+        for pk, km in (('node/4', 3), ('node/30', 9), ('node/12', 20)):
+            add_settlement(pk, *km_east(-8.0, 53.0, km))
+
+        results = self._engines(min_distance_km=5)
+        self.assertSameBest(results, 'node/12')
+        for result in results:
+            self.assertIsNone(result['min_distance_to_carwash_km'])
+            self.assertEqual(result['nearby_settlements'], 3)
+
+    def test_settlement_on_a_carwash_scores_like_no_carwash(self):
+        add_carwash('node/1', *km_east(-8.0, 53.0, 6))
+        add_settlement('node/10', *km_east(-8.0, 53.0, 6))
+        add_settlement('node/11', *km_east(-8.0, 53.0, 20))
+
+        results = self._engines(min_distance_km=0)
+        self.assertSameBest(results, 'node/10')
+
+    def test_no_settlement_far_enough(self):
+        add_carwash('node/1', -8.0, 53.0)
+        add_settlement('node/10', *km_east(-8.0, 53.0, 2))
+
+        for result in self._engines(min_distance_km=5):
+            self.assertEqual(result['name'], 'Polygon Centroid')
+            self.assertEqual(result['reason'], 'No suitable settlement found, using centroid')
+            self.assertEqual(result['nearby_settlements'], 1)
+
+
+class QueuedExecutor:
+    """Stands in for the job thread pool; runs what was submitted on request."""
+
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, fn, *args):
+        self.queued.append((fn, args))
+
+    def run_all(self):
+        while self.queued:
+            fn, args = self.queued.pop(0)
+            fn(*args)
+
+
+class RecommendationJobTests(TestCase):
+
+    CIRCLE = {'lat': 53.35, 'lng': -6.26, 'radius_km': 20}
+
+    def setUp(self):
+        self.user = User.objects.create_user('surveyor')
+        self.executor = QueuedExecutor()
+        for target, value in (
+            ('testapp.jobs._get_executor', lambda: self.executor),
+            # Closing the connection would end the test transaction
+            ('testapp.jobs.close_old_connections', lambda: None),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_job_runs_to_done(self):
+        candidate = {
+            'id': 'node/10', 'lat': 53.3, 'lng': -6.2, 'name': 'Ringsend', 'population': 1200,
+            'place': 'suburb', 'min_distance_to_carwash_km': 8.5, 'nearby_settlements': 4,
+            'reason': 'Recommended location inside selected circle',
+        }
+        with mock.patch.object(recommendations, 'recommend_circle', return_value=[candidate]) as recommend:
+            job = jobs.submit(self.user, 'circle', self.CIRCLE)
+            self.assertEqual(job.status, RecommendationJob.QUEUED)
+            self.executor.run_all()
+
+        recommend.assert_called_once_with(-6.26, 53.35, 20.0, 5.0, 10.0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecommendationJob.DONE)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual([r['id'] for r in job.result['recommendations']], ['node/10'])
+        self.assertEqual(jobs._pending, 0)
+        self.assertEqual(jobs._owned, set())
+
+    def test_cancelled_while_queued_never_runs(self):
+        with mock.patch.object(recommendations, 'recommend_circle') as recommend:
+            job = jobs.submit(self.user, 'circle', self.CIRCLE)
+            self.assertTrue(jobs.cancel(job))
+            self.executor.run_all()
+
+        recommend.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecommendationJob.CANCELLED)
+        self.assertFalse(jobs.cancel(job))
+        self.assertEqual(jobs._pending, 0)
+
+    def test_failure_records_the_error(self):
+        with mock.patch.object(recommendations, 'recommend_circle', side_effect=RuntimeError('boom')):
+            job = jobs.submit(self.user, 'circle', self.CIRCLE)
+            self.executor.run_all()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecommendationJob.FAILED)
+        self.assertEqual(job.error, 'boom')
+        self.assertIsNone(job.result)
+
+    def test_bad_parameters_are_rejected_before_queueing(self):
+        with self.assertRaises(ValueError):
+            jobs.submit(self.user, 'circle', {'lat': 'north', 'lng': -6.26})
+        self.assertFalse(RecommendationJob.objects.exists())
+        self.assertEqual(self.executor.queued, [])
+
+    @override_settings(RECOMMENDATION_JOB_MAX_QUEUED=1)
+    def test_queue_full(self):
+        jobs.submit(self.user, 'circle', self.CIRCLE)
+        with self.assertRaises(jobs.QueueFull):
+            jobs.submit(self.user, 'circle', self.CIRCLE)
+        self.assertEqual(RecommendationJob.objects.count(), 1)
+
+        with mock.patch.object(recommendations, 'recommend_circle', return_value=[]):
+            self.executor.run_all()
+            # The finished job freed its slot
+            jobs.submit(self.user, 'circle', self.CIRCLE)
+            self.executor.run_all()
+        self.assertEqual(jobs._pending, 0)
+
+    @override_settings(RECOMMENDATION_JOB_STALE_SECONDS=120)
+    def test_only_jobs_without_a_heartbeat_are_stale(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        # A slow job that is still alive: created long ago, heartbeat fresh
+        alive = RecommendationJob.objects.create(
+            user=self.user, mode='circle', params={}, status=RecommendationJob.RUNNING,
+        )
+        RecommendationJob.objects.filter(pk=alive.pk).update(created_at=long_ago)
+        orphan = RecommendationJob.objects.create(
+            user=self.user, mode='circle', params={}, status=RecommendationJob.RUNNING,
+            heartbeat_at=long_ago,
+        )
+
+        self.assertEqual(jobs.fail_if_stale(alive).status, RecommendationJob.RUNNING)
+        orphan = jobs.fail_if_stale(orphan)
+        self.assertEqual(orphan.status, RecommendationJob.FAILED)
+        self.assertEqual(orphan.error, 'The worker running this job stopped before it finished')
+
+
+class BatchValidationTests(ImportedTablesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.county = add_county('Testshire', -8.3, 52.8, -7.4, 53.3)
+
+    def assertRejected(self, data, message):
+        with self.assertRaisesMessage(ValueError, message):
+            batch.parse_areas(data)
+
+    def test_rejects_malformed_bodies(self):
+        self.assertRejected([], 'Request body must be a JSON object')
+        self.assertRejected({}, 'areas must be a non-empty list')
+        self.assertRejected({'areas': []}, 'areas must be a non-empty list')
+        self.assertRejected({'areas': {'type': 'circle'}}, 'areas must be a non-empty list')
+        self.assertRejected(
+            {'areas': [{'type': 'circle', 'lat': 53, 'lng': -8}], 'min_distance_km': 'far'},
+            'min_distance_km and max_settlement_distance_km must be numbers',
+        )
+
+    def test_rejects_bad_areas(self):
+        self.assertRejected({'areas': [{'type': 'hexagon'}]}, 'areas[0].type must be one of')
+        self.assertRejected({'areas': ['county']}, 'areas[0].type must be one of')
+        self.assertRejected(
+            {'areas': [{'type': 'circle', 'lat': 53, 'lng': -8}, {'type': 'circle', 'lat': 53}]},
+            'areas[1]:',
+        )
+        self.assertRejected({'areas': [{'type': 'county', 'id': 'Cork'}]}, 'areas[0]:')
+        self.assertRejected(
+            {'areas': [{'type': 'polygon', 'geometry': {'type': 'Polygon', 'coordinates': 'x'}}]},
+            'areas[0]:',
+        )
+        self.assertRejected(
+            {'areas': [{'type': 'circle', 'lat': 53, 'lng': -8, 'min_distance_km': 'far'}]},
+            'areas[0]:',
+        )
+
+    def test_rejects_unknown_counties(self):
+        self.assertRejected(
+            {'areas': [{'type': 'county', 'id': self.county.id}, {'type': 'county', 'id': 9999}]},
+            'Unknown county ids: 9999',
+        )
+
+    @override_settings(RECOMMENDATION_BATCH_MAX_AREAS=2)
+    def test_rejects_too_many_areas(self):
+        self.assertRejected(
+            {'areas': [{'type': 'circle', 'lat': 53, 'lng': -8}] * 3}, 'At most 2 areas per batch'
+        )
+
+    def test_parses_every_area_type(self):
+        polygon = Polygon.from_bbox((-8.2, 52.9, -7.5, 53.1))
+        tasks = batch.parse_areas({
+            'min_distance_km': 3,
+            'areas': [
+                {'type': 'county', 'id': self.county.id},
+                {'type': 'circle', 'lat': '53.1', 'lng': -8, 'max_settlement_distance_km': 20},
+                {'type': 'polygon', 'geometry': json.loads(polygon.geojson)},
+            ],
+        })
+
+        self.assertEqual([area_type for area_type, _ in tasks], ['county', 'circle', 'polygon'])
+        county, circle, drawn = (params for _, params in tasks)
+        self.assertEqual(county['name'], 'Testshire')
+        self.assertEqual(bytes(self.county.geom.wkb), county['wkb'])
+        self.assertEqual(circle, {
+            'min_distance_km': 3.0, 'max_settlement_distance_km': 20.0,
+            'lat': 53.1, 'lng': -8.0, 'radius_km': 10.0,
+        })
+        self.assertTrue(GEOSGeometry(memoryview(drawn['wkb'])).equals(polygon))
+        self.assertEqual(drawn['max_settlement_distance_km'], 10.0)
+
+    def test_api_answers_400(self):
+        self.client.force_login(User.objects.create_user('surveyor'))
+        response = self.client.post(
+            '/api/recommend_batch/', {'areas': [{'type': 'hexagon'}]}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('areas[0].type must be one of', response.json()['error'])
+
+
+class CountyRollupTests(ImportedTablesTestCase):
+    """The rollup agrees with a live grouped spatial join of the source tables."""
+
+    LIVE_SQL = """
+        SELECT c.id, w.brand, count(w.id)
+        FROM irish_counties c
+        LEFT JOIN carwash w ON ST_Contains(c.geom, w.wkb_geometry)
+        GROUP BY c.id, w.brand
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.west = add_county('Westshire', -8.3, 52.8, -7.4, 53.3)
+        self.east = add_county('Eastshire', -7.4, 52.8, -6.5, 53.3)
+        self.empty = add_county('Emptyshire', -7.4, 53.3, -6.5, 53.8)
+        for n, (lng, lat, brand) in enumerate([
+            (-8.0, 53.0, 'Suds'), (-7.9, 53.1, 'Suds'), (-7.6, 52.9, None),
+            (-7.0, 53.0, 'Suds'), (-6.8, 53.2, 'Bubbles'),
+            (-9.5, 53.0, 'Suds'),  # offshore, in no county
+        ]):
+            add_carwash(f'node/{n}', lng, lat, brand=brand, self_service='yes' if n % 2 else 'no')
+
+    def _live_counts(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.LIVE_SQL)
+            rows = cursor.fetchall()
+        totals = {}
+        by_brand = {}
+        for county_id, brand, count in rows:
+            totals[county_id] = totals.get(county_id, 0) + count
+            if count:
+                by_brand[county_id, brand] = count
+        return totals, by_brand
+
+    def assertMatchesLiveJoin(self):
+        totals, by_brand = self._live_counts()
+        self.assertEqual(totals, {self.west.id: 3, self.east.id: 2, self.empty.id: 0})
+        self.assertEqual(
+            {row['county_id']: row['wash_count'] for row in county_rollup.county_counts()}, totals
+        )
+        self.assertEqual(
+            {(row['county_id'], row['brand']): row['wash_count']
+             for row in county_rollup.county_counts('brand')},
+            by_brand,
+        )
+        per_self_service = county_rollup.county_counts('brand', 'self_service')
+        self.assertEqual(sum(row['wash_count'] for row in per_self_service), 5)
+
+    def test_counts_through_county_pieces(self):
+        self.assertFalse(county_assignment.current(CARWASH))
+        county_rollup.refresh_county_rollup()
+        self.assertMatchesLiveJoin()
+
+    def test_counts_through_assignments(self):
+        county_assignment.assign_counties(CARWASH)
+        self.assertTrue(county_assignment.current(CARWASH))
+        county_rollup.refresh_county_rollup()
+        self.assertMatchesLiveJoin()
+
+    def test_rebuilt_on_read_after_a_version_bump(self):
+        self.assertEqual(county_rollup.county_counts()[0]['wash_count'], 3)
+        add_carwash('node/9', -8.1, 52.9)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(CARWASH)
+        totals, _ = self._live_counts()
+        self.assertEqual(totals[self.west.id], 4)
+        self.assertEqual(
+            {row['county_id']: row['wash_count'] for row in county_rollup.county_counts()}, totals
+        )
+
+
+class CountyAssignmentTests(ImportedTablesTestCase):
+    """assign_counties() agrees with ST_Contains on irish_counties."""
+
+    CONTAINS_SQL = """
+        SELECT p.id, c.id
+        FROM population_points p
+        JOIN irish_counties c ON ST_Contains(c.geom, p.wkb_geometry)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.west = add_county('Westshire', -8.3, 52.8, -7.4, 53.3)
+        self.east = add_county('Eastshire', -7.4, 52.8, -6.5, 53.3)
+        rng = np.random.default_rng(12)
+        for n, (lng, lat) in enumerate(zip(rng.uniform(-8.6, -6.2, 200), rng.uniform(52.6, 53.5, 200))):
+            add_settlement(f'node/{n}', lng, lat)
+
+    def test_matches_st_contains(self):
+        assigned = county_assignment.assign_counties(POPULATION)
+
+        with connection.cursor() as cursor:
+            cursor.execute(self.CONTAINS_SQL)
+            expected = dict(cursor.fetchall())
+        self.assertEqual(assigned, len(expected))
+        for county in (self.west, self.east):
+            self.assertEqual(
+                set(county_assignment.point_ids(POPULATION, county.id)),
+                {pk for pk, county_id in expected.items() if county_id == county.id},
+            )
+
+    def test_point_on_a_shared_border_goes_to_one_county(self):
+        add_settlement('node/border', -7.4, 53.0)
+        county_assignment.assign_counties(POPULATION)
+
+        counties = [
+            county.id for county in (self.west, self.east)
+            if 'node/border' in county_assignment.point_ids(POPULATION, county.id)
+        ]
+        self.assertEqual(len(counties), 1)
+
+    def test_stale_after_a_version_bump(self):
+        county_assignment.assign_counties(POPULATION)
+        self.assertTrue(county_assignment.current(POPULATION))
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(POPULATION)
+        self.assertFalse(county_assignment.current(POPULATION))
+
+
+@override_settings(COUNTY_PIECE_MAX_VERTICES=16)
+class CountyPiecesTests(ImportedTablesTestCase):
+    """The subdivided pieces cover exactly the counties they were cut from."""
+
+    def setUp(self):
+        super().setUp()
+        round_county = Point(-7.5, 53.0, srid=4326).buffer(0.4, quadsegs=32)
+        self.round = IrishCounty.objects.create(
+            name_en='Roundshire', geom=MultiPolygon(round_county, srid=4326)
+        )
+        self.square = add_county('Squareshire', -6.9, 52.6, -6.2, 53.4)
+        rng = np.random.default_rng(13)
+        for n, (lng, lat) in enumerate(zip(rng.uniform(-8.0, -6.0, 200), rng.uniform(52.5, 53.5, 200))):
+            add_carwash(f'node/{n}', lng, lat)
+
+    def test_pieces_are_small_and_cover_their_county(self):
+        pieces = county_pieces.rebuild_county_pieces()
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT max(ST_NPoints(geom)) FROM county_pieces")
+            self.assertLessEqual(cursor.fetchone()[0], 16)
+            cursor.execute("""
+                SELECT c.id, count(*), ST_Area(ST_SymDifference(c.geom, ST_Union(cp.geom)))
+                FROM irish_counties c JOIN county_pieces cp ON cp.county_id = c.id
+                GROUP BY c.id, c.geom
+            """)
+            rows = {county_id: (count, gap) for county_id, count, gap in cursor.fetchall()}
+
+        self.assertEqual(set(rows), {self.round.id, self.square.id})
+        self.assertEqual(sum(count for count, _ in rows.values()), pieces)
+        self.assertGreater(rows[self.round.id][0], 1)
+        for _, gap in rows.values():
+            self.assertLess(gap, 1e-12)
+
+    def test_in_county_matches_st_contains(self):
+        for county in (self.round, self.square):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT w.id FROM carwash w JOIN irish_counties c ON ST_Contains(c.geom, w.wkb_geometry)"
+                    " WHERE c.id = %s",
+                    [county.id],
+                )
+                expected = {pk for pk, in cursor.fetchall()}
+            self.assertTrue(expected)
+            self.assertEqual(
+                set(Location.objects.filter(county_pieces.in_county(county.id)).values_list('id', flat=True)),
+                expected,
+            )
+
+
+class NearestServiceTests(ImportedTablesTestCase):
+    """
+    /api/nearest and /api/nearby answers from the index agree with PostGIS.
+
+    The index measures great circles on a sphere and PostGIS measures in
+    ITM metres, so distances are compared to within half a percent.
+    """
+
+    QUERIES = [(-6.26, 53.35), (-8.47, 51.90), (-9.05, 53.27), (-7.50, 54.00)]
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(15)
+        for n, (lng, lat) in enumerate(zip(rng.uniform(-10.3, -6.1, 150), rng.uniform(51.5, 55.3, 150))):
+            add_carwash(f'node/{n}', lng, lat, name=f'Wash {n}', addr_street='Main St', addr_city='Town')
+
+    def assertDistancesClose(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for a, b in zip(first, second):
+            self.assertAlmostEqual(a, b, delta=0.005 * b)
+
+    def test_nearest_matches_knn(self):
+        for lng, lat in self.QUERIES:
+            hits = nearest_service.nearest_carwashes(lng, lat, k=5)
+            knn = itm.nearest_carwashes(lng, lat, limit=5)
+            self.assertDistancesClose([d for d, _ in hits], [row.distance_km for row in knn])
+            self.assertEqual(hits[0][1]['id'], knn[0].id)
+            self.assertEqual(hits[0][1]['address'], 'Main St, Town')
+
+    def test_within_matches_dwithin(self):
+        for lng, lat in self.QUERIES:
+            hits = nearest_service.carwashes_within(lng, lat, 40)
+            found = {fields['id']: d for d, fields in hits}
+            expected = set(Location.objects.filter(itm.within(lng, lat, 40)).values_list('id', flat=True))
+            self.assertTrue(expected)
+            # Only car washes right on the edge may be in one answer and not the other
+            for pk in expected.symmetric_difference(found):
+                row = Location.objects.get(pk=pk)
+                self.assertAlmostEqual(haversine_km(lng, lat, row.point.x, row.point.y), 40, delta=0.2)
+            self.assertEqual([d for d, _ in hits], sorted(found.values()))
+
+    def test_fallback_answers_like_the_index(self):
+        lngs, lats = zip(*self.QUERIES)
+        from_index = (
+            [nearest_service.nearest_carwashes(lng, lat, k=3) for lng, lat in self.QUERIES],
+            nearest_service.nearest_carwashes_many(lngs, lats, k=3),
+        )
+        with mock.patch.object(carwash_index, 'get', side_effect=DatabaseError('unavailable')):
+            from_postgis = (
+                [nearest_service.nearest_carwashes(lng, lat, k=3) for lng, lat in self.QUERIES],
+                nearest_service.nearest_carwashes_many(lngs, lats, k=3),
+            )
+
+        for index_answers, postgis_answers in zip(from_index, from_postgis):
+            for index_hits, postgis_hits in zip(index_answers, postgis_answers):
+                self.assertEqual(index_hits[0][1], postgis_hits[0][1])
+                self.assertDistancesClose([d for d, _ in index_hits], [d for d, _ in postgis_hits])
+
+
+class DecodePolylineTests(SimpleTestCase):
+
+    def test_decodes_reference_polyline(self):
+        points = decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(points, [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+
+    def test_precision_6(self):
+        # The same deltas read at precision 6 are ten times smaller
+        points = decode_polyline('_p~iF~ps|U', precision=6)
+        self.assertEqual(points, [(3.85, -12.02)])
+
+    def test_empty_string(self):
+        self.assertEqual(decode_polyline(''), [])
+
+    def test_truncated_polyline(self):
+        with self.assertRaises(ValueError):
+            decode_polyline('_p~iF')
+
+    def test_invalid_character(self):
+        with self.assertRaises(ValueError):
+            decode_polyline('_p~iF ps|U')
+
+
+class SegmentsTests(SimpleTestCase):
+
+    def test_long_edge_is_split(self):
+        pieces = list(segments([(0.0, 0.0), (10.0, 0.0)], 4.0))
+        self.assertEqual(pieces, [
+            (0.0, [(0.0, 0.0), (4.0, 0.0)]),
+            (4.0, [(4.0, 0.0), (8.0, 0.0)]),
+            (8.0, [(8.0, 0.0), (10.0, 0.0)]),
+        ])
+
+    def test_pieces_follow_corners(self):
+        pieces = list(segments([(0.0, 0.0), (3.0, 0.0), (3.0, 3.0)], 4.0))
+        self.assertEqual(pieces, [
+            (0.0, [(0.0, 0.0), (3.0, 0.0), (3.0, 1.0)]),
+            (4.0, [(3.0, 1.0), (3.0, 3.0)]),
+        ])
+
+    def test_exact_multiple_has_no_empty_tail(self):
+        pieces = list(segments([(0.0, 0.0), (8.0, 0.0)], 4.0))
+        self.assertEqual([offset for offset, _ in pieces], [0.0, 4.0])
+
+    def test_short_line_is_one_piece(self):
+        self.assertEqual(
+            list(segments([(0.0, 0.0), (1.0, 1.0)], 4.0)),
+            [(0.0, [(0.0, 0.0), (1.0, 1.0)])],
+        )
+
+
+class GeohashTests(SimpleTestCase):
+
+    def test_known_geohash(self):
+        geohash, _ = geohash_cell(-5.6, 42.6, 5)
+        self.assertEqual(geohash, 'ezs42')
+
+    def test_cell_contains_point(self):
+        lng, lat = -6.2603, 53.3498
+        geohash, (min_lng, min_lat, max_lng, max_lat) = geohash_cell(lng, lat, 6)
+        self.assertEqual(len(geohash), 6)
+        self.assertTrue(min_lng <= lng < max_lng)
+        self.assertTrue(min_lat <= lat < max_lat)
+
+    def test_longer_hash_refines_cell(self):
+        coarse, _ = geohash_cell(-6.2603, 53.3498, 4)
+        fine, _ = geohash_cell(-6.2603, 53.3498, 7)
+        self.assertTrue(fine.startswith(coarse))
+
+
+class CompetitionGridTests(SimpleTestCase):
+
+    def test_disc_bands(self):
+        self.assertEqual(disc_bands(0), [(0, 0, 0)])
+        self.assertEqual(disc_bands(1), [(-1, -1, 0), (0, 0, 1), (1, 1, 0)])
+        # Rows -1..1 all reach one cell sideways, so they merge into one band
+        self.assertEqual(disc_bands(1.5), [(-1, 1, 1)])
+
+    def test_disc_bands_cover_the_disc(self):
+        radius = 3.7
+        covered = {
+            (dy, dx)
+            for first, last, half_width in disc_bands(radius)
+            for dy in range(first, last + 1)
+            for dx in range(-half_width, half_width + 1)
+        }
+        expected = {
+            (dy, dx)
+            for dy in range(-4, 5)
+            for dx in range(-4, 5)
+            if dx * dx + dy * dy <= radius * radius
+        }
+        self.assertEqual(covered, expected)
+
+    def test_count_grid_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        cell, radius = 100.0, 250.0
+        n_cols, n_rows = 12, 9
+        xs = rng.uniform(-400, n_cols * cell + 400, 300)
+        ys = rng.uniform(-400, n_rows * cell + 400, 300)
+
+        counts = count_grid(xs, ys, 0.0, 0.0, n_cols, n_rows, cell, radius)
+
+        # Points are snapped to their cell centre before the radius test
+        px = (np.floor(xs / cell) + 0.5) * cell
+        py = (np.floor(ys / cell) + 0.5) * cell
+        expected = np.zeros((n_rows, n_cols), dtype=np.int64)
+        for row in range(n_rows):
+            for col in range(n_cols):
+                cx, cy = (col + 0.5) * cell, (row + 0.5) * cell
+                expected[row, col] = np.sum(np.hypot(px - cx, py - cy) <= radius + 1e-9)
+        np.testing.assert_array_equal(counts, expected)
+
+    def test_count_grid_without_points(self):
+        counts = count_grid([], [], 0.0, 0.0, 3, 2, 1.0, 2.0)
+        np.testing.assert_array_equal(counts, np.zeros((2, 3), dtype=np.int64))
+
+
+def _square(x0, y0, x1, y1):
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+
+
+# Two unit squares sharing the edge x = 1
+TWO_SQUARES = [
+    (1, {'name_en': 'West'}, [[_square(0.0, 0.0, 1.0, 1.0)]]),
+    (2, {'name_en': 'East'}, [[_square(1.0, 0.0, 2.0, 1.0)]]),
+]
+
+
+class CountyTopologyTests(SimpleTestCase):
+
+    def tearDown(self):
+        county_topology.reset()
+
+    def test_junctions(self):
+        west = [(0, 0), (1, 0), (1, 1), (0, 1)]
+        east = [(1, 0), (2, 0), (2, 1), (1, 1)]
+        self.assertEqual(_junctions([west, east]), {(1, 0), (1, 1)})
+
+    def test_ring_without_neighbours_has_no_junctions(self):
+        self.assertEqual(_junctions([[(0, 0), (1, 0), (1, 1), (0, 1)]]), set())
+
+    def test_shared_border_is_one_arc(self):
+        topo = Topology(TWO_SQUARES, 1001)
+        # The shared edge plus the outer part of each square
+        self.assertEqual(len(topo.arcs), 3)
+        west_refs = topo.objects[0][2][0][0]
+        east_refs = topo.objects[1][2][0][0]
+        shared = {ref if ref >= 0 else ~ref for ref in west_refs} & {
+            ref if ref >= 0 else ~ref for ref in east_refs
+        }
+        self.assertEqual(len(shared), 1)
+        # ...traversed in opposite directions
+        [arc] = shared
+        self.assertEqual((arc in west_refs), (~arc in east_refs))
+
+    def test_empty_topology(self):
+        topo = Topology([], 1001)
+        self.assertEqual(topo.arcs, [])
+        self.assertEqual(topo.objects, [])
+
+    def test_simplify_open_arc_keeps_endpoints(self):
+        topo = Topology(TWO_SQUARES, 1001)
+        arc = [(0, 0), (250, 1), (500, 0), (1000, 0)]
+        self.assertEqual(_simplify_arc(topo, arc, 0.01), [(0, 0), (1000, 0)])
+        self.assertEqual(_simplify_arc(topo, arc, 0), arc)
+
+    def test_simplify_keeps_points_beyond_tolerance(self):
+        topo = Topology(TWO_SQUARES, 1001)
+        arc = [(0, 0), (500, 400), (1000, 0)]
+        self.assertEqual(_simplify_arc(topo, arc, 0.1), arc)
+
+    def test_simplify_drops_small_closed_arc(self):
+        topo = Topology(TWO_SQUARES, 1001)
+        ring = [(0, 0), (2, 0), (2, 2), (0, 2), (0, 0)]
+        self.assertIsNone(_simplify_arc(topo, ring, 0.5))
+
+    def test_simplify_closed_arc_stays_a_ring(self):
+        topo = Topology(TWO_SQUARES, 1001)
+        ring = [(0, 0), (1000, 0), (1000, 1000), (0, 1000), (0, 0)]
+        simplified = _simplify_arc(topo, ring, 0.01)
+        self.assertGreaterEqual(len(simplified), 4)
+        self.assertEqual(simplified[0], simplified[-1])
+
+    @override_settings(COUNTY_LOD_TOLERANCES=(10.0, 0.0))
+    def test_geojson_rings_have_four_positions(self):
+        county_topology._topology = Topology(TWO_SQUARES, 1001)
+
+        # Full detail: both squares survive as closed rings
+        fine = json.loads(county_topology.render_geojson(1))
+        for feature in fine['features']:
+            [[ring]] = feature['geometry']['coordinates']
+            self.assertEqual(len(ring), 5)
+            self.assertEqual(ring[0], ring[-1])
+
+        # Every arc collapses to its endpoints: A, B, A is not a ring
+        coarse = json.loads(county_topology.render_geojson(0))
+        self.assertEqual([f['geometry']['coordinates'] for f in coarse['features']], [[], []])
+
+
+class PointLayerTests(SimpleTestCase):
+
+    def _decode(self, data):
+        self.assertEqual(data[:4], MAGIC)
+        (length,) = struct.unpack('<I', data[4:8])
+        return json.loads(data[8:8 + length])
+
+    def test_encode_groups_points_by_cell(self):
+        lngs = [-6.25, -6.24, -8.5]
+        lats = [53.35, 53.34, 51.9]
+        columns = [
+            ('id', 'string', ['a', 'b', 'c']),
+            ('brand', 'dict', ['Shell', None, 'Shell']),
+            ('population', 'int32', [10, None, 30]),
+        ]
+        data = encode(lngs, lats, columns, 0.25)
+        header = self._decode(data)
+
+        self.assertEqual(header['count'], 3)
+        self.assertEqual(header['dictionaries'], {'brand': ['Shell']})
+        self.assertEqual(sum(group[3] for group in header['groups']), 3)
+        self.assertEqual(len(header['groups']), 2)
+
+        groups_lngs = []
+        for cell, offset, length, count in header['groups']:
+            self.assertEqual(offset % 8, 0)
+            self.assertEqual(length % 8, 0)
+            lng32 = np.frombuffer(data, dtype='<f4', count=count, offset=offset)
+            groups_lngs.extend(lng32.tolist())
+        self.assertEqual(
+            sorted(round(v, 4) for v in groups_lngs), sorted(round(v, 4) for v in lngs)
+        )
+
+    def test_encode_empty_layer(self):
+        header = self._decode(encode([], [], [('id', 'string', [])], 0.25))
+        self.assertEqual(header['count'], 0)
+        self.assertEqual(header['groups'], [])
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_parse_range_ignored(self):
+        self.assertIsNone(parse_range(None, 1000))
+        self.assertIsNone(parse_range('items=0-1', 1000))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_range('bytes=a-b', 1000))
+        self.assertIsNone(parse_range('bytes=50-10', 1000))
+
+    def test_parse_range_unsatisfiable(self):
+        self.assertEqual(parse_range('bytes=1000-', 1000), 'unsatisfiable')
+        self.assertEqual(parse_range('bytes=-0', 1000), 'unsatisfiable')
+
+
+class ClusterLevelTests(SimpleTestCase):
+
+    def test_parent_merges_sibling_cells(self):
+        level = Level(
+            cx=np.array([0, 1, 2, 5], dtype=np.int64),
+            cy=np.array([0, 1, 1, 4], dtype=np.int64),
+            count=np.array([1, 2, 3, 1], dtype=np.int64),
+            lng_sum=np.array([1.0, 4.0, 9.0, 7.0]),
+            lat_sum=np.array([2.0, 2.0, 3.0, 5.0]),
+            member=np.array([0, 1, 3, 6], dtype=np.int64),
+        )
+        parent = level.parent()
+        cells = {
+            (int(x), int(y)): (int(c), float(lng), float(lat))
+            for x, y, c, lng, lat in zip(parent.cx, parent.cy, parent.count, parent.lng, parent.lat)
+        }
+        self.assertEqual(cells, {
+            (0, 0): (3, 5.0 / 3, 4.0 / 3),
+            (1, 0): (3, 3.0, 1.0),
+            (2, 2): (1, 7.0, 5.0),
+        })
+
+    def test_parent_of_parent(self):
+        level = Level(
+            cx=np.array([0, 3], dtype=np.int64),
+            cy=np.array([0, 3], dtype=np.int64),
+            count=np.array([1, 1], dtype=np.int64),
+            lng_sum=np.array([0.0, 2.0]),
+            lat_sum=np.array([0.0, 2.0]),
+            member=np.array([0, 1], dtype=np.int64),
+        )
+        top = level.parent().parent()
+        self.assertEqual(len(top), 1)
+        self.assertEqual(int(top.count[0]), 2)
+        self.assertEqual((float(top.lng[0]), float(top.lat[0])), (1.0, 1.0))
@@ -5,6 +5,7 @@ urlpatterns = [
     path('', views.hello_map, name='hello_map'),
     path('carwashes.geojson', views.carwash_geojson, name='carwash_geojson'),
     path('counties.geojson', views.counties_geojson, name='counties_geojson'),
+    path('tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt', views.vector_tile, name='vector_tile'),
     path('nearest_carwash/', views.nearest_carwash, name='nearest_carwash'),
     path('nearby_carwashes/', views.nearby_carwashes, name='nearby_carwashes'),
     path('county_wash_counts/', views.county_wash_counts, name='county_wash_counts'),
@@ -0,0 +1,364 @@
+"""
+Mapbox Vector Tiles for the car wash, county and settlement layers.
+
+/tiles/<layer>/<z>/<x>/<y>.mvt is built by PostGIS: ST_AsMVTGeom clips
+and quantises each feature to the tile, and ST_AsMVT encodes them. Only
+rows whose geometry overlaps the tile are read (GiST index on the
+geometry column), so a tile costs the same however large the layer is.
+
+Tiles up to TILE_CACHE_MAX_ZOOM are kept on disk under TILE_CACHE_DIR as
+<layer>/<z>/<x>/<y>.mvt. Next to them, <layer>/state.json records the
+dataset version the tiles were rendered from, and each feature's position
+and a digest of its properties. When the dataset version changes (e.g. an
+Overpass refresh), sync_layer() compares that snapshot with the table. It
+deletes only the cached tiles that contain an added, removed, moved or
+edited feature, and then records the new snapshot. It runs when the car
+washes change (osm_import.carwashes_changed, once the import commits) and
+from the refresh_tiles command, which also pre-renders the low zoom
+levels. The first tile request that sees a version no sync has recorded
+yet (e.g. after bump_dataset_version) runs it as a fallback.
+
+Syncs and clears hold an exclusive lock on <layer>.lock, so only one
+process rewrites a layer at a time, and then touch <layer>.generation.
+A worker only writes a freshly rendered tile back to the cache if the
+generation has not moved since it started rendering; otherwise the tile
+may show data that a sync has just invalidated. The lock uses fcntl and
+is per-process only where that is unavailable (Windows).
+
+Counties have no dataset version. Their tiles are only dropped by
+refresh_tiles --clear, after a boundary import.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from .dataset_version import CARWASH, POPULATION, current_version
+from .models import IrishCounty, Location, PopulationPoint
+
+try:
+    import fcntl
+except ImportError:  # Windows: the per-process lock only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# Tile coordinate space and the margin features are kept in around it
+EXTENT = 4096
+BUFFER = 64
+
+# layer -> (model, geometry field, properties, dataset or None)
+LAYERS = {
+    'carwashes': (
+        Location, 'point',
+        ('id', 'name', 'brand', 'operator', 'automated', 'self_service'),
+        CARWASH,
+    ),
+    'counties': (
+        IrishCounty, 'geom',
+        ('id', 'name_en', 'name_ga', 'alt_name'),
+        None,
+    ),
+    'settlements': (
+        PopulationPoint, 'point',
+        ('id', 'name', 'population', 'place'),
+        POPULATION,
+    ),
+}
+
+TILE_SQL = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom,
+               ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s) AS clip
+    )
+    SELECT ST_AsMVT(tile, %(layer)s, %(extent)s, 'geom')
+    FROM (
+        SELECT ST_AsMVTGeom(ST_Transform(t.{geometry}, 3857), bounds.geom,
+                            %(extent)s, %(buffer)s, true) AS geom,
+               {properties}
+        FROM {table} t, bounds
+        WHERE t.{geometry} && ST_Transform(bounds.clip, 4326)
+    ) tile
+    WHERE tile.geom IS NOT NULL
+"""
+
+EXTENT_SQL = "SELECT ST_Extent({geometry}) FROM {table}"
+
+# layer -> dataset version this worker last synced the cache to
+_synced_for = {}
+_sync_lock = threading.Lock()
+
+
+def _cache_dir():
+    return Path(getattr(settings, 'TILE_CACHE_DIR', Path(settings.BASE_DIR) / 'cache' / 'tiles'))
+
+
+def _cache_max_zoom():
+    return getattr(settings, 'TILE_CACHE_MAX_ZOOM', 14)
+
+
+def _columns(layer):
+    model, geometry_field, properties, _ = LAYERS[layer]
+    opts = model._meta
+    quote = connection.ops.quote_name
+    return (
+        quote(opts.db_table),
+        quote(opts.get_field(geometry_field).column),
+        [(name, quote(opts.get_field(name).column)) for name in properties],
+    )
+
+
+def tile_path(layer, z, x, y):
+    return _cache_dir() / layer / str(z) / str(x) / f'{y}.mvt'
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= getattr(settings, 'TILE_MAX_ZOOM', 18) and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def render_tile(layer, z, x, y) -> bytes:
+    """Encode one tile with ST_AsMVT (empty bytes if no feature touches it)."""
+    table, geometry, properties = _columns(layer)
+    sql = TILE_SQL.format(
+        table=table,
+        geometry=geometry,
+        properties=', '.join(f'{column} AS "{name}"' for name, column in properties),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'z': z, 'x': x, 'y': y,
+            'layer': layer,
+            'extent': EXTENT,
+            'buffer': BUFFER,
+            'margin': BUFFER / EXTENT,
+        })
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b''
+
+
+def _write(path, data):
+    # Write to a temporary file and rename it, so readers never see half a tile
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _layer_lock(layer, exclusive):
+    """Cross-process lock on a layer's cache: exclusive to rewrite it, shared to add tiles."""
+    if fcntl is None:
+        yield
+        return
+    path = _cache_dir() / f'{layer}.lock'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _generation(layer):
+    try:
+        return (_cache_dir() / f'{layer}.generation').stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _bump_generation(layer):
+    _write(_cache_dir() / f'{layer}.generation', str(time.time_ns()).encode())
+
+
+def _store(layer, path, data, generation):
+    """Cache a rendered tile unless the layer was synced or cleared meanwhile."""
+    with _layer_lock(layer, exclusive=False):
+        if _generation(layer) != generation:
+            return False
+        _write(path, data)
+        return True
+
+
+def get_tile(layer, z, x, y) -> bytes:
+    """The tile's bytes, from the disk cache when possible."""
+    ensure_synced(layer)
+    path = tile_path(layer, z, x, y)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    generation = _generation(layer)
+    data = render_tile(layer, z, x, y)
+    if z <= _cache_max_zoom():
+        _store(layer, path, data, generation)
+    return data
+
+
+def _feature_snapshot(layer):
+    """{id: [lng, lat, digest]} for every feature of a point layer."""
+    model, geometry_field, properties, _ = LAYERS[layer]
+    snapshot = {}
+    for row in model.objects.values_list(geometry_field, *properties).iterator():
+        point, values = row[0], row[1:]
+        digest = hashlib.md5(json.dumps(values, default=str).encode()).hexdigest()
+        snapshot[str(values[0])] = [point.x, point.y, digest]
+    return snapshot
+
+
+def tiles_touching(lng, lat, z):
+    """
+    Tiles at zoom z whose buffered area contains the point, as (x, y)
+    pairs: the tile it is in, plus neighbours when it lies within the
+    buffer of an edge.
+    """
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    fx = (lng + 180.0) / 360.0 * n
+    fy = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    margin = BUFFER / EXTENT
+    xs = {min(max(int(math.floor(fx + d)), 0), n - 1) for d in (-margin, 0, margin)}
+    ys = {min(max(int(math.floor(fy + d)), 0), n - 1) for d in (-margin, 0, margin)}
+    return {(x, y) for x in xs for y in ys}
+
+
+def _state_path(layer):
+    return _cache_dir() / layer / 'state.json'
+
+
+def _state_version(layer):
+    try:
+        return json.loads(_state_path(layer).read_text())['version']
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def clear_layer(layer):
+    """Delete every cached tile of a layer."""
+    with _layer_lock(layer, exclusive=True):
+        shutil.rmtree(_cache_dir() / layer, ignore_errors=True)
+        _bump_generation(layer)
+    _synced_for.pop(layer, None)
+
+
+def sync_layer(layer) -> int:
+    """
+    Bring a point layer's cache up to its dataset version by deleting the
+    tiles that show changed features. Returns the number deleted.
+    """
+    with _layer_lock(layer, exclusive=True):
+        return _sync_locked(layer)
+
+
+def _sync_locked(layer):
+    dataset = LAYERS[layer][3]
+    version = current_version(dataset)
+    snapshot = _feature_snapshot(layer)
+
+    try:
+        state = json.loads(_state_path(layer).read_text())
+    except (FileNotFoundError, ValueError):
+        state = None
+
+    deleted = 0
+    if state is None:
+        # No record of what the cached tiles show
+        shutil.rmtree(_cache_dir() / layer, ignore_errors=True)
+    elif state['version'] != version:
+        old = state['features']
+        changed = [
+            feature
+            for key in old.keys() | snapshot.keys()
+            if old.get(key) != snapshot.get(key)
+            for feature in (old.get(key), snapshot.get(key))
+            if feature is not None
+        ]
+        layer_dir = _cache_dir() / layer
+        zooms = [int(p.name) for p in layer_dir.iterdir() if p.is_dir() and p.name.isdigit()]
+        for z in zooms:
+            affected = set()
+            for lng, lat, _ in changed:
+                affected |= tiles_touching(lng, lat, z)
+            for x, y in affected:
+                try:
+                    tile_path(layer, z, x, y).unlink()
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        logger.info(
+            "%s tiles: %d features changed, %d cached tiles deleted", layer, len(changed), deleted
+        )
+
+    _write(_state_path(layer), json.dumps({'version': version, 'features': snapshot}).encode())
+    _bump_generation(layer)
+    _synced_for[layer] = version
+    return deleted
+
+
+def ensure_synced(layer):
+    """Run sync_layer() once per dataset version per worker."""
+    dataset = LAYERS[layer][3]
+    if dataset is None:
+        return
+    version = current_version(dataset)
+    if _synced_for.get(layer) == version:
+        return
+
+    if _state_version(layer) == version:
+        _synced_for[layer] = version
+        return
+
+    with _sync_lock, _layer_lock(layer, exclusive=True):
+        # Another thread or process may have synced while this one waited
+        if _state_version(layer) == version:
+            _synced_for[layer] = version
+        else:
+            _sync_locked(layer)
+
+
+def seed_layer(layer, max_zoom) -> int:
+    """
+    Render and cache every tile from zoom 0 to max_zoom that overlaps the
+    layer's extent. Returns the number of tiles rendered.
+    """
+    ensure_synced(layer)
+    table, geometry, _ = _columns(layer)
+    with connection.cursor() as cursor:
+        cursor.execute(EXTENT_SQL.format(table=table, geometry=geometry))
+        extent = cursor.fetchone()[0]
+    if not extent:
+        return 0
+
+    # BOX(min_lng min_lat,max_lng max_lat)
+    (min_lng, min_lat), (max_lng, max_lat) = (
+        map(float, corner.split()) for corner in extent[4:-1].split(',')
+    )
+
+    rendered = 0
+    generation = _generation(layer)
+    for z in range(max_zoom + 1):
+        xs = {x for x, _ in tiles_touching(min_lng, max_lat, z) | tiles_touching(max_lng, min_lat, z)}
+        ys = {y for _, y in tiles_touching(min_lng, max_lat, z) | tiles_touching(max_lng, min_lat, z)}
+        for x in range(min(xs), max(xs) + 1):
+            for y in range(min(ys), max(ys) + 1):
+                path = tile_path(layer, z, x, y)
+                if not path.exists():
+                    if not _store(layer, path, render_tile(layer, z, x, y), generation):
+                        # Synced or cleared by another process; its tiles are newer
+                        return rendered
+                    rendered += 1
+    return rendered
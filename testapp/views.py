@@ -1,16 +1,12 @@
-from .models import PopulationPoint
 from django.shortcuts import render
 from django.http import JsonResponse
-from django.contrib.gis.geos import Point
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
 import django
 from django.db import connection
-from .models import Location, TestArea, IrishCounty
-from django.core.serializers import serialize
-from django.http import HttpResponse
-from django.contrib.gis.db.models.functions import Distance
+from .models import Location, TestArea
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.db.models import Count
 from django.contrib.gis.db.models import GeometryField
 from django.contrib.gis.geos import GEOSGeometry
@@ -23,6 +19,7 @@ from django.urls import reverse_lazy
 from django.views.generic import CreateView
 from django.contrib.auth.decorators import login_required
 from .forms import LoginForm, SignUpForm
+from . import county_rollup, geojson_snapshots, geojson_stream, itm, recommendations, result_cache, vector_tiles
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.utils.decorators import method_decorator
 
@@ -45,26 +42,42 @@ def hello_map(request):
     return render(request, 'maps/hello_map.html', context)
 
 # GeoJSON API view for carwash locations
+def _stream_geojson(request, model, geometry_field, properties):
+    # Built by PostGIS and streamed (geojson_stream.py), in serialize('geojson') format
+    try:
+        precision = geojson_stream.parse_precision(request.GET.get('precision'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return StreamingHttpResponse(
+        geojson_stream.feature_collection(model, geometry_field, properties, precision, crs=True),
+        content_type='application/json',
+    )
+
+def _serve_snapshot(request, name):
+    # Prebuilt, precompressed file with conditional GET (geojson_snapshots.py);
+    # ?precision= still streams a fresh document
+    if request.GET.get('precision'):
+        model, geometry_field, properties, _ = geojson_snapshots.LAYERS[name]
+        return _stream_geojson(request, model, geometry_field, properties)
+    return geojson_snapshots.snapshot_response(request, name)
+
 def carwash_geojson(request):
-    qs = Location.objects.all()
-    geojson = serialize('geojson', qs, geometry_field='point', fields=(
-        'name', 'brand', 'amenity', 'operator', 'address', 'building', 'automated', 'self_service', 'note'))
-    return HttpResponse(geojson, content_type='application/json')
+    return _serve_snapshot(request, 'carwashes')
 
 def counties_geojson(request):
-    qs = IrishCounty.objects.all()
-    geojson = serialize('geojson', qs, geometry_field='geom', fields=(
-        'name_en', 'name_ga', 'alt_name', 'area', 'latitude', 'longitude'))
-    return HttpResponse(geojson, content_type='application/json')
+    return _serve_snapshot(request, 'counties')
+
+def vector_tile(request, layer, z, x, y):
+    # Mapbox Vector Tile, rendered by PostGIS and cached on disk (vector_tiles.py)
+    if layer not in vector_tiles.LAYERS or not vector_tiles.valid_tile(z, x, y):
+        raise Http404('No such tile')
+    return HttpResponse(vector_tiles.get_tile(layer, z, x, y), content_type=vector_tiles.CONTENT_TYPE)
 
 def nearest_carwash(request):
     try:
         lat = float(request.GET.get('lat'))
         lng = float(request.GET.get('lng'))
-        user_point = Point(lng, lat, srid=4326)
-        nearest = Location.objects.annotate(
-            distance=Distance('point', user_point)
-        ).order_by('distance').first()
+        nearest = next(iter(itm.nearest_carwashes(lng, lat, limit=1)), None)
         if nearest:
             return JsonResponse({
                 'location': {
@@ -74,7 +87,7 @@ def nearest_carwash(request):
                     'lng': nearest.point.x,
                     'address': f"{nearest.addr_street or ''}, {nearest.addr_city or ''}, {nearest.addr_postcode or ''}"
                 },
-                'distance': nearest.distance.km
+                'distance': nearest.distance_km
             })
         else:
             return JsonResponse({'location': None})
@@ -86,11 +99,8 @@ def nearby_carwashes(request):
     try:
         lat = float(request.GET.get('lat'))
         lng = float(request.GET.get('lng'))
-        user_point = Point(lng, lat, srid=4326)
         # Limit to 10 nearest car washes
-        nearby = Location.objects.annotate(
-            distance=Distance('point', user_point)
-        ).order_by('distance')[:10]
+        nearby = itm.nearest_carwashes(lng, lat, limit=10)
         carwashes = []
         for loc in nearby:
             carwashes.append({
@@ -99,7 +109,7 @@ def nearby_carwashes(request):
                 'lat': loc.point.y,
                 'lng': loc.point.x,
                 'address': f"{getattr(loc, 'addr_street', '')}, {getattr(loc, 'addr_city', '')}, {getattr(loc, 'addr_postcode', '')}",
-                'distance': loc.distance.km
+                'distance': loc.distance_km
             })
         return JsonResponse({'carwashes': carwashes})
     except Exception as e:
@@ -109,14 +119,13 @@ def nearby_carwashes(request):
 @login_required
 def county_wash_counts(request):
     try:
-        # For each county, count car washes whose point is within the county polygon
+        # Per-county totals from the precomputed rollup (one spatial join per refresh)
         counts = []
-        for county in IrishCounty.objects.all():
-            wash_count = Location.objects.filter(point__within=county.geom).count()
+        for row in county_rollup.county_counts():
             counts.append({
-                'id': county.id,
-                'name_en': county.name_en,
-                'wash_count': wash_count
+                'id': row['county_id'],
+                'name_en': row['county_name'],
+                'wash_count': row['wash_count']
             })
         return JsonResponse({'counts': counts})
     except Exception as e:
@@ -128,11 +137,8 @@ def nearby_populated_places(request):
     try:
         lat = float(request.GET.get('lat'))
         lng = float(request.GET.get('lng'))
-        user_point = Point(lng, lat, srid=4326)
         # Limit to 10 nearest populated places
-        nearby = PopulationPoint.objects.annotate(
-            distance=Distance('point', user_point)
-        ).order_by('distance')[:10]
+        nearby = itm.nearest_settlements(lng, lat, limit=10)
         places = []
         for place in nearby:
             places.append({
@@ -142,7 +148,7 @@ def nearby_populated_places(request):
                 'lng': place.point.x,
                 'population': place.population,
                 'place': place.place,
-                'distance': place.distance.km
+                'distance': place.distance_km
             })
         return JsonResponse({'places': places})
     except Exception as e:
@@ -155,43 +161,9 @@ def recommend_carwash_locations(request):
         county_id = request.GET.get('county_id')
         min_distance_km = float(request.GET.get('min_distance_km', 5))  # Minimum distance from existing car wash
         max_settlement_distance_km = float(request.GET.get('max_settlement_distance_km', 10))  # Max distance to settlement
-        # Get county polygon
-        county = IrishCounty.objects.get(id=county_id)
-        # Get all car washes in county
-        carwashes = Location.objects.filter(point__within=county.geom)
-        carwash_points = [cw.point for cw in carwashes]
-        # Get all settlements in county
-        settlements = PopulationPoint.objects.filter(point__within=county.geom)
-        # Candidate grid: use settlements as candidate points
-        candidates = []
-        for settlement in settlements:
-            # Distance to nearest car wash
-            if carwash_points:
-                distances = [settlement.point.distance(cw_point) for cw_point in carwash_points]
-                min_dist_km = min(distances) * 111  # Convert degrees to km (approx)
-            else:
-                min_dist_km = None
-            # Is candidate far enough from car washes?
-            if min_dist_km is not None and min_dist_km < min_distance_km:
-                continue
-            # Is candidate close enough to a settlement? (itself is a settlement)
-            # Optionally, check for other settlements nearby
-            nearby_settlements = PopulationPoint.objects.filter(
-                point__distance_lte=(settlement.point, max_settlement_distance_km / 111)
-            ).count()
-            candidates.append({
-                'id': settlement.id,
-                'name': settlement.name,
-                'lat': settlement.point.y,
-                'lng': settlement.point.x,
-                'population': settlement.population,
-                'place': settlement.place,
-                'min_distance_to_carwash_km': min_dist_km,
-                'nearby_settlements': nearby_settlements
-            })
-        # Rank by distance from nearest car wash (descending), then by population (descending)
-        candidates = sorted(candidates, key=lambda x: (x['min_distance_to_carwash_km'] or 0, x['population'] or 0), reverse=True)
-        return JsonResponse({'recommendations': candidates[:10]})
+        # Settlements are candidates; answers are memoised per county and parameters
+        candidates = result_cache.recommend_county(county_id, min_distance_km, max_settlement_distance_km)
+        return JsonResponse({'recommendations': candidates})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
     
@@ -204,44 +176,9 @@ def recommend_carwash_locations_circle(request):
         radius_km = float(request.GET.get('radius_km', 10))
         min_distance_km = float(request.GET.get('min_distance_km', 5))
         max_settlement_distance_km = float(request.GET.get('max_settlement_distance_km', 10))
-        # Create circle geometry (buffer in degrees)
-        # Buffer expects degrees, so convert km to degrees (approx 1 deg = 111 km)
-        buffer_deg = radius_km / 111.0
-        center = Point(lng, lat, srid=4326)
-        circle = center.buffer(buffer_deg)
-        # Get all car washes in circle
-        carwashes = Location.objects.filter(point__within=circle)
-        carwash_points = [cw.point for cw in carwashes]
-        # Get all settlements in circle
-        settlements = PopulationPoint.objects.filter(point__within=circle)
-        candidates = []
-        for settlement in settlements:
-            # Distance to nearest car wash
-            if carwash_points:
-                distances = [settlement.point.distance(cw_point) for cw_point in carwash_points]
-                min_dist_km = min(distances) * 111  # Convert degrees to km (approx)
-            else:
-                min_dist_km = None
-            # Is candidate far enough from car washes?
-            if min_dist_km is not None and min_dist_km < min_distance_km:
-                continue
-            # Optionally, check for other settlements nearby
-            nearby_settlements = PopulationPoint.objects.filter(
-                point__distance_lte=(settlement.point, max_settlement_distance_km / 111)
-            ).count()
-            candidates.append({
-                'id': settlement.id,
-                'name': settlement.name,
-                'lat': settlement.point.y,
-                'lng': settlement.point.x,
-                'population': settlement.population,
-                'place': settlement.place,
-                'min_distance_to_carwash_km': min_dist_km,
-                'nearby_settlements': nearby_settlements
-            })
-        # Rank by distance from nearest car wash (descending), then by population (descending)
-        candidates = sorted(candidates, key=lambda x: (x['min_distance_to_carwash_km'] or 0, x['population'] or 0), reverse=True)
-        return JsonResponse({'recommendations': candidates[:10]})
+        # Settlements within radius_km (great-circle) of the centre are candidates
+        candidates = recommendations.recommend_circle(lng, lat, radius_km, min_distance_km, max_settlement_distance_km)
+        return JsonResponse({'recommendations': candidates})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
 
@@ -255,64 +192,7 @@ def recommend_carwash_locations_polygon(request):
 
     min_distance_km = float(data.get("min_distance_km", 5))
 
-    # Get car washes inside polygon
-    carwashes = Location.objects.filter(point__within=polygon)
-    carwash_pts = [cw.point for cw in carwashes]
-
-    # Get settlements inside polygon
-    settlements = PopulationPoint.objects.filter(point__within=polygon)
-
-    if not settlements:
-        centroid = polygon.centroid
-        return JsonResponse({
-            "lat": centroid.y,
-            "lng": centroid.x,
-            "name": "Polygon Centroid",
-            "population": None,
-            "min_distance_to_carwash_km": None,
-            "nearby_settlements": settlements.count(),
-            "reason": "No settlements inside polygon, using centroid"
-        })
-
-    best = None
-    best_score = -1
-
-    for s in settlements:
-        if carwash_pts:
-            dist_km = min([s.point.distance(cw) * 111 for cw in carwash_pts])
-            if dist_km < min_distance_km:
-                continue
-        else:
-            dist_km = None
-
-        score = dist_km or 1000  # simple scoring
-
-        if score > best_score:
-            best = s
-            best_score = score
-
-    if best:
-        return JsonResponse({
-            "lat": best.point.y,
-            "lng": best.point.x,
-            "name": getattr(best, "name", "Unknown"),
-            "population": getattr(best, "population", None),
-            "min_distance_to_carwash_km": float(dist_km) if dist_km is not None else None,
-            "nearby_settlements": settlements.count(),
-            "reason": "Best settlement inside your polygon"
-        })
-
-    else:
-        centroid = polygon.centroid
-        return JsonResponse({
-            "lat": centroid.y,
-            "lng": centroid.x,
-            "name": "Polygon Centroid",
-            "population": None,
-            "min_distance_to_carwash_km": None,
-            "nearby_settlements": settlements.count(),
-            "reason": "No suitable settlement found, using polygon centroid"
-        })
+    return JsonResponse(recommendations.recommend_polygon(polygon, min_distance_km))
 
 
 @method_decorator(csrf_exempt, name='dispatch')